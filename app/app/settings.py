@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,13 +48,29 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.SlowQueryMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.PathScopedMiddleware',
+]
+
+# Only run for paths outside LEAN_MIDDLEWARE_PATHS, i.e. the admin (see
+# core.middleware.PathScopedMiddleware). The admin checks for these look at
+# MIDDLEWARE alone, hence the silenced checks.
+
+FULL_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+LEAN_MIDDLEWARE_PATHS = ('/api/',)
+
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
 
 ROOT_URLCONF = 'app.urls'
 
@@ -89,6 +106,68 @@ DATABASES = {
     }
 }
 
+# Read replicas, one `replica_<n>` alias per host in DB_REPLICA_HOSTS.
+# Safe-method requests read from a healthy replica whose lag is below
+# REPLICA_MAX_LAG seconds; clients are pinned to the primary for
+# REPLICA_PIN_SECONDS after a write.
+
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = dict(
+        DATABASES['default'],
+        HOST=host.strip(),
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+# Per-user sharding of recipe data, one `shard_<n>` alias per host in
+# DB_SHARD_HOSTS in addition to `default`. Assignments are cached per
+# process for SHARD_CACHE_SECONDS. See core.sharding.
+
+RECIPE_SHARDS = ['default']
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(','))):
+    DATABASES[f'shard_{index}'] = dict(DATABASES['default'], HOST=host.strip())
+    RECIPE_SHARDS.append(f'shard_{index}')
+SHARD_CACHE_SECONDS = float(os.environ.get('SHARD_CACHE_SECONDS', 5))
+
+DATABASE_ROUTERS = [
+    'core.db_routers.ShardRouter',
+    'core.db_routers.ReplicaRouter',
+]
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 5))
+
+
+# Caches
+# `default` is private to each process. `shared` holds what every web and
+# worker process must see, such as the slow-query statistics. It defaults to
+# a table on the primary (`manage.py createcachetable`); point
+# SHARED_CACHE_BACKEND/SHARED_CACHE_LOCATION at memcached to take that load
+# off the database.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': os.environ.get(
+            'SHARED_CACHE_BACKEND',
+            'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', 'shared_cache'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.environ.get('SHARED_CACHE_MAX_ENTRIES', 100000)
+            ),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -132,4 +211,133 @@ MEDIA_URL = '/media/'
 STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+
+# Response compression
+# Bodies smaller than this many bytes are sent uncompressed.
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+
+# Incremental sync
+# Tombstones older than this are compacted away; older cursors get a reset.
+
+CHANGELOG_RETENTION_DAYS = int(os.environ.get('CHANGELOG_RETENTION_DAYS', 30))
+
+
+# Server-sent change events (see recipe.events). Use
+# recipe.events.PostgresBroker when events are published by more than one
+# process, as with the purge worker.
+
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'recipe.events.LocalBroker')
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', 15))
+
+
+# Tag/ingredient autocomplete (see recipe.autocomplete)
+
+AUTOCOMPLETE_MAX_NAMES = int(os.environ.get('AUTOCOMPLETE_MAX_NAMES', 50000))
+AUTOCOMPLETE_MAX_USERS = int(os.environ.get('AUTOCOMPLETE_MAX_USERS', 1000))
+# How long a process trusts its copy of a user's name version; changes made
+# by other processes show up after at most this many seconds
+AUTOCOMPLETE_VERSION_SECONDS = float(
+    os.environ.get('AUTOCOMPLETE_VERSION_SECONDS', 2)
+)
+
+
+# Background deletion (see recipe.purge)
+# Rows deleted per transaction, and how long a running job may go without a
+# heartbeat before another worker takes it over.
+
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))
+PURGE_STALE_SECONDS = int(os.environ.get('PURGE_STALE_SECONDS', 300))
+
+
+# Request profiling (see core.profiling)
+# Off by default; when on, only requests with a signed X-Profile header or
+# picked by the sample rate are profiled.
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/vol/web/profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+
+
+# Slow-query log (see core.slow_queries)
+# A threshold of 0 disables it. EXPLAIN ANALYZE runs the statement again.
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(
+    os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+)
+SLOW_QUERY_EXPLAIN_ANALYZE = \
+    os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', '') == '1'
+
+
+# Batch endpoint (see core.batch)
+
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+
+
+# Idempotency-Key handling (see core.idempotency)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+IDEMPOTENCY_WAIT_SECONDS = float(
+    os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 5)
+)
+
+
+# Near-duplicate image detection (see recipe.image_hashes)
+# Images whose perceptual hashes differ in at most this many of 64 bits are
+# reported as duplicates.
+
+IMAGE_DUPLICATE_DISTANCE = int(os.environ.get('IMAGE_DUPLICATE_DISTANCE', 6))
+IMAGE_INDEX_MAX_USERS = int(os.environ.get('IMAGE_INDEX_MAX_USERS', 1000))
+IMAGE_INDEX_GLOBAL_TTL = int(os.environ.get('IMAGE_INDEX_GLOBAL_TTL', 300))
+
+
+# Buffered last_login updates (see user.activity)
+# At most this many seconds of logins are lost if a process is killed,
+# 0 writes last_login on every login.
+
+ACTIVITY_FLUSH_SECONDS = float(os.environ.get('ACTIVITY_FLUSH_SECONDS', 10))
+if sys.argv[1:2] == ['test']:
+    # Tests see every login in the database, the activity tests opt in
+    ACTIVITY_FLUSH_SECONDS = 0
+ACTIVITY_BUFFER_MAX_USERS = int(
+    os.environ.get('ACTIVITY_BUFFER_MAX_USERS', 10000)
+)
+
+
+# Per-request database budgets (see core.budgets)
+# Views pick an entry with query_budget / action_query_budgets; missing
+# limits come from 'default'. None or 0 disables a limit.
+
+QUERY_BUDGETS = {
+    'default': {
+        'max_ids': int(os.environ.get('QUERY_BUDGET_MAX_IDS', 100)),
+        'max_queries': int(os.environ.get('QUERY_BUDGET_MAX_QUERIES', 100)),
+        'statement_timeout_ms': int(
+            os.environ.get('QUERY_BUDGET_STATEMENT_TIMEOUT_MS', 3000)
+        ),
+    },
+    'bulk': {
+        'max_queries': 1000,
+        'statement_timeout_ms': 30000,
+    },
+    # Creating tags or ingredients, about a dozen statements whatever the
+    # number of names
+    'names': {
+        'max_queries': 30,
+    },
+    # Recipe writes, about 30 statements whatever the number of tags and
+    # ingredients
+    'write': {
+        'max_queries': 60,
+    },
+}
@@ -2,9 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from core.views import BatchView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('api/debug/', include('core.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
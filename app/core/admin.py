@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from core import models
@@ -24,5 +25,24 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class NamedForm(forms.ModelForm):
+    name = forms.CharField(max_length=255)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['name'] = self.instance.name
+
+    def save(self, commit=True):
+        self.instance.name = self.cleaned_data['name']
+        return super().save(commit)
+
+
+class TagAdmin(admin.ModelAdmin):
+    form = NamedForm
+    fields = ('name', 'user')
+    list_display = ['name', 'user']
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
+admin.site.register(models.Tag, TagAdmin)
@@ -0,0 +1,158 @@
+"""
+Several API calls in one round trip.
+
+``BatchView`` authenticates the batch once and runs each sub-request
+through the URL resolver with the batch's user forced onto it, so token
+lookup and the middleware stack are paid once. Sub-requests only reach
+``/api/`` views and never the batch endpoint itself. They inherit the
+batch's ``INHERITED_META`` only, not per-request headers such as
+``Idempotency-Key``.
+
+With ``parallel`` set, consecutive GET/HEAD sub-requests are run on a
+thread pool of ``BATCH_MAX_WORKERS`` threads, each using its own database
+connections with the batch's execute wrappers (query budget, slow query
+log) installed. This matters most under ASGI, where every sync view of the
+process otherwise shares a single thread. Writes always run one at a time
+in the order given, and a run of GETs never overtakes a write before it.
+"""
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD')
+_PREFIX = '/api/'
+INHERITED_META = (
+    'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL', 'REMOTE_ADDR',
+    'HTTP_HOST', 'HTTP_ACCEPT', 'HTTP_ACCEPT_LANGUAGE', 'HTTP_USER_AGENT',
+    'HTTP_AUTHORIZATION', 'HTTP_X_FORWARDED_FOR', 'HTTP_X_FORWARDED_HOST',
+    'HTTP_X_FORWARDED_PROTO',
+)
+
+
+def max_requests():
+    return getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+
+
+def build_request(request, item):
+    """WSGI request for one sub-request, carrying the batch's identity"""
+    url = urlsplit(item['path'])
+    body = b''
+    if item.get('body') is not None:
+        body = json.dumps(item['body']).encode()
+
+    environ = {
+        key: request.META[key] for key in INHERITED_META
+        if isinstance(request.META.get(key), str)
+    }
+    environ.update({
+        'REQUEST_METHOD': item['method'],
+        'PATH_INFO': url.path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+        'wsgi.url_scheme': request.scheme,
+    })
+    sub_request = WSGIRequest(environ)
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _decode(response):
+    content = b''.join(response) if response.streaming else response.content
+    if response.get('Content-Type', '').startswith('application/json') \
+            and content:
+        return json.loads(content)
+    return content.decode(response.charset or 'utf-8', 'replace')
+
+
+def dispatch(request, item):
+    """Run one sub-request and return its status, headers and body"""
+    path = urlsplit(item['path']).path
+    try:
+        match = resolve(path)
+    except Resolver404:
+        match = None
+    if match is None or not path.startswith(_PREFIX) or \
+            match.url_name == 'batch':
+        return {'status': 404, 'headers': {},
+                'body': {'detail': 'Not found.'}}
+
+    sub_request = build_request(request, item)
+    sub_request.resolver_match = match
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    except Exception:
+        logger.exception('Batch sub-request %s %s failed',
+                         item['method'], item['path'])
+        return {'status': 500, 'headers': {},
+                'body': {'detail': 'Internal server error.'}}
+    headers = {
+        name: value for name, value in response.items()
+        if name.lower() not in ('content-length', 'vary', 'allow')
+    }
+    return {'status': response.status_code, 'headers': headers,
+            'body': _decode(response)}
+
+
+def _execute_wrappers():
+    return {
+        alias: list(connections[alias].execute_wrappers)
+        for alias in connections
+    }
+
+
+def _dispatch_in_thread(context, request, item, wrappers):
+    try:
+        with ExitStack() as stack:
+            for alias, alias_wrappers in wrappers.items():
+                for wrapper in alias_wrappers:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(wrapper)
+                    )
+            return context.run(dispatch, request, item)
+    finally:
+        connections.close_all()
+
+
+def run(request, items, parallel=False):
+    results = [None] * len(items)
+    workers = getattr(settings, 'BATCH_MAX_WORKERS', 4)
+    if not parallel or workers < 2:
+        for index, item in enumerate(items):
+            results[index] = dispatch(request, item)
+        return results
+
+    wrappers = _execute_wrappers()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for index, item in enumerate(items):
+            if item['method'] in SAFE_METHODS:
+                pending[index] = executor.submit(
+                    _dispatch_in_thread, contextvars.copy_context(),
+                    request, item, wrappers
+                )
+                continue
+            for done, future in pending.items():
+                results[done] = future.result()
+            pending = {}
+            results[index] = dispatch(request, item)
+        for done, future in pending.items():
+            results[done] = future.result()
+    return results
@@ -0,0 +1,237 @@
+"""
+Per-request database budgets.
+
+Every DRF view runs under the budget named by its ``query_budget``
+attribute, or by ``action_query_budgets[action]`` for viewset actions,
+with the limits of that entry of ``settings.QUERY_BUDGETS`` over those of
+``default``:
+
+``max_ids``
+    IDs accepted in one comma separated filter, checked before parsing
+    (400).
+``max_queries``
+    Statements one request may execute (503). Savepoints do not count.
+    Recipe API writes run in one transaction (``ShardRoutingMixin``), so a
+    request refused halfway leaves nothing behind.
+``statement_timeout_ms``
+    Postgres ``statement_timeout`` of the request's statements. It is set
+    with the first statement on each connection and only changed when the
+    next request needs another value. A cancelled statement is answered
+    with a 503.
+
+A limit of ``None`` or 0 is not enforced. Every rejection is logged and
+counted per limit and view in ``BudgetRejection`` rows on the primary, so
+the counts cover every process. A request's rejections are written once its
+guard is removed, outside its transactions and budget, with one atomic
+``UPDATE`` each. Staff read the counters at ``/api/debug/query-budgets/``.
+"""
+import logging
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS, IntegrityError, OperationalError, connections,
+    transaction,
+)
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from core.models import BudgetRejection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT = 'default'
+MAX_IDS = 'max_ids'
+MAX_QUERIES = 'max_queries'
+STATEMENT_TIMEOUT = 'statement_timeout'
+QUERY_CANCELED = '57014'
+TRANSACTION_CONTROL = (
+    'BEGIN', 'SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ',
+)
+_UNKNOWN = object()
+
+_pending = ContextVar('budget_rejections', default=None)
+
+
+class QueryBudgetExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'This request needs too many database queries.'
+    default_code = 'query_budget_exceeded'
+
+
+class StatementTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'This request took too long in the database.'
+    default_code = 'statement_timeout'
+
+
+class Budget:
+
+    def __init__(self, name, max_ids=None, max_queries=None,
+                 statement_timeout_ms=None):
+        self.name = name
+        self.max_ids = max_ids
+        self.max_queries = max_queries
+        self.statement_timeout_ms = statement_timeout_ms
+
+
+def get_budget(name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    limits = dict(budgets.get(DEFAULT, {}))
+    limits.update(budgets.get(name, {}))
+    return Budget(name, **limits)
+
+
+def budget_name(view_class, action=None):
+    names = getattr(view_class, 'action_query_budgets', {})
+    return names.get(action) or getattr(view_class, 'query_budget', DEFAULT)
+
+
+def for_view(view):
+    """Budget of a DRF view instance"""
+    budget = getattr(view.request, 'query_budget', None)
+    if budget is None:
+        budget = get_budget(
+            budget_name(type(view), getattr(view, 'action', None))
+        )
+    return budget
+
+
+def _rejections():
+    return BudgetRejection.objects.using(DEFAULT_DB_ALIAS)
+
+
+def _count(limit, view, count=1):
+    counter = _rejections().filter(limit=limit, view=view[:255])
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if counter.update(count=F('count') + count):
+            return
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                _rejections().create(limit=limit, view=view[:255],
+                                     count=count)
+        except IntegrityError:
+            counter.update(count=F('count') + count)
+
+
+def record(limit, view):
+    """Count one rejection by limit of the view at dotted path view,
+    when the request's guard is removed if there is one
+    """
+    logger.warning('Request to %s exceeded its %s budget', view, limit)
+    pending = _pending.get()
+    if pending is not None:
+        pending.append((limit, view))
+    else:
+        _count(limit, view)
+
+
+def _flush(pending):
+    for (limit, view), count in Counter(pending).items():
+        try:
+            _count(limit, view, count)
+        except Exception:
+            logger.exception('Could not count %s rejections of %s',
+                             limit, view)
+
+
+def get_stats():
+    """Rejection counts, the most frequent first"""
+    return list(_rejections().order_by('-count', 'limit', 'view').values(
+        'limit', 'view', 'count'
+    ))
+
+
+def reset():
+    _rejections().delete()
+
+
+def _view_path(request):
+    match = getattr(request, 'resolver_match', None)
+    return match._func_path if match is not None else request.path
+
+
+def check_ids(view, value, name, limit=None):
+    """Reject a comma separated list with more than limit items, by
+    default the view's ``max_ids``, before it is parsed.
+    """
+    if limit is None:
+        limit = for_view(view).max_ids
+    if limit and value.count(',') >= limit:
+        record(MAX_IDS, _view_path(view.request))
+        raise ValidationError({name: f'At most {limit} IDs are allowed.'})
+
+
+def _set_statement_timeout(connection, cursor, timeout_ms):
+    raw = connection.connection
+    current = getattr(connection, '_budget_statement_timeout', None)
+    current_ms = current[1] if current and current[0] is raw else None
+    if (current_ms or None) == (timeout_ms or None):
+        return
+    if timeout_ms:
+        cursor.execute('SET statement_timeout = %s', [int(timeout_ms)])
+    else:
+        cursor.execute('RESET statement_timeout')
+    # A SET inside a transaction is undone by a rollback, so the value is
+    # only known in autocommit mode
+    connection._budget_statement_timeout = (
+        raw, _UNKNOWN if connection.in_atomic_block else timeout_ms
+    )
+
+
+class QueryGuard:
+    """Execute wrapper enforcing one request's budget on every connection,
+    including those of batch sub-requests run on other threads
+    """
+
+    def __init__(self, request, budget):
+        self.request = request
+        self.budget = budget
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Savepoints are neither counted nor refused, a request over its
+        # budget must still be able to roll back
+        if sql.startswith(TRANSACTION_CONTROL):
+            return execute(sql, params, many, context)
+        with self._lock:
+            self.count += 1
+            count = self.count
+        max_queries = self.budget.max_queries
+        if max_queries and count > max_queries:
+            if count == max_queries + 1:
+                record(MAX_QUERIES, _view_path(self.request))
+            raise QueryBudgetExceeded()
+        connection = context['connection']
+        if connection.vendor == 'postgresql':
+            _set_statement_timeout(
+                connection, context['cursor'].cursor,
+                self.budget.statement_timeout_ms
+            )
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if getattr(exc.__cause__, 'pgcode', None) != QUERY_CANCELED:
+                raise
+            record(STATEMENT_TIMEOUT, _view_path(self.request))
+            raise StatementTimeout() from exc
+
+
+def guard_connections(request, budget):
+    """Context manager applying budget to all connections and counting
+    the rejections once it exits
+    """
+    stack = ExitStack()
+    pending = []
+    stack.callback(_flush, pending)
+    stack.callback(_pending.reset, _pending.set(pending))
+    guard = QueryGuard(request, budget)
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(guard))
+    return stack
@@ -0,0 +1,152 @@
+"""
+Database routers.
+
+Replica routing: requests with a safe HTTP method are served from one of
+``settings.DATABASE_REPLICAS`` while writes always go to ``default``. To try
+it locally with two SQLite files, point ``default`` and a ``replica_0``
+alias at different files, run ``migrate`` against both and list
+``replica_0`` in ``DATABASE_REPLICAS``.
+
+Shard routing: per-user recipe data is sent to the user's shard, see
+``core.sharding``.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+from core import sharding
+
+
+_use_replica = ContextVar('use_replica', default=False)
+
+# Seconds since the last replayed transaction, or 0 on a primary and on a
+# replica that has replayed everything it received, which is the usual state
+# while the primary is idle
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - "
+    "pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+@contextmanager
+def read_from_replicas(enabled=True):
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaHealth:
+    """Track replica availability and replication lag, re-checking each
+    replica at most once per ``REPLICA_HEALTH_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+
+    def check(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                if connections[alias].vendor == 'postgresql':
+                    cursor.execute(REPLICA_LAG_SQL)
+                    lag = float(cursor.fetchone()[0])
+                else:
+                    cursor.execute('SELECT 1')
+                    lag = 0.0
+        except DatabaseError:
+            return False, None
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG', 5)
+        return lag <= max_lag, lag
+
+    def is_healthy(self, alias):
+        interval = getattr(settings, 'REPLICA_HEALTH_INTERVAL', 5)
+        now = time.monotonic()
+        with self._lock:
+            status = self._status.get(alias)
+        if status is None or now - status[0] > interval:
+            healthy, lag = self.check(alias)
+            with self._lock:
+                self._status[alias] = (now, healthy, lag)
+            return healthy
+        return status[1]
+
+    def healthy_replicas(self):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        return [alias for alias in replicas if self.is_healthy(alias)]
+
+    def reset(self):
+        with self._lock:
+            self._status.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get():
+            return None
+        # The shared cache table must not lag behind its writes
+        if model._meta.app_label == 'django_cache':
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        replicas = replica_health.healthy_replicas()
+        if not replicas:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS}
+        pool.update(getattr(settings, 'DATABASE_REPLICAS', []))
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ShardRouter:
+
+    def _is_sharded(self, model):
+        return model._meta.app_label == 'core' and \
+            model._meta.model_name in sharding.SHARDED_MODELS
+
+    def _shard_for(self, model, hints):
+        if not sharding.sharding_enabled() or not self._is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is None:
+            user_id = sharding.current_user_id()
+        if user_id is None:
+            return None
+        return sharding.shard_for_user(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._shard_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self._is_sharded(type(obj1)) or self._is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in sharding.get_shards():
+            return None
+        return app_label == 'core' and model_name in sharding.SHARDED_MODELS
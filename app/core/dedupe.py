@@ -0,0 +1,63 @@
+"""
+Merge tags and ingredients whose names only differ by case.
+
+Used by the migrations that add the case-insensitive unique indexes. Works
+on whatever model classes it is given so historical models from a
+migration can be passed in; ``key`` is the expression rows are grouped by,
+``lower(name)`` for models from before names were interned in ``Term``.
+"""
+from django.db import connections
+from django.db.models import F, Min, Window
+from django.db.models.functions import Lower
+
+
+BATCH_SIZE = 1000
+
+
+def duplicate_map(model, using, key=None):
+    """Return {duplicate id: id of the oldest row with the same name}"""
+    if key is None:
+        key = Lower('name')
+    ranked = model.objects.using(using).annotate(
+        keep=Window(Min('id'), partition_by=[F('user_id'), key])
+    ).values('id', 'keep')
+    # The ORM cannot filter on a window function, so the single grouped
+    # query is wrapped by hand
+    sql, params = ranked.query.sql_with_params()
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT id, keep FROM ({sql}) ranked WHERE id <> keep', params
+        )
+        return dict(cursor.fetchall())
+
+
+def merge_duplicates(model, through, column, using='default', key=None,
+                     recipe_ids=None):
+    """Point M2M rows at the kept row and delete the duplicates in bulk.
+
+    ``through`` is the recipe M2M model and ``column`` its foreign key
+    attribute for ``model`` (e.g. ``tag_id``). The IDs of recipes whose rows
+    were rewritten are added to the set ``recipe_ids`` if given.
+    """
+    mapping = duplicate_map(model, using, key)
+    duplicate_ids = list(mapping)
+    for start in range(0, len(duplicate_ids), BATCH_SIZE):
+        batch = duplicate_ids[start:start + BATCH_SIZE]
+        rows = through.objects.using(using).filter(
+            **{f'{column}__in': batch}
+        ).values_list('recipe_id', column)
+        if recipe_ids is not None:
+            recipe_ids.update(recipe_id for recipe_id, _ in rows)
+        through.objects.using(using).bulk_create(
+            [
+                through(**{'recipe_id': recipe_id, column: mapping[old_id]})
+                for recipe_id, old_id in set(rows)
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        through.objects.using(using).filter(
+            **{f'{column}__in': batch}
+        ).delete()
+        model.objects.using(using).filter(id__in=batch).delete()
+    return len(duplicate_ids)
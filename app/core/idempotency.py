@@ -0,0 +1,183 @@
+"""
+Idempotency-Key handling for POST endpoints.
+
+A view method decorated with ``idempotent`` claims ``(user, key)`` in the
+``IdempotencyKey`` table before running; the unique constraint makes the
+claim atomic across processes. Once the method returns, its status and
+rendered body are stored for ``IDEMPOTENCY_TTL_SECONDS`` and replayed to
+retries of the same request. A retry arriving while the first request
+still runs waits up to ``IDEMPOTENCY_WAIT_SECONDS`` for it and then gets a
+409. Reusing a key for a different request is a 422. Exceptions raised by
+the view and 5xx responses release the key so the request can be retried.
+
+A claim whose request died is taken over after ``IDEMPOTENCY_LOCK_SECONDS``.
+Expired rows are removed by ``manage.py purge_idempotency_keys``.
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from core.models import IdempotencyKey
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+POLL_INTERVAL = 0.1
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being ' \
+                     'processed, please retry shortly.'
+    default_code = 'idempotency_key_in_use'
+
+
+class IdempotencyKeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was used for a different request.'
+    default_code = 'idempotency_key_mismatch'
+
+
+def _feed(digest, value):
+    if isinstance(value, UploadedFile):
+        for chunk in value.chunks():
+            digest.update(chunk)
+        value.seek(0)
+    else:
+        digest.update(
+            json.dumps(value, sort_keys=True, default=str).encode()
+        )
+
+
+def request_hash(request):
+    """Hash of the method, path and parsed body, uploaded files included"""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    data = request.data
+    if hasattr(data, 'lists'):
+        for name, values in sorted(data.lists(), key=lambda item: item[0]):
+            digest.update(name.encode() + b'\0')
+            for value in values:
+                _feed(digest, value)
+    else:
+        _feed(digest, data)
+    return digest.hexdigest()
+
+
+def _records():
+    return IdempotencyKey.objects.using(DEFAULT_DB_ALIAS)
+
+
+def _lock_until():
+    return timezone.now() + timedelta(
+        seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+    )
+
+
+def claim(user_id, key, fingerprint):
+    """Return (record, True) if this request should run, else the record
+    of the request that already holds the key.
+    """
+    while True:
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                return _records().create(
+                    user_id=user_id, key=key, request_hash=fingerprint,
+                    expires_at=_lock_until()
+                ), True
+        except IntegrityError:
+            pass
+        record = _records().filter(user_id=user_id, key=key).first()
+        if record is None:
+            continue
+        if record.expires_at > timezone.now():
+            return record, False
+        taken = _records().filter(
+            pk=record.pk, expires_at=record.expires_at
+        ).update(
+            request_hash=fingerprint, response_status=None,
+            response_body='', expires_at=_lock_until()
+        )
+        if taken:
+            return _records().get(pk=record.pk), True
+
+
+def wait_for(record):
+    """Poll until the running request holding record has finished"""
+    deadline = time.monotonic() + getattr(
+        settings, 'IDEMPOTENCY_WAIT_SECONDS', 5
+    )
+    while record is not None and record.response_status is None:
+        if time.monotonic() >= deadline:
+            raise IdempotencyKeyInUse()
+        time.sleep(POLL_INTERVAL)
+        record = _records().filter(pk=record.pk).first()
+    return record
+
+
+def store(record, response):
+    body = ''
+    if response.data is not None:
+        body = JSONRenderer().render(response.data).decode()
+    _records().filter(pk=record.pk).update(
+        response_status=response.status_code,
+        response_body=body,
+        expires_at=timezone.now() + timedelta(
+            seconds=getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 86400)
+        )
+    )
+
+
+def replay(record):
+    data = json.loads(record.response_body) if record.response_body else None
+    response = Response(data, status=record.response_status)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(method):
+    """Run a DRF view method at most once per Idempotency-Key"""
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError(
+                {'Idempotency-Key': 'Must be at most 255 characters.'}
+            )
+
+        fingerprint = request_hash(request)
+        while True:
+            record, claimed = claim(request.user.pk, key, fingerprint)
+            if claimed:
+                break
+            if record.request_hash != fingerprint:
+                raise IdempotencyKeyMismatch()
+            record = wait_for(record)
+            if record is not None:
+                return replay(record)
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            _records().filter(pk=record.pk).delete()
+            raise
+        if response.status_code >= 500:
+            _records().filter(pk=record.pk).delete()
+        else:
+            store(record, response)
+        return response
+
+    return wrapper
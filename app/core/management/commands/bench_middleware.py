@@ -0,0 +1,73 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+
+SCOPED = 'core.middleware.PathScopedMiddleware'
+
+
+def build_handler(middleware):
+    with override_settings(MIDDLEWARE=middleware):
+        handler = BaseHandler()
+        handler.load_middleware()
+    return handler
+
+
+def time_requests(handler, path, count):
+    """Mean seconds per request through handler"""
+    factory = RequestFactory()
+    requests = [factory.get(path) for _ in range(count)]
+    with override_settings(ALLOWED_HOSTS=['*']):
+        started = time.perf_counter()
+        for request in requests:
+            handler.get_response(request)
+        return (time.perf_counter() - started) / count
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request overhead of the full and path-scoped ' \
+           'middleware stacks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='Alternate the stacks this many times and '
+                                 'keep the best round of each')
+        parser.add_argument('--path', default='/api/recipe/tags/',
+                            help='Path to request, unauthenticated API '
+                                 'requests need no database')
+
+    def handle(self, *args, **options):
+        scoped = list(settings.MIDDLEWARE)
+        full = [path for path in scoped if path != SCOPED] + \
+            list(getattr(settings, 'FULL_MIDDLEWARE', []))
+        count = options['requests']
+        handlers = {'full': build_handler(full),
+                    'scoped': build_handler(scoped)}
+        best = {}
+        # The 401s would otherwise be logged on every request
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        try:
+            for _ in range(options['rounds']):
+                for name, handler in handlers.items():
+                    elapsed = time_requests(handler, options['path'], count)
+                    best[name] = min(best.get(name, elapsed), elapsed)
+        finally:
+            request_logger.disabled = False
+
+        full_time, scoped_time = best['full'], best['scoped']
+        saved = full_time - scoped_time
+        self.stdout.write(f'{count} x GET {options["path"]}')
+        self.stdout.write(f'  full stack:   {full_time * 1e6:8.1f} us/request')
+        self.stdout.write(
+            f'  path-scoped:  {scoped_time * 1e6:8.1f} us/request'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'  saved:        {saved * 1e6:8.1f} us/request '
+            f'({saved / full_time:.0%})'
+        ))
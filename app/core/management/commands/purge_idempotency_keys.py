@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.using(DEFAULT_DB_ALIAS).filter(
+            expires_at__lte=timezone.now()
+        ).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} expired key(s)'
+        ))
@@ -0,0 +1,139 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from core import sharding
+from core.models import ShardAssignment, Tag, Ingredient, Recipe, \
+    ChangeLogEntry
+
+
+BATCH_SIZE = 500
+
+
+def copy_user_data(user_id, source, target):
+    """Copy a user's recipe data to another shard keeping primary keys"""
+    tag_through = Recipe.tags.through
+    ingredient_through = Recipe.ingredients.through
+    with transaction.atomic(using=target):
+        for model in (Tag, Ingredient, Recipe, ChangeLogEntry):
+            rows = list(model.objects.using(source).filter(user_id=user_id))
+            ids = [row.pk for row in rows]
+            if model.objects.using(target).filter(pk__in=ids).exists():
+                raise CommandError(
+                    f'{model.__name__} IDs of user {user_id} already exist '
+                    f'on {target}; shards must use disjoint ID ranges'
+                )
+            if model in (Tag, Ingredient):
+                model.intern_names(rows, target)
+            model.objects.using(target).bulk_create(
+                rows, batch_size=BATCH_SIZE
+            )
+        for through in (tag_through, ingredient_through):
+            rows = list(through.objects.using(source).filter(
+                recipe__user_id=user_id
+            ))
+            through.objects.using(target).bulk_create(
+                rows, batch_size=BATCH_SIZE
+            )
+
+
+def switch_user(user_id, target):
+    """Copy a user's data to target and route the user there, returning
+    the source shard, or None if the user already is on target
+    """
+    assignment = sharding.get_assignment(user_id)
+    source = assignment.alias
+    if source == target:
+        return None
+
+    # Refuse new writes, wait for those already past the check, then copy
+    # while reads keep hitting the source
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=assignment.pk
+    )
+    assignments.update(migrating=True)
+    try:
+        with sharding.drain_writers(user_id):
+            copy_user_data(user_id, source, target)
+            assignments.update(alias=target, migrating=False)
+    except Exception:
+        assignments.update(migrating=False)
+        raise
+    sharding.forget_user(user_id)
+    return source
+
+
+def delete_user_data(user_id, source):
+    """Delete a switched user's rows from its old shard"""
+    # Raw deletes skip the collector and the model signals, which would
+    # otherwise log the moved rows as deleted on the new shard
+    with transaction.atomic(using=source):
+        for through in (Recipe.tags.through, Recipe.ingredients.through):
+            through.objects.using(source).filter(
+                recipe__user_id=user_id
+            )._raw_delete(source)
+        for model in (Recipe, Tag, Ingredient, ChangeLogEntry):
+            model.objects.using(source).filter(
+                user_id=user_id
+            )._raw_delete(source)
+
+
+def wait_for_caches():
+    """Sleep until no process can read through an assignment cached
+    before a switch
+    """
+    time.sleep(sharding.cache_seconds())
+
+
+def move_user(user_id, target):
+    source = switch_user(user_id, target)
+    if source is None:
+        return False
+    wait_for_caches()
+    delete_user_data(user_id, source)
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Move users whose shard differs from their hash ring position'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only rebalance these users')
+        parser.add_argument('--to', dest='target',
+                            help='Move to this shard instead of the ring one')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        shards = sharding.get_shards()
+        target = options['target']
+        if target and target not in shards:
+            raise CommandError(f'Unknown shard {target}')
+
+        assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS)
+        if options['users']:
+            for user_id in options['users']:
+                sharding.get_assignment(user_id)
+            assignments = assignments.filter(user_id__in=options['users'])
+
+        ring = sharding.get_ring()
+        switched = []
+        for user_id, alias in assignments.values_list('user_id', 'alias'):
+            destination = target or ring.get_node(user_id)
+            if destination == alias:
+                continue
+            self.stdout.write(f'User {user_id}: {alias} -> {destination}')
+            if options['dry_run']:
+                continue
+            source = switch_user(user_id, destination)
+            if source is not None:
+                switched.append((user_id, source))
+
+        # One wait covers every user switched above
+        if switched:
+            wait_for_caches()
+        for user_id, source in switched:
+            delete_user_data(user_id, source)
+        self.stdout.write(
+            self.style.SUCCESS(f'Moved {len(switched)} user(s)')
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from core import slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Show the slowest statement fingerprints from the slow-query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--explain', action='store_true',
+                            help='Also print the captured plans')
+        parser.add_argument('--reset', action='store_true',
+                            help='Clear the collected statistics')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            slow_queries.reset()
+            self.stdout.write(self.style.SUCCESS('Slow-query log cleared'))
+            return
+        for stats in slow_queries.get_stats()[:options['limit']]:
+            average = stats['total_ms'] / stats['count']
+            self.stdout.write(
+                f"{stats['fingerprint']}  {stats['count']}x  "
+                f"total {stats['total_ms']:.1f} ms  avg {average:.1f} ms  "
+                f"max {stats['max_ms']:.1f} ms"
+            )
+            self.stdout.write(f"  {stats['sql']}")
+            for call_site, count in sorted(stats['call_sites'].items(),
+                                           key=lambda item: -item[1]):
+                self.stdout.write(f'  {count}x {call_site}')
+            if options['explain'] and stats['explain']:
+                for line in stats['explain'].splitlines():
+                    self.stdout.write(f'    {line}')
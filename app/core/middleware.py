@@ -0,0 +1,438 @@
+import gzip
+import hashlib
+import logging
+import random
+import re
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.cache import patch_vary_headers
+from django.utils.module_loading import import_string
+from rest_framework.views import APIView
+
+from core import budgets, profiling, slow_queries
+from core.db_routers import read_from_replicas
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+INCOMPRESSIBLE_TYPES = re.compile(
+    r'^(image|video|audio)/|^application/(zip|gzip|x-gzip|x-bzip2|'
+    r'x-7z-compressed|x-rar-compressed|pdf|octet-stream|zstd)|'
+    r'^font/woff2?$'
+)
+
+
+class _GzipStream:
+
+    def __init__(self):
+        self._obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+
+    def __init__(self):
+        self._obj = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdStream:
+
+    def __init__(self):
+        self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data) + self._obj.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def _compress_gzip(data):
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _compress_brotli(data):
+    return brotli.compress(data, quality=5)
+
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def available_encodings():
+    """Return the supported encodings in server preference order"""
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = (_compress_brotli, _BrotliStream)
+    if zstandard is not None:
+        encodings['zstd'] = (_compress_zstd, _ZstdStream)
+    encodings['gzip'] = (_compress_gzip, _GzipStream)
+    return encodings
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """Pick the best encoding the client accepts, honouring q-values"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+
+    best = None
+    for name in encodings:
+        quality = accepted.get(name, accepted.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (name, quality)
+    return best[0] if best else None
+
+
+class CompressionMiddleware:
+    """Compress responses with br, zstd or gzip depending on what the
+    client accepts. Small bodies and already-compressed media are sent
+    as-is, and streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.encodings = available_encodings()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def _should_skip(self, response):
+        if response.has_header('Content-Encoding'):
+            return True
+        content_type = response.get('Content-Type', '').lower()
+        if INCOMPRESSIBLE_TYPES.search(content_type):
+            return True
+        if content_type.startswith('text/event-stream'):
+            return True
+        if not response.streaming and len(response.content) < self.min_size:
+            return True
+        return False
+
+    def process_response(self, request, response):
+        if self._should_skip(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings
+        )
+        if encoding is None:
+            return response
+
+        compress, stream_class = self.encodings[encoding]
+        if response.streaming:
+            response.streaming_content = self._compress_stream(
+                request, response.streaming_content, stream_class(), encoding
+            )
+            del response['Content-Length']
+        else:
+            original_size = len(response.content)
+            started = time.process_time()
+            compressed = compress(response.content)
+            cpu_time = time.process_time() - started
+            if len(compressed) >= original_size:
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+            self._report(request, encoding, original_size,
+                         len(compressed), cpu_time)
+            response['Server-Timing'] = (
+                f'compress;desc="{encoding}";dur={cpu_time * 1000:.3f}'
+            )
+
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(
+                r'"$', f';{encoding}"', response['ETag']
+            )
+        response['Content-Encoding'] = encoding
+        return response
+
+    def _compress_stream(self, request, chunks, stream, encoding):
+        original_size = compressed_size = 0
+        cpu_time = 0.0
+        for chunk in chunks:
+            started = time.process_time()
+            data = stream.compress(chunk)
+            cpu_time += time.process_time() - started
+            original_size += len(chunk)
+            compressed_size += len(data)
+            if data:
+                yield data
+        started = time.process_time()
+        data = stream.finish()
+        cpu_time += time.process_time() - started
+        compressed_size += len(data)
+        yield data
+        self._report(request, encoding, original_size,
+                     compressed_size, cpu_time)
+
+    def _report(self, request, encoding, original_size, compressed_size,
+                cpu_time):
+        ratio = original_size / compressed_size if compressed_size else 0.0
+        logger.debug(
+            'compressed %s %s with %s: %d -> %d bytes '
+            '(ratio %.2f, cpu %.3f ms)',
+            request.method, request.path, encoding, original_size,
+            compressed_size, ratio, cpu_time * 1000,
+            extra={
+                'encoding': encoding,
+                'original_size': original_size,
+                'compressed_size': compressed_size,
+                'compression_ratio': ratio,
+                'compression_cpu_ms': cpu_time * 1000,
+            }
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """Serve safe-method requests from the read replicas. After a
+    successful write the client is pinned to the primary for
+    ``REPLICA_PIN_SECONDS`` so it always reads its own writes; the pin is
+    kept in the ``shared`` cache under the client's credentials, so every
+    process sees it, and mirrored in a cookie.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    pin_cookie = 'replica_pin'
+    pin_cache = 'shared'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def _pin_key(self, request):
+        credentials = request.META.get('HTTP_AUTHORIZATION') or \
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credentials:
+            return None
+        digest = hashlib.sha256(credentials.encode()).hexdigest()
+        return f'replica-pin:{digest}'
+
+    def is_pinned(self, request):
+        if request.COOKIES.get(self.pin_cookie):
+            return True
+        key = self._pin_key(request)
+        return key is not None and \
+            caches[self.pin_cache].get(key) is not None
+
+    def __call__(self, request):
+        if request.method not in self.SAFE_METHODS:
+            response = self.get_response(request)
+            if response.status_code < 400:
+                self.pin(request, response)
+            return response
+
+        with read_from_replicas(not self.is_pinned(request)):
+            return self.get_response(request)
+
+    def pin(self, request, response):
+        key = self._pin_key(request)
+        if key is not None:
+            caches[self.pin_cache].set(key, 1, self.pin_seconds)
+        response.set_cookie(
+            self.pin_cookie, '1', max_age=self.pin_seconds, httponly=True,
+            samesite='Lax'
+        )
+
+
+class ProfilingMiddleware:
+    """Profile requests that carry a signed ``X-Profile`` header or that
+    are picked by ``PROFILE_SAMPLE_RATE``, see ``core.profiling``.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        self.interval = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+
+    def _options(self, request):
+        header = request.META.get(profiling.HEADER)
+        if header:
+            return profiling.read_token(header)
+        if self.sample_rate and random.random() < self.sample_rate:
+            return {'memory': False}
+        return None
+
+    def __call__(self, request):
+        options = self._options(request)
+        if options is None:
+            return self.get_response(request)
+
+        tracer = profiling.MemoryTracer() if options.get('memory') else None
+        if tracer is not None and not tracer.start():
+            logger.info('Skipping memory profile of %s, another request is '
+                        'being traced', request.path)
+            tracer = None
+        profiler = profiling.SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+            allocations = tracer.stop() if tracer is not None else None
+        try:
+            name = profiling.save_profile(request, profiler, allocations)
+        except OSError:
+            logger.exception('Could not store profile of %s', request.path)
+        else:
+            response['X-Profile-Id'] = name
+        return response
+
+
+class SlowQueryMiddleware:
+    """Log statements slower than ``SLOW_QUERY_THRESHOLD_MS``, see
+    ``core.slow_queries``. A threshold of 0 turns the log off.
+    """
+
+    def __init__(self, get_response):
+        self.threshold_ms = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 200)
+        if self.threshold_ms <= 0:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with slow_queries.wrap_connections(request, self.threshold_ms):
+            return self.get_response(request)
+
+
+class QueryBudgetMiddleware:
+    """Hold each DRF view to its query budget, see ``core.budgets``.
+    Other views run without limits but still reset a statement timeout
+    left on the connection by an earlier request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            guard = request.__dict__.pop('_query_budget_guard', None)
+            if guard is not None:
+                guard.close()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is not None and issubclass(view_class, APIView):
+            actions = getattr(view_func, 'actions', None) or {}
+            budget = budgets.get_budget(budgets.budget_name(
+                view_class, actions.get(request.method.lower())
+            ))
+        else:
+            budget = budgets.Budget(None)
+        request.query_budget = budget
+        request._query_budget_guard = budgets.guard_connections(
+            request, budget
+        )
+
+
+class PathScopedMiddleware:
+    """Run ``FULL_MIDDLEWARE`` only for paths outside
+    ``LEAN_MIDDLEWARE_PATHS``. Token-authenticated API requests have no use
+    for sessions, CSRF, auth or messages, so they skip straight to
+    the view; the admin still gets the whole chain. Must be last in
+    ``MIDDLEWARE``, it builds the inner chain the way Django's handler does
+    and forwards the view, template response and exception hooks.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lean_paths = tuple(
+            getattr(settings, 'LEAN_MIDDLEWARE_PATHS', ('/api/',))
+        )
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(get_response)
+        for path in reversed(getattr(settings, 'FULL_MIDDLEWARE', [])):
+            try:
+                instance = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(instance, 'process_view'):
+                self._view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self._template_response_middleware.append(
+                    instance.process_template_response
+                )
+            if hasattr(instance, 'process_exception'):
+                self._exception_middleware.append(instance.process_exception)
+            handler = convert_exception_to_response(instance)
+        self.full_handler = handler
+
+    def is_lean(self, request):
+        return request.path_info.startswith(self.lean_paths)
+
+    def __call__(self, request):
+        if self.is_lean(request):
+            return self.get_response(request)
+        return self.full_handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_lean(request):
+            return None
+        for method in self._view_middleware:
+            response = method(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        if not self.is_lean(request):
+            for method in self._template_response_middleware:
+                response = method(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        if self.is_lean(request):
+            return None
+        for method in self._exception_middleware:
+            response = method(request, exception)
+            if response is not None:
+                return response
+        return None
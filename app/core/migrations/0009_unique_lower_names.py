@@ -0,0 +1,41 @@
+from django.db import migrations
+
+from core.dedupe import merge_duplicates
+
+
+def merge_existing_duplicates(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    using = schema_editor.connection.alias
+    merge_duplicates(
+        apps.get_model('core', 'Tag'), Recipe.tags.through, 'tag_id', using
+    )
+    merge_duplicates(
+        apps.get_model('core', 'Ingredient'), Recipe.ingredients.through,
+        'ingredient_id', using
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_changelog'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_existing_duplicates, migrations.RunPython.noop,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX core_tag_user_lower_name_uniq '
+            'ON core_tag (user_id, lower(name))',
+            'DROP INDEX core_tag_user_lower_name_uniq',
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX core_ingredient_user_lower_name_uniq '
+            'ON core_ingredient (user_id, lower(name))',
+            'DROP INDEX core_ingredient_user_lower_name_uniq',
+            hints={'model_name': 'ingredient'},
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+INDEXES = (
+    ('core_tag', 'core_tag_user_name_prefix_idx'),
+    ('core_ingredient', 'core_ingredient_user_name_prefix_idx'),
+)
+
+
+def create_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX {name} ON {table} '
+            f'(user_id, lower(name) varchar_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_unique_lower_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_prefix_indexes, drop_prefix_indexes,
+            hints={'model_name': 'tag'},
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_name_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.IntegerField(db_index=True)),
+                ('scope', models.CharField(choices=[('user', 'User'), ('recipes', 'Recipes')], max_length=16)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('max_recipe_id', models.IntegerField(null=True)),
+                ('total_recipes', models.IntegerField(default=0)),
+                ('deleted_recipes', models.IntegerField(default=0)),
+                ('deleted_tags', models.IntegerField(default=0)),
+                ('deleted_ingredients', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('heartbeat_at', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
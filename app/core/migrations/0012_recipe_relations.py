@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_purgejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='relations',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,142 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+import core.models
+from core.dedupe import merge_duplicates
+
+
+BATCH_SIZE = 1000
+NAME_TABLES = ('core_tag', 'core_ingredient')
+
+
+def drop_name_indexes(apps, schema_editor):
+    for table in NAME_TABLES:
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {table}_user_lower_name_uniq'
+        )
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {table}_user_name_prefix_idx'
+        )
+
+
+def create_name_indexes(apps, schema_editor):
+    for table in NAME_TABLES:
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX {table}_user_lower_name_uniq '
+            f'ON {table} (user_id, lower(name))'
+        )
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(
+                f'CREATE INDEX {table}_user_name_prefix_idx ON {table} '
+                f'(user_id, lower(name) varchar_pattern_ops)'
+            )
+
+
+def rebuild_relations(Recipe, recipe_ids, using):
+    """Recompute ``Recipe.relations`` (see recipe.read_model) of recipes
+    whose tags or ingredients were merged
+    """
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        relations = {pk: {'tags': [], 'ingredients': []} for pk in batch}
+        for name, related in (('tags', 'tag'), ('ingredients', 'ingredient')):
+            rows = getattr(Recipe, name).through.objects.using(using).filter(
+                recipe_id__in=batch
+            ).values_list(
+                'recipe_id', f'{related}_id', f'{related}__term__value'
+            ).order_by(f'{related}_id')
+            for recipe_id, pk, value in rows:
+                relations[recipe_id][name].append({'id': pk, 'name': value})
+        Recipe.objects.using(using).bulk_update(
+            [Recipe(pk=pk, relations=value)
+             for pk, value in relations.items()],
+            ['relations'], batch_size=BATCH_SIZE
+        )
+
+
+def intern_existing_names(apps, schema_editor):
+    """Intern the distinct names of every tag and ingredient in bulk"""
+    using = schema_editor.connection.alias
+    Term = apps.get_model('core', 'Term')
+    Recipe = apps.get_model('core', 'Recipe')
+    merged_recipe_ids = set()
+    for model_name, through, column in (
+            ('Tag', Recipe.tags.through, 'tag_id'),
+            ('Ingredient', Recipe.ingredients.through, 'ingredient_id')):
+        model = apps.get_model('core', model_name)
+        rows = model.objects.using(using).order_by('id')
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).values_list(
+                'id', 'name'
+            )[:BATCH_SIZE])
+            if not batch:
+                break
+            names = {name for _, name in batch}
+            ids = Term.objects.db_manager(using).intern(
+                names | {name.lower() for name in names}
+            )
+            model.objects.using(using).bulk_update(
+                [
+                    model(id=pk, term_id=ids[name],
+                          folded_term_id=ids[name.lower()])
+                    for pk, name in batch
+                ],
+                ['term', 'folded_term'], batch_size=BATCH_SIZE
+            )
+            last_id = batch[-1][0]
+        # Python and SQL lower() can disagree outside ASCII
+        merge_duplicates(model, through, column, using, F('folded_term'),
+                         merged_recipe_ids)
+    rebuild_relations(Recipe, merged_recipe_ids, using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_image_hash'),
+    ]
+
+    operations = [
+        # SQLite rebuilds the tables below, dropping these indexes anyway
+        migrations.RunPython(
+            drop_name_indexes, create_name_indexes,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255, unique=True)),
+            ],
+            managers=[
+                ('objects', core.models.TermManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='folded_term',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='term',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='folded_term',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='term',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.RunPython(
+            intern_existing_names, migrations.RunPython.noop,
+            hints={'model_name': 'tag'},
+        ),
+    ]
@@ -0,0 +1,107 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+UNIQUE_INDEXES = (
+    ('core_tag', 'core_tag_user_folded_term_uniq'),
+    ('core_ingredient', 'core_ingredient_user_folded_term_uniq'),
+)
+
+
+def create_unique_indexes(apps, schema_editor):
+    for table, name in UNIQUE_INDEXES:
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX {name} ON {table} (user_id, folded_term_id)'
+        )
+
+
+def drop_unique_indexes(apps, schema_editor):
+    for _, name in UNIQUE_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def create_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX core_term_value_prefix_idx '
+        'ON core_term (value varchar_pattern_ops)'
+    )
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS core_term_value_prefix_idx')
+
+
+def restore_names(apps, schema_editor):
+    using = schema_editor.connection.alias
+    Term = apps.get_model('core', 'Term')
+    for model_name in ('Tag', 'Ingredient'):
+        apps.get_model('core', model_name).objects.using(using).update(
+            name=Subquery(
+                Term.objects.filter(id=OuterRef('term_id')).values('value')
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_terms'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(
+            migrations.RunPython.noop, restore_names,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RemoveField(
+            model_name='ingredient',
+            name='name',
+        ),
+        migrations.RemoveField(
+            model_name='tag',
+            name='name',
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='folded_term',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='term',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='folded_term',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='term',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.term'),
+        ),
+        migrations.RunPython(
+            create_unique_indexes, drop_unique_indexes,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RunPython(
+            create_prefix_index, drop_prefix_index,
+            hints={'model_name': 'term'},
+        ),
+    ]
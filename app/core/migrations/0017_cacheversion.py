@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_remove_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('owner_id', models.IntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cacheversion',
+            constraint=models.UniqueConstraint(fields=('owner_id', 'name'), name='cacheversion_owner_name_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetRejection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('limit', models.CharField(max_length=32)),
+                ('view', models.CharField(max_length=255)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='budgetrejection',
+            constraint=models.UniqueConstraint(fields=('limit', 'view'), name='budgetrejection_limit_view_uniq'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+KINDS = (('recipe', 'Recipe'), ('tag', 'Tag'), ('ingredient', 'Ingredient'))
+
+
+def backfill_changelog(apps, schema_editor):
+    """Log an upsert for every row created before the change log, so a
+    sync from scratch returns all of a user's objects
+    """
+    using = schema_editor.connection.alias
+    ChangeLogEntry = apps.get_model('core', 'ChangeLogEntry')
+    entries = ChangeLogEntry.objects.using(using)
+    for kind, model_name in KINDS:
+        model = apps.get_model('core', model_name)
+        rows = model.objects.using(using).exclude(
+            id__in=entries.filter(kind=kind).values('object_id')
+        ).order_by('id').values_list('id', 'user_id')
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not batch:
+                break
+            entries.bulk_create([
+                ChangeLogEntry(
+                    user_id=user_id, kind=kind, object_id=object_id,
+                    action='upsert'
+                )
+                for object_id, user_id in batch
+            ])
+            last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_budgetrejection'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_changelog, migrations.RunPython.noop,
+            hints={'model_name': 'changelogentry'}
+        ),
+    ]
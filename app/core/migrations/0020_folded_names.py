@@ -0,0 +1,91 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+NAME_TABLES = ('core_tag', 'core_ingredient')
+UNIQUE_INDEXES = (
+    ('core_tag', 'core_tag_user_folded_term_uniq'),
+    ('core_ingredient', 'core_ingredient_user_folded_term_uniq'),
+)
+
+
+def restore_unique_indexes(apps, schema_editor):
+    # SQLite adds a column by rebuilding the table, which loses the indexes
+    # created with raw SQL in 0016
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, name in UNIQUE_INDEXES:
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS {name} '
+            f'ON {table} (user_id, folded_term_id)'
+        )
+
+
+def fill_folded_names(apps, schema_editor):
+    using = schema_editor.connection.alias
+    Term = apps.get_model('core', 'Term')
+    for model_name in ('Tag', 'Ingredient'):
+        apps.get_model('core', model_name).objects.using(using).update(
+            folded_name=Subquery(
+                Term.objects.filter(
+                    id=OuterRef('folded_term_id')
+                ).values('value')
+            )
+        )
+
+
+def create_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in NAME_TABLES:
+        schema_editor.execute(
+            f'CREATE INDEX {table}_user_folded_prefix_idx ON {table} '
+            f'(user_id, folded_name varchar_pattern_ops)'
+        )
+    # Autocomplete no longer searches the shared terms by prefix
+    schema_editor.execute('DROP INDEX IF EXISTS core_term_value_prefix_idx')
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in NAME_TABLES:
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {table}_user_folded_prefix_idx'
+        )
+    schema_editor.execute(
+        'CREATE INDEX core_term_value_prefix_idx '
+        'ON core_term (value varchar_pattern_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_backfill_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='folded_name',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='folded_name',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(
+            restore_unique_indexes, migrations.RunPython.noop,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RunPython(
+            fill_folded_names, migrations.RunPython.noop,
+            hints={'model_name': 'tag'},
+        ),
+        migrations.RunPython(
+            create_prefix_indexes, drop_prefix_indexes,
+            hints={'model_name': 'tag'},
+        ),
+    ]
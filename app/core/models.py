@@ -1,6 +1,6 @@
 import uuid
 import os
-from django.db import models
+from django.db import models, router
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager,\
                                         PermissionsMixin
 from django.conf import settings
@@ -40,32 +40,141 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
-class Tag(models.Model):
-    name = models.CharField(max_length=255)
-    user = models.ForeignKey(
-            settings.AUTH_USER_MODEL,
-            on_delete=models.CASCADE
+class ShardAssignment(models.Model):
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='shard_assignment'
     )
+    alias = models.CharField(max_length=64)
+    migrating = models.BooleanField(default=False)
 
     def __str__(self):
-        return self.name
+        return f'{self.user_id} -> {self.alias}'
 
 
-class Ingredient(models.Model):
-    name = models.CharField(max_length=255)
-    user = models.ForeignKey(
-        settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+class TermManager(models.Manager):
+    use_in_migrations = True
+
+    def intern(self, values):
+        """Return {value: id} for values, adding the missing ones"""
+        values = set(values)
+        found = dict(
+            self.filter(value__in=values).values_list('value', 'id')
+        )
+        missing = values - found.keys()
+        if missing:
+            self.bulk_create(
+                [self.model(value=value) for value in missing],
+                ignore_conflicts=True
+            )
+            found.update(
+                self.filter(value__in=missing).values_list('value', 'id')
+            )
+        return found
+
+
+class Term(models.Model):
+    """Tag or ingredient name stored once per database and referenced by
+    every user's rows. Names are case-sensitive; ``folded_term`` on the
+    referencing rows points at the lower-cased spelling.
+    """
+    value = models.CharField(max_length=255, unique=True)
+    objects = TermManager()
+
+    def __str__(self):
+        return self.value
+
+
+class NamedManager(models.Manager):
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('term')
+
+
+class NamedModel(models.Model):
+    """Per-user row whose name is interned in ``Term``.
+
+    ``name`` reads and writes the text; it is interned when the row is
+    saved, or by ``intern_names`` before a ``bulk_create``.
+    """
+    term = models.ForeignKey(
+        Term,
+        on_delete=models.PROTECT,
+        db_constraint=False,
+        related_name='+'
+    )
+    folded_term = models.ForeignKey(
+        Term,
+        on_delete=models.PROTECT,
+        db_constraint=False,
+        related_name='+'
     )
+    # Copy of the folded term's value, so one user's names can be range
+    # scanned by prefix without going through the shared terms
+    folded_name = models.CharField(max_length=255, default='')
+    objects = NamedManager()
+
+    class Meta:
+        abstract = True
+
+    @property
+    def name(self):
+        if '_name' in self.__dict__:
+            return self._name
+        return self.term.value
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
+    @classmethod
+    def intern_names(cls, objs, using):
+        """Point objs at the terms of their names, creating missing terms"""
+        names = [obj.name for obj in objs]
+        ids = Term.objects.db_manager(using).intern(
+            names + [name.lower() for name in names]
+        )
+        for obj, name in zip(objs, names):
+            obj.term = Term(id=ids[name], value=name)
+            obj.folded_term_id = ids[name.lower()]
+            obj.folded_name = name.lower()
+            obj.__dict__.pop('_name', None)
+
+    def save(self, *args, **kwargs):
+        if '_name' in self.__dict__:
+            using = kwargs.get('using') or \
+                router.db_for_write(type(self), instance=self)
+            self.intern_names([self], using)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+class Tag(NamedModel):
+    user = models.ForeignKey(
+            settings.AUTH_USER_MODEL,
+            on_delete=models.CASCADE,
+            db_constraint=False
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Ingredient(NamedModel):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class Recipe(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_constraint=False
     )
     title = models.CharField(max_length=255)
     time_minutes = models.IntegerField()
@@ -74,6 +183,154 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Perceptual hash of the image, see recipe.image_hashes
+    image_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Denormalized tags and ingredients, see recipe.read_model
+    relations = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'id'], name='recipe_user_id_idx'
+            ),
+            models.Index(
+                fields=['user', 'time_minutes', 'id'],
+                name='recipe_user_time_idx'
+            ),
+            models.Index(
+                fields=['user', 'price', 'id'], name='recipe_user_price_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class ChangeLogEntry(models.Model):
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = ((UPSERT, 'Upsert'), (DELETE, 'Delete'))
+    KIND_CHOICES = (
+        ('recipe', 'Recipe'),
+        ('tag', 'Tag'),
+        ('ingredient', 'Ingredient'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='+'
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='changelog_user_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.action} {self.kind} {self.object_id}'
+
+
+class PurgeJob(models.Model):
+    USER = 'user'
+    RECIPES = 'recipes'
+    SCOPE_CHOICES = ((USER, 'User'), (RECIPES, 'Recipes'))
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    owner_id = models.IntegerField(db_index=True)
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING
+    )
+    max_recipe_id = models.IntegerField(null=True)
+    total_recipes = models.IntegerField(default=0)
+    deleted_recipes = models.IntegerField(default=0)
+    deleted_tags = models.IntegerField(default=0)
+    deleted_ingredients = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'{self.scope} purge of {self.owner_id} ({self.status})'
+
+
+class IdempotencyKey(models.Model):
+    """First response to a request sent with an Idempotency-Key header.
+
+    ``response_status`` stays empty while the first request is running.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'key'], name='idempotency_user_key_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
+class CacheVersion(models.Model):
+    """Counter per name and user behind ``core.versions``"""
+    name = models.CharField(max_length=64)
+    owner_id = models.IntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner_id', 'name'],
+                name='cacheversion_owner_name_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name}:{self.owner_id}={self.value}'
+
+
+class BudgetRejection(models.Model):
+    """Rejections per limit and view counted by ``core.budgets``"""
+    limit = models.CharField(max_length=32)
+    view = models.CharField(max_length=255)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['limit', 'view'],
+                name='budgetrejection_limit_view_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.limit}:{self.view}={self.count}'
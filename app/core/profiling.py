@@ -0,0 +1,233 @@
+"""
+On-demand profiling of live requests.
+
+``ProfilingMiddleware`` profiles a request when it carries a valid
+``X-Profile`` header (minted by staff through ``api/debug/profiles/token/``)
+or when it is picked by ``PROFILE_SAMPLE_RATE``. A background thread samples
+the stack of the thread serving the request every ``PROFILE_INTERVAL``
+seconds, so the view runs at full speed apart from the sampling itself.
+When the token asks for memory the request is also traced with
+``tracemalloc`` and the top allocation sites are stored alongside. Tracing
+is process-wide, so only one request is memory-profiled at a time; others
+arriving meanwhile get a stack profile only.
+
+Profiles are written to ``PROFILE_DIR`` in speedscope's JSON format
+(https://www.speedscope.app) and can be fetched as folded stacks for
+``flamegraph.pl``. Only the newest ``PROFILE_MAX_FILES`` are kept. With
+``PROFILING_ENABLED`` off the middleware removes itself from the stack.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+
+HEADER = 'HTTP_X_PROFILE'
+TOKEN_SALT = 'core.profiling'
+SUFFIX = '.speedscope.json'
+_NAME = re.compile(r'^[\w.-]+$')
+_memory_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Statistical profiler for a single thread"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.frames = {}
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_index(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self.frames:
+            self.frames[key] = len(self.frames)
+        return self.frames[key]
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_index(frame.f_code))
+            frame = frame.f_back
+        if not stack:
+            return False
+        stack.reverse()
+        self.samples.append(stack)
+        return True
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if self.sample():
+                self.weights.append(now - last)
+            last = now
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def speedscope(self, name):
+        frames = [
+            {'name': func, 'file': filename, 'line': line}
+            for func, filename, line in self.frames
+        ]
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'recipe-app-api',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(self.weights),
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+def collapsed(profile):
+    """Folded stacks ("a;b;c count") from a stored speedscope profile"""
+    frames = profile['shared']['frames']
+    counts = Counter(
+        ';'.join(frames[index]['name'] for index in stack)
+        for stack in profile['profiles'][0]['samples']
+    )
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.items())
+
+
+class MemoryTracer:
+    """Allocation diff of one request taken with tracemalloc"""
+
+    def __init__(self, limit=25):
+        self.limit = limit
+        self.started_tracing = False
+
+    def start(self):
+        """Start tracing, False if another request is being traced"""
+        if not _memory_lock.acquire(blocking=False):
+            return False
+        try:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start(10)
+            self.before = tracemalloc.take_snapshot()
+        except BaseException:
+            self._finish()
+            raise
+        return True
+
+    def _finish(self):
+        if self.started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        _memory_lock.release()
+
+    def stop(self):
+        try:
+            after = tracemalloc.take_snapshot()
+        finally:
+            self._finish()
+        ignore = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+        stats = after.filter_traces(ignore).compare_to(
+            self.before.filter_traces(ignore), 'lineno'
+        )
+        return [
+            {
+                'file': stat.traceback[0].filename,
+                'line': stat.traceback[0].lineno,
+                'size_diff': stat.size_diff,
+                'count_diff': stat.count_diff,
+            }
+            for stat in stats[:self.limit]
+        ]
+
+
+def make_token(memory=False):
+    return signing.dumps({'memory': memory}, salt=TOKEN_SALT)
+
+
+def read_token(value):
+    """Return the token options, or None if it is invalid or expired"""
+    try:
+        return signing.loads(
+            value, salt=TOKEN_SALT,
+            max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600)
+        )
+    except signing.BadSignature:
+        return None
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', '/vol/web/profiles')
+
+
+def save_profile(request, profiler, allocations=None):
+    path = re.sub(r'[^\w-]+', '-', request.path).strip('-') or 'root'
+    name = (f'{time.strftime("%Y%m%dT%H%M%S")}-{request.method.lower()}-'
+            f'{path[:60]}-{uuid.uuid4().hex[:8]}')
+    data = profiler.speedscope(f'{request.method} {request.path}')
+    data['duration'] = profiler.duration
+    if allocations is not None:
+        data['allocations'] = allocations
+
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + SUFFIX), 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    _prune(directory)
+    return name
+
+
+def _prune(directory):
+    keep = getattr(settings, 'PROFILE_MAX_FILES', 200)
+    for name in list_profiles()[keep:]:
+        try:
+            os.remove(os.path.join(directory, name + SUFFIX))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    """Stored profile names, newest first"""
+    try:
+        names = os.listdir(profile_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (name[:-len(SUFFIX)] for name in names if name.endswith(SUFFIX)),
+        reverse=True
+    )
+
+
+def load_profile(name):
+    if not _NAME.match(name):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), name + SUFFIX)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
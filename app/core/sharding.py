@@ -0,0 +1,282 @@
+"""
+User-based sharding of recipe data.
+
+``Term``, ``Tag``, ``Ingredient``, ``Recipe`` and the recipe M2M tables
+live on one of the database aliases listed in ``settings.RECIPE_SHARDS``;
+users, tokens and shard assignments stay on ``default``. A new user is
+placed with a consistent-hashing ring and the placement is recorded in
+``ShardAssignment``, so growing the ring never moves data implicitly: run
+``manage.py rebalance_shards`` to move users to their new ring position.
+
+Each process caches assignments for ``SHARD_CACHE_SECONDS``. Writing views
+instead re-read the assignment under a shared per-user lock (a Postgres
+advisory lock on ``default``, a process-local lock elsewhere) and are
+refused while the user is migrating; a move takes the lock exclusively, so
+it waits for the writes already in flight before it copies anything. The
+source rows are deleted ``SHARD_CACHE_SECONDS`` after the switch, once no
+process can still be reading them through a cached assignment.
+
+Rows keep their primary keys when moved, so every shard must allocate IDs
+from a disjoint range (e.g. per-shard sequence offsets on Postgres). Terms
+are interned per shard, moved tags and ingredients are re-pointed at the
+target shard's terms.
+"""
+import bisect
+import hashlib
+import threading
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+SHARDED_MODELS = {
+    'term', 'tag', 'ingredient', 'recipe', 'recipe_tags', 'recipe_ingredients',
+    'changelogentry',
+}
+
+# Key space of the advisory locks, the second key is the user id
+LOCK_CLASS = 0x5348
+
+_current_user_id = ContextVar('shard_user_id', default=None)
+_write_shard = ContextVar('shard_write_alias', default=None)
+
+
+class UserShardMigrating(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your data is being moved, please retry shortly.'
+    default_code = 'shard_migrating'
+
+
+class HashRing:
+    """Consistent-hashing ring with virtual nodes"""
+
+    def __init__(self, nodes, replicas=64):
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            for index in range(replicas):
+                key = self._hash(f'{node}#{index}')
+                self._nodes[key] = node
+                bisect.insort(self._keys, key)
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+    def get_node(self, value):
+        if not self._keys:
+            raise ValueError('Hash ring has no nodes')
+        index = bisect.bisect(self._keys, self._hash(value))
+        return self._nodes[self._keys[index % len(self._keys)]]
+
+
+_ring_cache = {}
+
+
+def get_shards():
+    return list(getattr(settings, 'RECIPE_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def sharding_enabled():
+    return len(get_shards()) > 1
+
+
+def get_ring():
+    shards = tuple(get_shards())
+    if shards not in _ring_cache:
+        _ring_cache.clear()
+        _ring_cache[shards] = HashRing(shards)
+    return _ring_cache[shards]
+
+
+def _cache_key(user_id):
+    return f'shard:{user_id}'
+
+
+def get_assignment(user_id):
+    from core.models import ShardAssignment
+
+    assignment, _ = ShardAssignment.objects.using(
+        DEFAULT_DB_ALIAS
+    ).get_or_create(
+        user_id=user_id,
+        defaults={'alias': get_ring().get_node(user_id)}
+    )
+    return assignment
+
+
+def cache_seconds():
+    return getattr(settings, 'SHARD_CACHE_SECONDS', 5)
+
+
+def shard_for_user(user_id):
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    pinned = _write_shard.get()
+    if pinned is not None and pinned[0] == user_id:
+        return pinned[1]
+    alias = cache.get(_cache_key(user_id))
+    if alias is None:
+        alias = get_assignment(user_id).alias
+        cache.set(_cache_key(user_id), alias, cache_seconds())
+    return alias
+
+
+def forget_user(user_id):
+    """Drop this process's cached assignment, other processes keep theirs
+    for up to ``SHARD_CACHE_SECONDS``
+    """
+    cache.delete(_cache_key(user_id))
+
+
+class LocalUserLocks:
+    """Shared/exclusive locks per user within one process"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._writers = {}
+        self._moving = set()
+
+    def acquire_shared(self, user_id):
+        with self._cond:
+            if user_id in self._moving:
+                return False
+            self._writers[user_id] = self._writers.get(user_id, 0) + 1
+            return True
+
+    def release_shared(self, user_id):
+        with self._cond:
+            self._writers[user_id] -= 1
+            if not self._writers[user_id]:
+                del self._writers[user_id]
+            self._cond.notify_all()
+
+    def acquire(self, user_id):
+        with self._cond:
+            self._cond.wait_for(lambda: user_id not in self._moving)
+            self._moving.add(user_id)
+            self._cond.wait_for(lambda: user_id not in self._writers)
+
+    def release(self, user_id):
+        with self._cond:
+            self._moving.discard(user_id)
+            self._cond.notify_all()
+
+
+local_locks = LocalUserLocks()
+
+
+def _advisory(function, user_id):
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s, %s)', [LOCK_CLASS, user_id])
+        return cursor.fetchone()[0]
+
+
+def _use_advisory_locks():
+    return connections[DEFAULT_DB_ALIAS].vendor == 'postgresql'
+
+
+@contextmanager
+def user_writes(user_id):
+    """Hold off moves of user_id while writing to its shard, which is
+    read from ``ShardAssignment`` and used for the user until the block
+    exits. Raises ``UserShardMigrating`` while the user is being moved.
+    """
+    if _use_advisory_locks():
+        locked = _advisory('pg_try_advisory_lock_shared', user_id)
+    else:
+        locked = local_locks.acquire_shared(user_id)
+    if not locked:
+        raise UserShardMigrating()
+    try:
+        assignment = get_assignment(user_id)
+        if assignment.migrating:
+            raise UserShardMigrating()
+        cache.set(_cache_key(user_id), assignment.alias, cache_seconds())
+        token = _write_shard.set((user_id, assignment.alias))
+        try:
+            yield assignment.alias
+        finally:
+            _write_shard.reset(token)
+    finally:
+        if _use_advisory_locks():
+            _advisory('pg_advisory_unlock_shared', user_id)
+        else:
+            local_locks.release_shared(user_id)
+
+
+@contextmanager
+def drain_writers(user_id):
+    """Wait for the writes of user_id in flight and refuse new ones until
+    the block exits
+    """
+    if _use_advisory_locks():
+        _advisory('pg_advisory_lock', user_id)
+    else:
+        local_locks.acquire(user_id)
+    try:
+        yield
+    finally:
+        if _use_advisory_locks():
+            _advisory('pg_advisory_unlock', user_id)
+        else:
+            local_locks.release(user_id)
+
+
+def current_user_id():
+    return _current_user_id.get()
+
+
+def set_current_user(user_id):
+    _current_user_id.set(user_id)
+
+
+@contextmanager
+def user_shard(user_id=None):
+    token = _current_user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user_id.reset(token)
+
+
+class ShardRoutingMixin:
+    """Route the ORM work of a view to the requesting user's shard.
+
+    Writing methods hold ``user_writes`` and run in one transaction on
+    ``default`` and on the user's shard until the response is finalized.
+    An error response, such as a query budget 503 halfway through, rolls
+    back everything the request wrote.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self._write_aliases = []
+        with user_shard(), ExitStack() as self._shard_writes:
+            response = super().dispatch(request, *args, **kwargs)
+            if getattr(response, 'exception', False):
+                for alias in self._write_aliases:
+                    transaction.set_rollback(True, using=alias)
+            return response
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        writing = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        alias = DEFAULT_DB_ALIAS
+        if request.user.is_authenticated and sharding_enabled():
+            set_current_user(request.user.pk)
+            if writing:
+                alias = self._shard_writes.enter_context(
+                    user_writes(request.user.pk)
+                )
+        if not writing:
+            return
+        # Entered after the lock, so the transactions commit before moves
+        # are let through
+        for using in dict.fromkeys([DEFAULT_DB_ALIAS, alias]):
+            self._shard_writes.enter_context(transaction.atomic(using=using))
+            self._write_aliases.append(using)
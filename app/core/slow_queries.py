@@ -0,0 +1,275 @@
+"""
+Slow-query log.
+
+``SlowQueryMiddleware`` installs an execute wrapper on every database
+connection for the duration of a request. Statements slower than
+``SLOW_QUERY_THRESHOLD_MS`` are logged with their fingerprint (the SQL with
+literals and IN lists collapsed), the view and the first project frame that
+issued them, and their parameters reduced to types. The first time a
+process sees a fingerprint, and then at most every
+``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds, its plan is captured with EXPLAIN
+(``SLOW_QUERY_EXPLAIN_ANALYZE`` adds ANALYZE where the backend supports it)
+with the literals of its conditions replaced by ``?``.
+
+Per-fingerprint totals are kept in the ``shared`` cache so every web and
+worker process contributes to them. Each fingerprint hashes to one of
+``BUCKETS`` keys, so there is no index to keep in sync and a newcomer only
+displaces the fingerprint it collides with. A request's slow statements are
+folded in once it is done, outside its transactions and query budget; the
+read-modify-write is not atomic, which is fine for diagnostics. They are
+served by ``api/debug/slow-queries/`` and ``manage.py slow_queries``.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+CACHE = 'shared'
+BUCKETS = 1024
+CHUNK_SIZE = 256
+MAX_CALL_SITES = 10
+_in_explain = ContextVar('slow_query_in_explain', default=False)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+_PLAN_CONDITION = re.compile(
+    r'^(\s*(?:->\s*)?(?:(?:Index|Recheck|Hash|Merge) Cond|'
+    r'(?:Join |One-Time )?Filter): )(.*)$'
+)
+_explained = {}
+
+
+def normalize(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+def redact(params):
+    """Keep only the type (and length of strings) of each parameter"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: redact([value])[0] for key, value in params.items()}
+    redacted = []
+    for value in params:
+        if value is None:
+            redacted.append(None)
+        elif isinstance(value, (str, bytes)):
+            redacted.append(f'<{type(value).__name__}:{len(value)}>')
+        elif isinstance(value, (list, tuple)):
+            redacted.append(f'<{type(value).__name__}:{len(value)}>')
+        else:
+            redacted.append(f'<{type(value).__name__}>')
+    return redacted
+
+
+_SKIP_FILES = (__file__, os.path.join('core', 'middleware.py'))
+
+
+def call_site():
+    """First frame in the project's own code that led to the query"""
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and \
+                not filename.endswith(_SKIP_FILES) and \
+                'site-packages' not in filename:
+            path = os.path.relpath(filename, base)
+            return f'{path}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return None
+
+
+def redact_plan(plan):
+    """Replace the literals of a plan's conditions with ?"""
+    lines = []
+    for line in _STRING.sub('?', plan).splitlines():
+        match = _PLAN_CONDITION.match(line)
+        if match:
+            line = match.group(1) + _NUMBER.sub('?', match.group(2))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def explain(connection, sql, params):
+    analyze = getattr(settings, 'SLOW_QUERY_EXPLAIN_ANALYZE', False)
+    options = {'analyze': True} if analyze and connection.vendor == \
+        'postgresql' else {}
+    prefix = connection.ops.explain_query_prefix(**options)
+    token = _in_explain.set(True)
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f'{prefix} {sql}', params)
+                rows = cursor.fetchall()
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+    finally:
+        _in_explain.reset(token)
+    return redact_plan('\n'.join(
+        ' '.join(str(column) for column in row) for row in rows
+    ))
+
+
+def _key(fp):
+    return f'slow-query:{int(fp, 16) % BUCKETS}'
+
+
+def _all_keys():
+    keys = [f'slow-query:{bucket}' for bucket in range(BUCKETS)]
+    for start in range(0, len(keys), CHUNK_SIZE):
+        yield keys[start:start + CHUNK_SIZE]
+
+
+def record(fp, entry):
+    """Fold one slow execution into the totals of its fingerprint"""
+    cache = caches[CACHE]
+    key = _key(fp)
+    stats = cache.get(key)
+    if stats is None or stats['fingerprint'] != fp:
+        stats = {
+            'fingerprint': fp,
+            'sql': entry['normalized'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'views': {},
+            'call_sites': {},
+            'explain': None,
+            'explained_at': None,
+        }
+    stats['count'] += 1
+    stats['total_ms'] += entry['duration_ms']
+    stats['max_ms'] = max(stats['max_ms'], entry['duration_ms'])
+    stats['last_seen'] = time.time()
+    stats['last_params'] = entry['params']
+    for field, value in (('views', entry['view']),
+                         ('call_sites', entry['call_site'])):
+        if value is None:
+            continue
+        counts = stats[field]
+        counts[value] = counts.get(value, 0) + 1
+        if len(counts) > MAX_CALL_SITES:
+            del counts[min(counts, key=counts.get)]
+    if entry.get('explain') is not None:
+        stats['explain'] = entry['explain']
+        stats['explained_at'] = stats['last_seen']
+    cache.set(key, stats, None)
+
+
+def needs_explain(fp):
+    """Whether this process should capture the plan of fp now"""
+    interval = getattr(settings, 'SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+    now = time.time()
+    if now - _explained.get(fp, 0) <= interval:
+        return False
+    if len(_explained) >= BUCKETS:
+        _explained.clear()
+    _explained[fp] = now
+    return True
+
+
+def get_stats():
+    """Per-fingerprint totals, the most total time first"""
+    cache = caches[CACHE]
+    found = []
+    for keys in _all_keys():
+        found.extend(cache.get_many(keys).values())
+    return sorted(found, key=lambda s: s['total_ms'], reverse=True)
+
+
+def reset():
+    cache = caches[CACHE]
+    for keys in _all_keys():
+        cache.delete_many(keys)
+    _explained.clear()
+
+
+class SlowQueryLogger:
+    """Execute wrapper timing every statement on one connection"""
+
+    def __init__(self, request, threshold_ms):
+        self.request = request
+        self.threshold_ms = threshold_ms
+        self.entries = []
+
+    def _view(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match._func_path if match is not None else None
+
+    def __call__(self, execute, sql, params, many, context):
+        if _in_explain.get():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold_ms:
+                self._log(sql, params, many, context, duration_ms)
+
+    def _log(self, sql, params, many, context, duration_ms):
+        fp = fingerprint(sql)
+        entry = {
+            'normalized': normalize(sql),
+            'duration_ms': duration_ms,
+            'view': self._view(),
+            'call_site': call_site(),
+            'params': None if many else redact(params),
+            'explain': None,
+        }
+        connection = context['connection']
+        if not many and sql.lstrip()[:6].upper() == 'SELECT' and \
+                not connection.needs_rollback and needs_explain(fp):
+            entry['explain'] = explain(connection, sql, params)
+        logger.warning(
+            'slow query %.1f ms [%s] %s at %s', duration_ms, fp,
+            entry['normalized'], entry['call_site'],
+            extra={'fingerprint': fp, 'duration_ms': duration_ms,
+                   'view': entry['view'], 'call_site': entry['call_site'],
+                   'params': entry['params'], 'plan': entry['explain']}
+        )
+        self.entries.append((fp, entry))
+
+    def flush(self):
+        """Record the collected statements in the shared totals"""
+        entries, self.entries = self.entries, []
+        try:
+            for fp, entry in entries:
+                record(fp, entry)
+        except Exception:
+            logger.exception('Could not record %d slow queries', len(entries))
+
+
+def wrap_connections(request, threshold_ms):
+    """Context manager logging slow statements on all connections and
+    recording them once it exits
+    """
+    stack = ExitStack()
+    wrapper = SlowQueryLogger(request, threshold_ms)
+    stack.callback(wrapper.flush)
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+    return stack
@@ -1,6 +1,7 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from core.models import Tag
 
 
 class AdminSiteTests(TestCase):
@@ -32,3 +33,14 @@ class AdminSiteTests(TestCase):
         url = reverse("admin:core_user_add")
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
+
+    def test_tag_change_page(self):
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        url = reverse('admin:core_tag_change', args=[tag.id])
+
+        res = self.client.post(url, {'name': 'Vegetarian',
+                                     'user': self.user.id})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(Tag.objects.get(pk=tag.pk).name, 'Vegetarian')
+        self.assertContains(self.client.get(url), 'Vegetarian')
@@ -0,0 +1,127 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Tag, Recipe
+
+
+BATCH_URL = reverse('batch')
+
+
+class BatchTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123', name='Test'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_login_required(self):
+        res = APIClient().post(BATCH_URL, {'requests': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_startup_calls(self):
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'GET', 'path': '/api/user/me/'},
+            {'method': 'get', 'path': '/api/recipe/tags/'},
+            {'method': 'GET', 'path': '/api/recipe/recipes/?limit=5'},
+            {'method': 'GET', 'path': '/api/recipe/recipes/999/'},
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        responses = res.data['responses']
+        self.assertEqual([r['status'] for r in responses],
+                         [200, 200, 200, 404])
+        self.assertEqual(responses[0]['body']['email'], 'test@mail.com')
+        self.assertEqual(responses[1]['body'][0]['name'], 'Vegan')
+        self.assertEqual(responses[2]['body']['results'], [])
+
+    def test_writes_applied_in_order(self):
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'POST', 'path': '/api/recipe/recipes/',
+             'body': {'title': 'Soup', 'time_minutes': 5, 'price': '2.00',
+                      'tags': [], 'ingredients': []}},
+            {'method': 'GET', 'path': '/api/recipe/recipes/'},
+        ]}, format='json')
+
+        responses = res.data['responses']
+        self.assertEqual(responses[0]['status'], 201)
+        self.assertEqual(responses[1]['body'][0]['title'], 'Soup')
+        self.assertTrue(Recipe.objects.filter(user=self.user).exists())
+
+    def test_idempotency_key_not_passed_to_sub_requests(self):
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'POST', 'path': '/api/recipe/tags/',
+             'body': {'name': 'Quick'}},
+            {'method': 'POST', 'path': '/api/recipe/tags/',
+             'body': {'name': 'Cheap'}},
+        ]}, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+
+        self.assertEqual([r['status'] for r in res.data['responses']],
+                         [201, 201])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+    def test_paths_outside_api_and_nested_batches_rejected(self):
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'GET', 'path': '/api/batch/'},
+            {'method': 'GET', 'path': '/api/missing/'},
+        ]}, format='json')
+        self.assertEqual([r['status'] for r in res.data['responses']],
+                         [404, 404])
+
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'GET', 'path': '/admin/'},
+        ]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many_requests(self):
+        item = {'method': 'GET', 'path': '/api/recipe/tags/'}
+
+        res = self.client.post(BATCH_URL, {'requests': [item] * 21},
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ParallelBatchTests(TransactionTestCase):
+
+    def test_parallel_gets(self):
+        user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        Tag.objects.create(user=user, name='Vegan')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        res = client.post(BATCH_URL, {'parallel': True, 'requests': [
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+            {'method': 'POST', 'path': '/api/recipe/tags/',
+             'body': {'name': 'Quick'}},
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+            {'method': 'GET', 'path': '/api/user/me/'},
+        ]}, format='json')
+
+        responses = res.data['responses']
+        self.assertEqual([r['status'] for r in responses],
+                         [200, 201, 200, 200])
+        self.assertEqual(len(responses[0]['body']), 1)
+        self.assertEqual(len(responses[2]['body']), 2)
+
+    @override_settings(QUERY_BUDGETS={'bulk': {'max_queries': 3}})
+    def test_parallel_gets_share_query_budget(self):
+        user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with self.assertLogs('core.budgets'):
+            res = client.post(BATCH_URL, {'parallel': True, 'requests': [
+                {'method': 'GET', 'path': '/api/recipe/tags/'},
+            ] * 6}, format='json')
+
+        self.assertIn(503, [r['status'] for r in res.data['responses']])
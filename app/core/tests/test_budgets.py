@@ -0,0 +1,220 @@
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import budgets
+from core.models import ChangeLogEntry, Ingredient, Tag
+from core.views import BatchView
+from recipe.views import RecipeViewSet
+
+
+BUDGETS_URL = reverse('core:query-budgets')
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+RESOLVE_TAGS_URL = reverse('recipe:tag-resolve')
+LIMITS = {
+    'default': {'max_ids': 3, 'max_queries': 20,
+                'statement_timeout_ms': 1000},
+    'bulk': {'max_queries': 200},
+}
+
+
+class QueryCanceled(Exception):
+    pgcode = budgets.QUERY_CANCELED
+
+
+class FakeCursor:
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+class FakeConnection:
+    vendor = 'postgresql'
+    in_atomic_block = False
+
+    def __init__(self):
+        self.connection = object()
+
+
+@override_settings(QUERY_BUDGETS=LIMITS)
+class BudgetTests(TestCase):
+
+    def test_budget_inherits_default_limits(self):
+        budget = budgets.get_budget('bulk')
+        self.assertEqual(budget.max_queries, 200)
+        self.assertEqual(budget.max_ids, 3)
+        self.assertEqual(budget.statement_timeout_ms, 1000)
+
+    def test_budget_name_by_view_and_action(self):
+        self.assertEqual(budgets.budget_name(BatchView), 'bulk')
+        self.assertEqual(budgets.budget_name(RecipeViewSet, 'list'),
+                         'default')
+        self.assertEqual(
+            budgets.budget_name(RecipeViewSet, 'cookbook_stats'), 'bulk'
+        )
+
+    def test_statement_timeout_set_only_when_changed(self):
+        connection, cursor = FakeConnection(), FakeCursor()
+
+        budgets._set_statement_timeout(connection, cursor, 1000)
+        budgets._set_statement_timeout(connection, cursor, 1000)
+        budgets._set_statement_timeout(connection, cursor, None)
+        budgets._set_statement_timeout(connection, cursor, None)
+
+        self.assertEqual(cursor.statements, [
+            ('SET statement_timeout = %s', [1000]),
+            ('RESET statement_timeout', None),
+        ])
+
+    def test_statement_timeout_reapplied_after_transaction(self):
+        connection, cursor = FakeConnection(), FakeCursor()
+        connection.in_atomic_block = True
+        budgets._set_statement_timeout(connection, cursor, 1000)
+        connection.in_atomic_block = False
+        budgets._set_statement_timeout(connection, cursor, 1000)
+        connection.connection = object()
+        budgets._set_statement_timeout(connection, cursor, 1000)
+
+        self.assertEqual(len(cursor.statements), 3)
+
+    def test_cancelled_statement_is_a_503(self):
+        guard = budgets.QueryGuard(RequestFactory().get('/api/slow/'),
+                                   budgets.get_budget('default'))
+        cursor = FakeCursor()
+        cursor.cursor = FakeCursor()
+
+        def execute(sql, params, many, context):
+            raise OperationalError('canceled') from QueryCanceled()
+
+        with self.assertLogs('core.budgets', 'WARNING'), \
+                self.assertRaises(budgets.StatementTimeout):
+            guard(execute, 'SELECT 1', None, False,
+                  {'connection': FakeConnection(), 'cursor': cursor})
+        self.assertEqual(budgets.get_stats(), [
+            {'limit': 'statement_timeout', 'view': '/api/slow/', 'count': 1}
+        ])
+
+    def test_rejections_counted_once_guard_exits(self):
+        request = RequestFactory().get('/api/tags/')
+        budget = budgets.Budget('default', max_queries=1)
+
+        with self.assertLogs('core.budgets', 'WARNING'), \
+                budgets.guard_connections(request, budget):
+            budgets.record(budgets.MAX_IDS, '/api/tags/')
+            budgets.record(budgets.MAX_IDS, '/api/tags/')
+            self.assertEqual(budgets.get_stats(), [])
+
+        self.assertEqual(budgets.get_stats(), [
+            {'limit': 'max_ids', 'view': '/api/tags/', 'count': 2}
+        ])
+
+
+@override_settings(QUERY_BUDGETS=LIMITS)
+class QueryBudgetAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123', is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_too_many_ids_rejected(self):
+        with self.assertLogs('core.budgets', 'WARNING'):
+            res = self.client.get(RECIPES_URL, {'tags': '1,2,3,4'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data)
+        self.assertEqual(
+            self.client.get(RECIPES_URL, {'tags': '1,2,3'}).status_code,
+            status.HTTP_200_OK
+        )
+
+    def test_query_budget_exceeded(self):
+        limits = dict(LIMITS, default=dict(LIMITS['default'],
+                                           max_queries=1))
+
+        with override_settings(QUERY_BUDGETS=limits), \
+                self.assertLogs('core.budgets', 'WARNING'):
+            res = self.client.post(TAGS_URL, {'name': 'vegan'})
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res.data['detail'].code, 'query_budget_exceeded')
+        self.assertFalse(Tag.objects.exists())
+
+    def test_budget_exceeded_rolls_back_writes(self):
+        limits = dict(LIMITS, names={'max_queries': 8})
+        names = [f'tag{index}' for index in range(10)]
+
+        with override_settings(QUERY_BUDGETS=limits), \
+                self.assertLogs('core.budgets', 'WARNING'):
+            res = self.client.post(
+                RESOLVE_TAGS_URL, {'names': names}, format='json'
+            )
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(ChangeLogEntry.objects.exists())
+
+    def test_rejections_counted(self):
+        with self.assertLogs('core.budgets', 'WARNING'):
+            for _ in range(2):
+                self.client.get(RECIPES_URL, {'ingredients': '1,2,3,4,5'})
+
+        res = self.client.get(BUDGETS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['rejections'], [{
+            'limit': 'max_ids', 'view': 'recipe.views.RecipeViewSet',
+            'count': 2,
+        }])
+        self.client.delete(BUDGETS_URL)
+        self.assertEqual(self.client.get(BUDGETS_URL).data['rejections'],
+                         [])
+
+
+class WriteBudgetTests(TestCase):
+    """The configured budgets fit the largest writes the API accepts"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_resolve_largest_batch(self):
+        names = [f'tag{index}' for index in range(100)]
+
+        res = self.client.post(
+            RESOLVE_TAGS_URL, {'names': names}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 100)
+
+    def test_recipe_writes(self):
+        tags = [Tag.objects.create(user=self.user, name=f'tag{index}').id
+                for index in range(50)]
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'i{index}').id
+            for index in range(50)
+        ]
+        payload = {'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+                   'tags': tags, 'ingredients': ingredients}
+
+        res = self.client.post(RECIPES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        url = reverse('recipe:recipe-detail', args=[res.data['id']])
+        res = self.client.put(url, dict(payload, tags=tags[:10]))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.delete(url)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,78 @@
+from unittest.mock import patch
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory, \
+    override_settings
+from core import db_routers
+from core.db_routers import ReplicaRouter, read_from_replicas, replica_health
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRouterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        replica_health.reset()
+
+    @patch.object(replica_health, 'is_healthy', return_value=True)
+    def test_reads_use_replica_when_enabled(self, is_healthy):
+        self.assertIsNone(self.router.db_for_read(Recipe))
+        with read_from_replicas():
+            self.assertEqual(self.router.db_for_read(Recipe), 'replica_0')
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    @patch.object(replica_health, 'is_healthy', return_value=False)
+    def test_unhealthy_replica_falls_back_to_primary(self, is_healthy):
+        with read_from_replicas():
+            self.assertIsNone(self.router.db_for_read(Recipe))
+
+    @patch.object(replica_health, 'is_healthy', return_value=True)
+    def test_reads_inside_transaction_use_primary(self, is_healthy):
+        with read_from_replicas(), transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Recipe))
+
+    @override_settings(REPLICA_MAX_LAG=1)
+    def test_replica_lag_check(self):
+        self.assertEqual(replica_health.check('default'), (True, 0.0))
+        with patch.object(replica_health, 'check',
+                          return_value=(False, 30.0)) as check:
+            self.assertFalse(replica_health.is_healthy('replica_0'))
+            self.assertFalse(replica_health.is_healthy('replica_0'))
+            self.assertEqual(check.call_count, 1)
+
+
+class ReplicaRoutingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.seen = []
+
+        def view(request):
+            self.seen.append(db_routers._use_replica.get())
+            return HttpResponse()
+
+        self.middleware = ReplicaRoutingMiddleware(view)
+
+    def test_safe_request_reads_from_replica(self):
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        self.assertEqual(self.seen, [True])
+        self.assertFalse(db_routers._use_replica.get())
+
+    def test_write_pins_client_to_primary(self):
+        res = self.middleware(
+            self.factory.post('/', HTTP_AUTHORIZATION='Token b')
+        )
+        self.assertIn('replica_pin', res.cookies)
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token b'))
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token c'))
+        self.assertEqual(self.seen, [False, False, True])
+
+    def test_pin_shared_between_processes(self):
+        self.middleware(self.factory.post('/', HTTP_AUTHORIZATION='Token d'))
+        caches['default'].clear()
+        other = ReplicaRoutingMiddleware(self.middleware.get_response)
+        other(self.factory.get('/', HTTP_AUTHORIZATION='Token d'))
+        self.assertEqual(self.seen, [False, False])
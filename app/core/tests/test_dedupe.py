@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, IntegrityError, transaction
+from django.db.models import F
+from django.test import TestCase
+from core.dedupe import duplicate_map, merge_duplicates
+from core.models import Tag, Recipe
+
+
+class MergeDuplicatesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+
+    def test_case_insensitive_unique_names(self):
+        Tag.objects.create(user=self.user, name='Vegan')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tag.objects.create(user=self.user, name='vegan')
+        other = get_user_model().objects.create_user('o@mail.com', 'pass')
+        Tag.objects.create(user=other, name='vegan')
+
+    def test_duplicates_found_in_one_query(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX core_tag_user_folded_term_uniq')
+        other = get_user_model().objects.create_user('o@mail.com', 'pass')
+        keep = Tag.objects.create(user=self.user, name='Vegan')
+        duplicates = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('vegan', 'VEGAN')
+        ]
+        other_keep = Tag.objects.create(user=other, name='vegan')
+        other_duplicate = Tag.objects.create(user=other, name='Vegan')
+        Tag.objects.create(user=self.user, name='Spicy')
+
+        with self.assertNumQueries(1):
+            mapping = duplicate_map(Tag, 'default', F('folded_term'))
+
+        self.assertEqual(mapping, {
+            duplicates[0].id: keep.id,
+            duplicates[1].id: keep.id,
+            other_duplicate.id: other_keep.id,
+        })
+
+    def test_merge_rewrites_recipe_references(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX core_tag_user_folded_term_uniq')
+        keep = Tag.objects.create(user=self.user, name='Vegan')
+        duplicate = Tag.objects.create(user=self.user, name='vegan')
+        recipe1 = Recipe.objects.create(
+            user=self.user, title='r1', time_minutes=1, price=1
+        )
+        recipe2 = Recipe.objects.create(
+            user=self.user, title='r2', time_minutes=1, price=1
+        )
+        recipe1.tags.add(keep, duplicate)
+        recipe2.tags.add(duplicate)
+
+        recipe_ids = set()
+        merged = merge_duplicates(
+            Tag, Recipe.tags.through, 'tag_id', key=F('folded_term'),
+            recipe_ids=recipe_ids
+        )
+
+        self.assertEqual(merged, 1)
+        self.assertEqual(recipe_ids, {recipe1.id, recipe2.id})
+        self.assertFalse(Tag.objects.filter(id=duplicate.id).exists())
+        self.assertEqual(list(recipe1.tags.all()), [keep])
+        self.assertEqual(list(recipe2.tags.all()), [keep])
@@ -0,0 +1,124 @@
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import IdempotencyKey, Recipe, Tag
+
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {'title': 'Soup', 'time_minutes': 5, 'price': '2.00',
+                        'tags': [], 'ingredients': []}
+
+    def post(self, url, payload, key='key-1', **extra):
+        return self.client.post(url, payload, format='json',
+                                HTTP_IDEMPOTENCY_KEY=key, **extra)
+
+    def test_retry_replays_first_response(self):
+        first = self.post(RECIPES_URL, self.payload)
+        second = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_without_key_not_deduplicated(self):
+        self.client.post(RECIPES_URL, self.payload, format='json')
+        self.client.post(RECIPES_URL, self.payload, format='json')
+
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 2)
+
+    def test_key_reused_for_other_request(self):
+        self.post(TAGS_URL, {'name': 'Vegan'})
+
+        res = self.post(TAGS_URL, {'name': 'Quick'})
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertFalse(Tag.objects.filter(term__value='Quick').exists())
+
+    def test_keys_are_per_user(self):
+        other = get_user_model().objects.create_user(
+            'other@mail.com', 'pass123'
+        )
+        self.post(TAGS_URL, {'name': 'Vegan'})
+        self.client.force_authenticate(other)
+
+        res = self.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertTrue(Tag.objects.filter(user=other).exists())
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_concurrent_duplicate_rejected(self):
+        res = self.post(TAGS_URL, {'name': 'Vegan'})
+        IdempotencyKey.objects.filter(key='key-1').update(
+            response_status=None, response_body=''
+        )
+
+        res = self.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+
+    def test_failed_request_releases_key(self):
+        res = self.post(RECIPES_URL, {'title': 'Missing fields'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.post(RECIPES_URL, self.payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_stale_claim_taken_over_and_purged(self):
+        self.post(TAGS_URL, {'name': 'Vegan'})
+        IdempotencyKey.objects.update(
+            response_status=None,
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        res = self.post(TAGS_URL, {'name': 'Vegan'})
+        self.assertNotIn('Idempotent-Replayed', res)
+
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_upload_image_processed_once(self):
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=2
+        )
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            responses = []
+            for _ in range(2):
+                ntf.seek(0)
+                responses.append(self.client.post(
+                    url, {'image': ntf}, format='multipart',
+                    HTTP_IDEMPOTENCY_KEY='upload-1'
+                ))
+
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        recipe.refresh_from_db()
+        recipe.image.delete()
@@ -0,0 +1,85 @@
+import gzip
+from io import StringIO
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from core.middleware import CompressionMiddleware, negotiate_encoding
+
+
+def compress_response(response, accept='gzip'):
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+    middleware = CompressionMiddleware(lambda request: response)
+    return middleware(request)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+class CompressionMiddlewareTests(TestCase):
+
+    def test_large_body_compressed(self):
+        body = b'{"title": "test"}' * 100
+        res = compress_response(
+            HttpResponse(body, content_type='application/json')
+        )
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.content), body)
+        self.assertIn('Accept-Encoding', res['Vary'])
+        self.assertIn('compress', res['Server-Timing'])
+
+    def test_small_body_not_compressed(self):
+        res = compress_response(
+            HttpResponse(b'{}', content_type='application/json')
+        )
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res.content, b'{}')
+
+    def test_compressed_media_skipped(self):
+        body = b'\x00' * 1000
+        res = compress_response(HttpResponse(body, content_type='image/jpeg'))
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_client_without_accept_encoding(self):
+        body = b'a' * 1000
+        res = compress_response(HttpResponse(body), accept='')
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res.content, body)
+
+    def test_streaming_response_compressed(self):
+        chunks = [b'line %d\n' % i for i in range(500)]
+        res = compress_response(StreamingHttpResponse(iter(chunks)))
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        body = b''.join(res.streaming_content)
+        self.assertEqual(gzip.decompress(body), b''.join(chunks))
+
+    def test_negotiate_respects_quality(self):
+        encodings = {'zstd': None, 'gzip': None}
+        self.assertEqual(
+            negotiate_encoding('gzip;q=1.0, zstd;q=0.5', encodings), 'gzip'
+        )
+        self.assertEqual(negotiate_encoding('zstd, gzip', encodings), 'zstd')
+        self.assertIsNone(negotiate_encoding('gzip;q=0', encodings))
+
+
+class PathScopedMiddlewareTests(TestCase):
+
+    def test_api_skips_admin_middleware(self):
+        res = Client().get('/api/recipe/tags/')
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res['X-Frame-Options'], 'DENY')
+        self.assertNotIn('Cookie', res.get('Vary', ''))
+
+    def test_admin_keeps_full_chain(self):
+        client = Client(enforce_csrf_checks=True)
+
+        res = client.get('/admin/login/')
+        self.assertEqual(res['X-Frame-Options'], 'DENY')
+        self.assertIn('csrftoken', res.cookies)
+
+        res = client.post('/admin/login/', {'username': 'a', 'password': 'b'})
+        self.assertEqual(res.status_code, 403)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_middleware', '--requests', '5', '--rounds', '1',
+                     stdout=out)
+        self.assertIn('saved', out.getvalue())
@@ -77,3 +77,55 @@ class ModelTests(TestCase):
         file_path = models.recipe_image_file_path(None, 'myimage.jpg')
         exp_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, exp_path)
+
+
+class TermTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.other = create_user('other@mail.com')
+
+    def test_names_are_shared_between_users(self):
+        tag = models.Tag.objects.create(user=self.user, name='Salt')
+        other = models.Tag.objects.create(user=self.other, name='Salt')
+        lower = models.Ingredient.objects.create(user=self.user, name='salt')
+
+        self.assertEqual(tag.term_id, other.term_id)
+        self.assertNotEqual(tag.term_id, lower.term_id)
+        self.assertEqual(tag.folded_term_id, lower.term_id)
+        self.assertEqual(lower.folded_term_id, lower.term_id)
+        self.assertEqual(
+            sorted(models.Term.objects.values_list('value', flat=True)),
+            ['Salt', 'salt']
+        )
+
+    def test_rename_points_at_new_term(self):
+        tag = models.Tag.objects.create(user=self.user, name='vegan')
+        tag.name = 'Vegetarian'
+        tag.save()
+
+        tag = models.Tag.objects.get(pk=tag.pk)
+        self.assertEqual(tag.name, 'Vegetarian')
+        self.assertEqual(tag.folded_term.value, 'vegetarian')
+        self.assertEqual(tag.folded_name, 'vegetarian')
+
+    def test_name_loaded_with_row(self):
+        models.Tag.objects.create(user=self.user, name='vegan')
+        models.Tag.objects.create(user=self.user, name='quick')
+
+        with self.assertNumQueries(1):
+            names = sorted(tag.name for tag in models.Tag.objects.all())
+        self.assertEqual(names, ['quick', 'vegan'])
+
+    def test_intern_names_in_bulk(self):
+        tags = [models.Tag(user=self.user, name=name)
+                for name in ('a', 'B', 'c')]
+
+        with self.assertNumQueries(3):
+            models.Tag.intern_names(tags, 'default')
+        models.Tag.objects.bulk_create(tags)
+
+        self.assertEqual(
+            sorted(tag.name for tag in models.Tag.objects.all()),
+            ['B', 'a', 'c']
+        )
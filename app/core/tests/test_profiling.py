@@ -0,0 +1,135 @@
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import profiling
+from core.middleware import ProfilingMiddleware
+
+
+PROFILES_URL = reverse('core:profiles')
+TOKEN_URL = reverse('core:profile-token')
+
+
+def busy_view(request):
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        sum(range(100))
+    return HttpResponse(b'ok')
+
+
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(
+            PROFILING_ENABLED=True, PROFILE_DIR=self.dir.name,
+            PROFILE_INTERVAL=0.001
+        )
+        self.override.enable()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        self.override.disable()
+        self.dir.cleanup()
+
+    def test_disabled_middleware_not_used(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(busy_view)
+
+    def test_signed_header_profiles_request(self):
+        request = self.factory.get(
+            '/api/recipe/recipes/',
+            HTTP_X_PROFILE=profiling.make_token(memory=True)
+        )
+
+        res = ProfilingMiddleware(busy_view)(request)
+
+        name = res['X-Profile-Id']
+        self.assertEqual(profiling.list_profiles(), [name])
+        profile = profiling.load_profile(name)
+        self.assertTrue(profile['profiles'][0]['samples'])
+        self.assertIn('allocations', profile)
+        self.assertIn('busy_view', profiling.collapsed(profile))
+
+    def test_overlapping_memory_profiles(self):
+        token = profiling.make_token(memory=True)
+        inner = []
+
+        def view(request):
+            inner.append(ProfilingMiddleware(busy_view)(
+                self.factory.get('/inner/', HTTP_X_PROFILE=token)
+            ))
+            return HttpResponse(b'ok')
+
+        res = ProfilingMiddleware(view)(
+            self.factory.get('/outer/', HTTP_X_PROFILE=token)
+        )
+
+        outer = profiling.load_profile(res['X-Profile-Id'])
+        self.assertIn('allocations', outer)
+        self.assertNotIn(
+            'allocations', profiling.load_profile(inner[0]['X-Profile-Id'])
+        )
+        tracer = profiling.MemoryTracer()
+        self.assertTrue(tracer.start())
+        tracer.stop()
+
+    def test_invalid_header_ignored(self):
+        request = self.factory.get('/', HTTP_X_PROFILE='forged')
+
+        res = ProfilingMiddleware(busy_view)(request)
+
+        self.assertFalse(res.has_header('X-Profile-Id'))
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_sample_rate(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            res = ProfilingMiddleware(busy_view)(self.factory.get('/'))
+
+        self.assertTrue(res.has_header('X-Profile-Id'))
+
+
+class ProfileEndpointTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(self.client.get(PROFILES_URL).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.post(TOKEN_URL).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_download_profile(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PROFILE_DIR=directory):
+            token = self.client.post(TOKEN_URL).data['token']
+            request = RequestFactory().get('/', HTTP_X_PROFILE=token)
+            with override_settings(PROFILING_ENABLED=True):
+                name = ProfilingMiddleware(busy_view)(request)['X-Profile-Id']
+
+            res = self.client.get(PROFILES_URL)
+            self.assertEqual(res.data['profiles'], [name])
+            url = reverse('core:profile-detail', args=[name])
+            res = self.client.get(url, {'output': 'collapsed'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertIn(b'busy_view', res.content)
+            res = self.client.get(reverse('core:profile-detail',
+                                          args=['missing']))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
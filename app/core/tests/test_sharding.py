@@ -0,0 +1,231 @@
+import threading
+from importlib import import_module
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db.migrations import RunPython, RunSQL
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import sharding
+from core.db_routers import ShardRouter
+from core.management.commands import rebalance_shards
+from core.models import ShardAssignment, Recipe, Tag
+
+
+SHARDS = ['default', 'shard_0']
+DATA_MIGRATIONS = (
+    '0009_unique_lower_names',
+    '0010_name_prefix_indexes',
+    '0015_terms',
+    '0016_remove_names',
+    '0019_backfill_changelog',
+    '0020_folded_names',
+)
+
+
+class HashRingTests(TestCase):
+
+    def test_placement_is_stable(self):
+        ring = sharding.HashRing(SHARDS)
+        nodes = [ring.get_node(user_id) for user_id in range(1000)]
+        self.assertEqual(nodes, [ring.get_node(i) for i in range(1000)])
+        self.assertEqual(set(nodes), set(SHARDS))
+
+    def test_adding_node_moves_few_keys(self):
+        before = sharding.HashRing(SHARDS)
+        after = sharding.HashRing(SHARDS + ['shard_1'])
+        moved = sum(
+            before.get_node(i) != after.get_node(i) for i in range(3000)
+        )
+        self.assertLess(moved, 1600)
+        for user_id in range(3000):
+            if before.get_node(user_id) != after.get_node(user_id):
+                self.assertEqual(after.get_node(user_id), 'shard_1')
+
+
+@override_settings(RECIPE_SHARDS=SHARDS)
+class ShardRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = ShardRouter()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.other = get_user_model().objects.create_user(
+            'other@mail.com', 'pass123'
+        )
+        ShardAssignment.objects.create(user=self.user, alias='default')
+        ShardAssignment.objects.create(user=self.other, alias='shard_0')
+        sharding.forget_user(self.user.pk)
+        sharding.forget_user(self.other.pk)
+
+    def test_routes_by_instance_user(self):
+        recipe = Recipe(user=self.other, title='x', time_minutes=1, price=1)
+        self.assertEqual(
+            self.router.db_for_write(Recipe, instance=recipe), 'shard_0'
+        )
+        self.assertEqual(
+            self.router.db_for_read(Recipe.tags.through, instance=recipe),
+            'shard_0'
+        )
+
+    def test_routes_by_current_user(self):
+        self.assertIsNone(self.router.db_for_read(Tag))
+        with sharding.user_shard(self.other.pk):
+            self.assertEqual(self.router.db_for_read(Tag), 'shard_0')
+        with sharding.user_shard(self.user.pk):
+            self.assertEqual(self.router.db_for_read(Tag), 'default')
+
+    def test_user_model_not_sharded(self):
+        with sharding.user_shard(self.other.pk):
+            self.assertIsNone(self.router.db_for_read(get_user_model()))
+
+    def test_new_user_assigned_from_ring(self):
+        user = get_user_model().objects.create_user('new@mail.com', 'pass')
+        alias = sharding.shard_for_user(user.pk)
+        self.assertEqual(alias, sharding.get_ring().get_node(user.pk))
+        self.assertTrue(
+            ShardAssignment.objects.filter(user=user, alias=alias).exists()
+        )
+
+    def test_writes_blocked_while_migrating(self):
+        ShardAssignment.objects.filter(user=self.user).update(migrating=True)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('recipe:tag-list')
+        res = client.post(url, {'name': 'test'})
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        res = client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_writes_reread_assignment(self):
+        cache.set(sharding._cache_key(self.user.pk), 'shard_0')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.post(reverse('recipe:tag-list'), {'name': 'test'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(
+            Tag.objects.using('default').filter(user=self.user).exists()
+        )
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'default')
+
+    def test_data_migrations_run_on_shards(self):
+        for name in DATA_MIGRATIONS:
+            migration = import_module(f'core.migrations.{name}').Migration
+            for operation in migration.operations:
+                if isinstance(operation, (RunPython, RunSQL)):
+                    self.assertTrue(self.router.allow_migrate(
+                        'shard_0', 'core', **operation.hints
+                    ), name)
+
+
+@override_settings(RECIPE_SHARDS=SHARDS, SHARD_CACHE_SECONDS=0)
+class MoveUserTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        ShardAssignment.objects.create(user=self.user, alias='default')
+        sharding.forget_user(self.user.pk)
+        Tag.objects.create(user=self.user, name='Vegan')
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1
+        )
+
+    def tearDown(self):
+        sharding.forget_user(self.user.pk)
+
+    def assignment(self):
+        return ShardAssignment.objects.get(user=self.user)
+
+    def test_move_switches_then_deletes_source(self):
+        def copy(user_id, source, target):
+            self.assertTrue(self.assignment().migrating)
+            with self.assertRaises(sharding.UserShardMigrating):
+                with sharding.user_writes(user_id):
+                    pass
+
+        with mock.patch.object(rebalance_shards, 'copy_user_data',
+                               side_effect=copy) as copy_user_data:
+            self.assertTrue(
+                rebalance_shards.move_user(self.user.pk, 'shard_0')
+            )
+
+        copy_user_data.assert_called_once_with(
+            self.user.pk, 'default', 'shard_0'
+        )
+        assignment = self.assignment()
+        self.assertEqual(assignment.alias, 'shard_0')
+        self.assertFalse(assignment.migrating)
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'shard_0')
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertFalse(Tag.objects.using('default').exists())
+
+    def test_failed_copy_leaves_user_in_place(self):
+        with mock.patch.object(rebalance_shards, 'copy_user_data',
+                               side_effect=CommandError('IDs exist')), \
+                self.assertRaises(CommandError):
+            rebalance_shards.move_user(self.user.pk, 'shard_0')
+
+        assignment = self.assignment()
+        self.assertEqual(assignment.alias, 'default')
+        self.assertFalse(assignment.migrating)
+        self.assertTrue(Recipe.objects.using('default').exists())
+
+    def test_move_waits_for_writes_in_flight(self):
+        drained = threading.Event()
+
+        def move():
+            with sharding.drain_writers(self.user.pk):
+                drained.set()
+
+        with sharding.user_writes(self.user.pk):
+            mover = threading.Thread(target=move)
+            mover.start()
+            self.assertFalse(drained.wait(0.2))
+        mover.join(5)
+
+        self.assertTrue(drained.is_set())
+
+    def test_copy_refuses_existing_ids(self):
+        with self.assertRaises(CommandError):
+            rebalance_shards.copy_user_data(
+                self.user.pk, 'default', 'default'
+            )
+
+
+@skipUnless('shard_0' in settings.DATABASES, 'needs a shard_0 database')
+@override_settings(RECIPE_SHARDS=SHARDS, SHARD_CACHE_SECONDS=0)
+class CopyUserDataTests(TestCase):
+    databases = {alias for alias in SHARDS if alias in settings.DATABASES}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        ShardAssignment.objects.create(user=self.user, alias='default')
+        sharding.forget_user(self.user.pk)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1
+        )
+        self.recipe.tags.add(tag)
+
+    def tearDown(self):
+        sharding.forget_user(self.user.pk)
+
+    def test_user_moved_with_relations(self):
+        self.assertTrue(rebalance_shards.move_user(self.user.pk, 'shard_0'))
+
+        recipe = Recipe.objects.using('shard_0').get(pk=self.recipe.pk)
+        self.assertEqual(
+            [tag.name for tag in recipe.tags.all()], ['Vegan']
+        )
+        self.assertFalse(Recipe.objects.using('default').exists())
@@ -0,0 +1,109 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import slow_queries
+from core.models import Recipe
+
+
+SLOW_QUERIES_URL = reverse('core:slow-queries')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class FingerprintTests(TestCase):
+
+    def test_literals_and_in_lists_collapsed(self):
+        first = slow_queries.normalize(
+            "SELECT * FROM \"core_recipe\" WHERE \"id\" IN (%s, %s, %s) "
+            "AND title = 'Soup' LIMIT 21"
+        )
+        second = slow_queries.normalize(
+            "SELECT *  FROM \"core_recipe\" WHERE \"id\" IN (%s) "
+            "AND title = 'Cake''s'  LIMIT 5"
+        )
+        self.assertEqual(first, second)
+        self.assertIn('IN (...)', first)
+
+    def test_redact(self):
+        self.assertEqual(
+            slow_queries.redact(['secret', 5, None, [1, 2]]),
+            ['<str:6>', '<int>', None, '<list:2>']
+        )
+
+    def test_redact_plan(self):
+        plan = slow_queries.redact_plan(
+            "Index Scan using core_user_email_key on core_user\n"
+            "  Index Cond: ((email)::text = 'test@mail.com'::text)\n"
+            "  Filter: (id > 42)\n"
+            "  Rows Removed by Filter: 3"
+        )
+
+        self.assertNotIn('test@mail.com', plan)
+        self.assertIn("Index Cond: ((email)::text = ?::text)", plan)
+        self.assertIn('Filter: (id > ?)', plan)
+        self.assertIn('Rows Removed by Filter: 3', plan)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0.0001)
+class SlowQueryLogTests(TestCase):
+
+    def setUp(self):
+        slow_queries.reset()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123', is_staff=True
+        )
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        slow_queries.reset()
+
+    def test_queries_recorded_with_call_site_and_plan(self):
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            self.client.get(RECIPES_URL)
+
+        res = self.client.get(SLOW_QUERIES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe_query = next(
+            stats for stats in res.data['queries']
+            if 'FROM "core_recipe"' in stats['sql']
+        )
+        self.assertIn('recipe.views.RecipeViewSet', recipe_query['views'])
+        self.assertTrue(recipe_query['call_sites'])
+        self.assertTrue(recipe_query['explain'])
+        self.assertNotIn('test@mail.com', str(res.data))
+
+    def test_plans_do_not_contain_literals(self):
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            with slow_queries.wrap_connections(None, 0.0001):
+                list(Recipe.objects.filter(title='Secret soup'))
+
+        self.assertNotIn('Secret soup', str(logs.output))
+        self.assertNotIn('Secret soup', str(slow_queries.get_stats()))
+
+    def test_command_and_reset(self):
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            self.client.get(RECIPES_URL)
+
+        out = StringIO()
+        call_command('slow_queries', '--explain', stdout=out)
+        self.assertIn('core_recipe', out.getvalue())
+
+        call_command('slow_queries', '--reset', stdout=StringIO())
+        self.assertEqual(slow_queries.get_stats(), [])
+
+    def test_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+
+        res = self.client.get(SLOW_QUERIES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
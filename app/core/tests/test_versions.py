@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.test import TestCase
+from core import versions
+from core.models import CacheVersion
+
+
+class VersionTests(TestCase):
+
+    def test_bump_and_read(self):
+        self.assertEqual(versions.get_version('stats', 1), 0)
+
+        self.assertEqual(versions.bump_version('stats', 1), 1)
+        self.assertEqual(versions.bump_version('stats', 1), 2)
+        versions.bump_version('other', 1)
+
+        self.assertEqual(versions.get_version('stats', 1), 2)
+        self.assertEqual(versions.get_version('stats', 2), 0)
+        self.assertEqual(
+            versions.get_versions(['stats', 'other', 'missing'], 1),
+            {'stats': 2, 'other': 1, 'missing': 0}
+        )
+
+    def test_counters_survive_cache_clear(self):
+        versions.bump_version('stats', 1)
+
+        cache.clear()
+
+        self.assertEqual(versions.get_version('stats', 1), 1)
+        self.assertEqual(CacheVersion.objects.get().value, 1)
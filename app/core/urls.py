@@ -0,0 +1,17 @@
+from django.urls import path
+from core import views
+
+
+app_name = 'core'
+
+urlpatterns = [
+    path('profiles/', views.ProfileListView.as_view(), name='profiles'),
+    path('profiles/token/', views.ProfileTokenView.as_view(),
+         name='profile-token'),
+    path('profiles/<str:name>/', views.ProfileDetailView.as_view(),
+         name='profile-detail'),
+    path('slow-queries/', views.SlowQueryView.as_view(),
+         name='slow-queries'),
+    path('query-budgets/', views.QueryBudgetView.as_view(),
+         name='query-budgets'),
+]
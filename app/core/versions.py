@@ -0,0 +1,77 @@
+"""
+Per-user version counters. Bumping a counter makes every cache entry keyed
+under the previous version unreachable.
+
+The counters are rows of ``CacheVersion`` on the primary database rather
+than cache entries: every web and worker process sees the same value, a
+bump is one atomic ``UPDATE``, and a counter can never be evicted and
+restart at a value some process has already cached data under. A bump
+inside a transaction is only seen by other processes once it commits,
+together with the change it announces.
+
+Hot paths that can serve slightly stale data read counters through
+``get_recent_version``, which reuses a value this process read or bumped
+less than ``max_age`` seconds ago.
+"""
+import time
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+
+from core.models import CacheVersion
+
+
+MAX_RECENT = 10000
+
+_recent = {}
+
+
+def _counters():
+    return CacheVersion.objects.using(DEFAULT_DB_ALIAS)
+
+
+def get_version(name, user_id):
+    return get_versions([name], user_id)[name]
+
+
+def get_versions(names, user_id):
+    found = dict(_counters().filter(
+        owner_id=user_id, name__in=list(names)
+    ).values_list('name', 'value'))
+    return {name: found.get(name, 0) for name in names}
+
+
+def _remember(name, user_id, value):
+    if len(_recent) >= MAX_RECENT:
+        _recent.clear()
+    _recent[(name, user_id)] = (value, time.monotonic())
+
+
+def get_recent_version(name, user_id, max_age):
+    """Version of name read by this process at most max_age seconds ago"""
+    entry = _recent.get((name, user_id))
+    if entry is not None and time.monotonic() - entry[1] <= max_age:
+        return entry[0]
+    value = get_version(name, user_id)
+    _remember(name, user_id, value)
+    return value
+
+
+def forget_recent():
+    _recent.clear()
+
+
+def bump_version(name, user_id):
+    counter = _counters().filter(owner_id=user_id, name=name)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if not counter.update(value=F('value') + 1):
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    _counters().create(owner_id=user_id, name=name, value=1)
+                _remember(name, user_id, 1)
+                return 1
+            except IntegrityError:
+                counter.update(value=F('value') + 1)
+        value = counter.values_list('value', flat=True).get()
+    _remember(name, user_id, value)
+    return value
@@ -0,0 +1,77 @@
+from django.http import Http404, HttpResponse, JsonResponse
+from rest_framework import authentication, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from core import batch, budgets, profiling, slow_queries
+from core.serializers import BatchSerializer
+
+
+class StaffAPIView(APIView):
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+
+
+class ProfileListView(StaffAPIView):
+
+    def get(self, request):
+        return Response({'profiles': profiling.list_profiles()})
+
+
+class ProfileDetailView(StaffAPIView):
+
+    def get(self, request, name):
+        profile = profiling.load_profile(name)
+        if profile is None:
+            raise Http404
+        if request.query_params.get('output') == 'collapsed':
+            return HttpResponse(
+                profiling.collapsed(profile), content_type='text/plain'
+            )
+        response = JsonResponse(profile)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{name}{profiling.SUFFIX}"'
+        )
+        return response
+
+
+class ProfileTokenView(StaffAPIView):
+    """Mint a value for the X-Profile header"""
+
+    def post(self, request):
+        memory = str(request.data.get('memory', '')).lower() in ('1', 'true')
+        return Response({'header': 'X-Profile',
+                         'token': profiling.make_token(memory)})
+
+
+class SlowQueryView(StaffAPIView):
+
+    def get(self, request):
+        return Response({'queries': slow_queries.get_stats()})
+
+    def delete(self, request):
+        slow_queries.reset()
+        return Response(status=204)
+
+
+class QueryBudgetView(StaffAPIView):
+
+    def get(self, request):
+        return Response({'rejections': budgets.get_stats()})
+
+    def delete(self, request):
+        budgets.reset()
+        return Response(status=204)
+
+
+class BatchView(APIView):
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 'bulk'
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'responses': batch.run(
+            request, serializer.validated_data['requests'],
+            parallel=serializer.validated_data['parallel']
+        )})
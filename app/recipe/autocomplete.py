@@ -0,0 +1,111 @@
+"""
+Prefix autocomplete for tag and ingredient names.
+
+Each process keeps, per user and kind, the user's names sorted by their
+lower-cased form; a prefix lookup is a bisect plus a short scan and runs
+no query. Saves and deletes bump the per-user version from signals; the
+process that saved sees the new version at once, the others within
+``AUTOCOMPLETE_VERSION_SECONDS``. Vocabularies above
+``AUTOCOMPLETE_MAX_NAMES`` are not cached and are answered by a
+``LIKE 'prefix%'`` query on the rows' ``folded_name``, which Postgres
+serves from the per-user ``(user_id, folded_name varchar_pattern_ops)``
+indexes without touching other users' names.
+"""
+import bisect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+
+from core import versions
+from core.models import Tag, Ingredient
+
+
+MODELS = {
+    'tag': Tag,
+    'ingredient': Ingredient,
+}
+
+
+def _version_name(kind):
+    return f'autocomplete-{kind}'
+
+
+class PrefixIndex:
+
+    def __init__(self, rows):
+        rows = sorted((name.lower(), pk, name) for pk, name in rows)
+        self.keys = [row[0] for row in rows]
+        self.items = [{'id': row[1], 'name': row[2]} for row in rows]
+
+    def search(self, prefix, limit):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\uffff', lo=start)
+        return self.items[start:min(end, start + limit)]
+
+
+class PrefixIndexCache:
+    """Per-process LRU of prefix indexes keyed by (kind, user id)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def get(self, kind, user_id, version):
+        with self._lock:
+            entry = self._indexes.get((kind, user_id))
+            if entry is None or entry[0] != version:
+                return None
+            self._indexes.move_to_end((kind, user_id))
+            return entry[1]
+
+    def set(self, kind, user_id, version, index):
+        max_users = getattr(settings, 'AUTOCOMPLETE_MAX_USERS', 1000)
+        with self._lock:
+            self._indexes[(kind, user_id)] = (version, index)
+            self._indexes.move_to_end((kind, user_id))
+            while len(self._indexes) > max_users:
+                self._indexes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+index_cache = PrefixIndexCache()
+
+
+def _query(kind, user_id, prefix, limit):
+    rows = MODELS[kind].objects.filter(
+        user_id=user_id, folded_name__startswith=prefix.lower()
+    ).order_by('folded_name', 'id').values(
+        'id', name=F('term__value')
+    )[:limit]
+    return list(rows)
+
+
+def search(kind, user_id, prefix, limit=10):
+    version = versions.get_recent_version(
+        _version_name(kind), user_id,
+        getattr(settings, 'AUTOCOMPLETE_VERSION_SECONDS', 2)
+    )
+    index = index_cache.get(kind, user_id, version)
+    if index is not None:
+        return index.search(prefix, limit)
+
+    max_names = getattr(settings, 'AUTOCOMPLETE_MAX_NAMES', 50000)
+    rows = list(
+        MODELS[kind].objects.filter(user_id=user_id)
+        .values_list('id', 'term__value')[:max_names + 1]
+    )
+    if len(rows) > max_names:
+        return _query(kind, user_id, prefix, limit)
+    index = PrefixIndex(rows)
+    index_cache.set(kind, user_id, version, index)
+    return index.search(prefix, limit)
+
+
+def names_changed(kind, user_id):
+    versions.bump_version(_version_name(kind), user_id)
@@ -0,0 +1,347 @@
+"""
+Server-sent change notifications.
+
+``sse_application`` is a plain ASGI app mounted in ``app/asgi.py`` at
+``EVENTS_PATH``. Each connection is one coroutine waiting on a small
+bounded queue, so idle clients cost a few hundred bytes and no threads.
+Changes recorded in ``recipe.changes`` are published after commit through
+the broker named by ``settings.EVENT_BROKER``. ``LocalBroker`` fans out
+inside the current process. With several processes, e.g. the purge worker
+next to the web servers, ``PostgresBroker`` relays every event through
+Postgres ``NOTIFY`` to a listener thread in each process that has
+subscribers, which hands it to ``LocalBroker.publish``.
+
+When a client falls behind and its queue overflows, queued events are
+dropped and a single ``resync`` event tells it to catch up through the
+``changes/`` endpoint instead.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = '/api/recipe/events/'
+RESYNC = {'type': 'resync'}
+
+
+class Subscription:
+
+    def __init__(self, user_id, loop, max_size):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def push(self, event):
+        """Queue an event, must be called from the subscription's loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.overflowed = True
+
+    async def get(self, timeout):
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is RESYNC:
+            self.overflowed = False
+        return event
+
+    def close(self):
+        self.push(None)
+
+
+class BaseBroker:
+
+    def subscribe(self, user_id):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, user_id, event):
+        raise NotImplementedError
+
+    def publish_many(self, user_id, events):
+        for event in events:
+            self.publish(user_id, event)
+
+
+class LocalBroker(BaseBroker):
+    """In-process fan-out to the subscriptions of each user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(
+            user_id, asyncio.get_running_loop(),
+            getattr(settings, 'EVENT_QUEUE_SIZE', 100)
+        )
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(
+                    subscription.push, event
+                )
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+    def resync_all(self):
+        with self._lock:
+            subscriptions = [
+                subscription for subscriptions in self._subscriptions.values()
+                for subscription in subscriptions
+            ]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(
+                    subscription.push, RESYNC
+                )
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    """Fan-out across processes through Postgres LISTEN/NOTIFY.
+
+    Events are sent with ``pg_notify`` on the default connection, at most
+    ``BATCH_SIZE`` per notification to stay below the 8000 byte payload
+    limit. The first subscription of a process starts a thread that holds
+    one extra connection listening on ``CHANNEL``; after a reconnect every
+    subscriber gets a ``resync`` since notifications may have been missed.
+    """
+    CHANNEL = 'recipe_events'
+    BATCH_SIZE = 50
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = super().subscribe(user_id)
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name='event-listener', daemon=True
+                )
+                self._listener.start()
+        return subscription
+
+    def publish(self, user_id, event):
+        self.publish_many(user_id, [event])
+
+    def publish_many(self, user_id, events):
+        events = list(events)
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            for start in range(0, len(events), self.BATCH_SIZE):
+                payload = json.dumps({
+                    'user_id': user_id,
+                    'events': events[start:start + self.BATCH_SIZE],
+                }, separators=(',', ':'))
+                cursor.execute(
+                    'SELECT pg_notify(%s, %s)', [self.CHANNEL, payload]
+                )
+
+    def deliver(self, payload):
+        """Pass one received notification to this process' subscribers"""
+        message = json.loads(payload)
+        for event in message['events']:
+            super().publish(message['user_id'], event)
+
+    def _connect(self):
+        wrapper = connections[DEFAULT_DB_ALIAS]
+        connection = wrapper.get_new_connection(
+            wrapper.get_connection_params()
+        )
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.CHANNEL}')
+        return connection
+
+    def _listen(self):
+        connected_before = False
+        while True:
+            try:
+                connection = self._connect()
+            except Exception:
+                logger.exception('Could not listen for change events')
+                time.sleep(1)
+                continue
+            if connected_before:
+                self.resync_all()
+            connected_before = True
+            try:
+                while True:
+                    if not select.select([connection], [], [], 5)[0]:
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.deliver(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Lost the change event listener connection')
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(
+                settings, 'EVENT_BROKER', 'recipe.events.LocalBroker'
+            )
+            _broker = import_string(path)()
+        return _broker
+
+
+def publish(user_id, kind, object_ids, action):
+    get_broker().publish_many(user_id, [
+        {'type': kind, 'action': action, 'id': object_id}
+        for object_id in object_ids
+    ])
+
+
+def format_event(event):
+    if event is RESYNC:
+        return b'event: resync\ndata: {}\n\n'
+    data = json.dumps(event, separators=(',', ':'))
+    return f'event: change\ndata: {data}\n\n'.encode()
+
+
+def _get_token(scope):
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin-1').partition(' ')
+            if keyword.lower() == 'token' and key:
+                return key.strip()
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    tokens = query.get('token')
+    return tokens[0] if tokens else None
+
+
+@sync_to_async
+def _get_user_id(key):
+    from rest_framework.authtoken.models import Token
+
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user_id
+
+
+async def _send_json(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps(body).encode(),
+    })
+
+
+async def sse_application(scope, receive, send):
+    if scope['method'] != 'GET':
+        await _send_json(send, 405, {'detail': 'Method not allowed.'})
+        return
+    key = _get_token(scope)
+    user_id = await _get_user_id(key) if key else None
+    if user_id is None:
+        await _send_json(
+            send, 401, {'detail': 'Authentication credentials were not '
+                                  'provided or are invalid.'}
+        )
+        return
+
+    broker = get_broker()
+    subscription = broker.subscribe(user_id)
+    heartbeat = getattr(settings, 'EVENT_HEARTBEAT_SECONDS', 15)
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                subscription.close()
+                return
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'retry: 5000\n\n',
+            'more_body': True,
+        })
+        while True:
+            event = await subscription.get(heartbeat)
+            if event is None:
+                if watcher.done():
+                    break
+                body = b': ping\n\n'
+            else:
+                body = format_event(event)
+            await send({
+                'type': 'http.response.body',
+                'body': body,
+                'more_body': True,
+            })
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(subscription)
@@ -0,0 +1,225 @@
+"""
+Perceptual hashes of recipe images for near-duplicate detection.
+
+``phash`` is the usual DCT hash: the image is reduced to 32x32 grey
+pixels, transformed with a 2-D DCT and the 8x8 lowest frequencies are
+compared with their median, giving 64 bits that survive recompression and
+resizing. Hashes are stored in ``Recipe.image_hash`` (as a signed 64-bit
+integer) and searched in memory: a ``HashIndex`` keeps the hashes of a user,
+or of every user, in one NumPy array and computes all Hamming distances at
+once with XOR and a byte popcount table, a few milliseconds per million
+images.
+
+User indexes are cached per process like the similarity indexes and kept
+current through the ``image-hash`` version. The index over all users is
+large, so it is only reloaded every ``IMAGE_INDEX_GLOBAL_TTL`` seconds and
+meanwhile patched with the uploads this process handles.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from core import versions
+from core.models import Recipe
+from core.sharding import get_shards, shard_for_user
+
+
+VERSION = 'image-hash'
+SAMPLE_SIZE = 32
+HASH_SIZE = 8
+CHUNK_SIZE = 1 << 20
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(size):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_DCT = _dct_matrix(SAMPLE_SIZE)
+
+
+def phash(image):
+    """64-bit perceptual hash of a PIL image as an unsigned int"""
+    image = ImageOps.exif_transpose(image).convert('L').resize(
+        (SAMPLE_SIZE, SAMPLE_SIZE), Image.LANCZOS
+    )
+    pixels = np.asarray(image, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_file(file):
+    """Hash of an uploaded or stored image file, None if unreadable"""
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            return phash(image)
+    except (OSError, ValueError):
+        return None
+    finally:
+        file.seek(0)
+
+
+def to_db(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_db(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(hashes, value):
+    """Hamming distances between a uint64 array and one hash"""
+    distances = np.empty(len(hashes), dtype=np.uint8)
+    for start in range(0, len(hashes), CHUNK_SIZE):
+        diff = np.bitwise_xor(hashes[start:start + CHUNK_SIZE],
+                              np.uint64(value))
+        distances[start:start + CHUNK_SIZE] = _POPCOUNT[
+            diff.view(np.uint8)
+        ].reshape(-1, 8).sum(axis=1)
+    return distances
+
+
+class HashIndex:
+    """Recipe ids and hashes, replaced together so searches never see an
+    id without its hash
+    """
+
+    def __init__(self, rows, version=None):
+        ids, hashes = zip(*rows) if rows else ((), ())
+        self.entries = (
+            np.array(ids, dtype=np.int64),
+            np.array(hashes, dtype=np.int64).view(np.uint64),
+        )
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries[0])
+
+    def add(self, recipe_id, image_hash):
+        with self.lock:
+            ids, hashes = self.entries
+            keep = ids != recipe_id
+            self.entries = (
+                np.append(ids[keep], recipe_id),
+                np.append(hashes[keep], np.uint64(image_hash)),
+            )
+
+    def search(self, image_hash, max_distance, limit=10, exclude=None):
+        """[(recipe id, distance)] closest first"""
+        ids, hashes = self.entries
+        distances = hamming(hashes, image_hash)
+        mask = distances <= max_distance
+        if exclude is not None:
+            mask &= ids != exclude
+        found = np.flatnonzero(mask)
+        found = found[np.argsort(distances[found], kind='stable')][:limit]
+        return [(int(ids[i]), int(distances[i])) for i in found]
+
+
+def load_rows(user_id=None):
+    if user_id is not None:
+        aliases = [shard_for_user(user_id)]
+    else:
+        aliases = get_shards()
+    rows = []
+    for alias in aliases:
+        recipes = Recipe.objects.using(alias).filter(image_hash__isnull=False)
+        if user_id is not None:
+            recipes = recipes.filter(user_id=user_id)
+        rows.extend(recipes.values_list('id', 'image_hash').iterator())
+    return rows
+
+
+class HashIndexRegistry:
+    """Per-process LRU of user indexes plus the index over all users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._global = None
+
+    def get(self, user_id):
+        version = versions.get_version(VERSION, user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+                return index
+        index = HashIndex(load_rows(user_id), version)
+        max_users = getattr(settings, 'IMAGE_INDEX_MAX_USERS', 1000)
+        with self._lock:
+            self._indexes[user_id] = index
+            while len(self._indexes) > max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def get_global(self):
+        ttl = getattr(settings, 'IMAGE_INDEX_GLOBAL_TTL', 300)
+        index = self._global
+        if index is None or time.monotonic() - index.loaded_at > ttl:
+            index = self._global = HashIndex(load_rows())
+        return index
+
+    def loaded(self, user_id):
+        with self._lock:
+            return self._indexes.get(user_id)
+
+    def loaded_global(self):
+        return self._global
+
+    def discard(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._global = None
+
+
+registry = HashIndexRegistry()
+
+
+def max_distance():
+    return getattr(settings, 'IMAGE_DUPLICATE_DISTANCE', 6)
+
+
+def find_duplicates(user_id, image_hash, exclude=None, limit=10):
+    """Near-duplicates among a user's images, or all images for None"""
+    if image_hash is None:
+        return []
+    index = registry.get(user_id) if user_id is not None else \
+        registry.get_global()
+    return index.search(image_hash, max_distance(), limit, exclude)
+
+
+def image_changed(user_id, recipe_id, image_hash):
+    """Add a new hash to loaded indexes and publish the new version"""
+    version = versions.bump_version(VERSION, user_id)
+    index = registry.loaded(user_id)
+    if index is not None:
+        if index.version == version - 1:
+            index.add(recipe_id, image_hash)
+            index.version = version
+        else:
+            registry.discard(user_id)
+    index = registry.loaded_global()
+    if index is not None:
+        index.add(recipe_id, image_hash)
+
+
+def invalidate(user_id):
+    versions.bump_version(VERSION, user_id)
+    registry.discard(user_id)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from core.models import Recipe
+from core.sharding import get_shards
+from recipe import image_hashes
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hash of recipe images that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only this user')
+
+    def handle(self, *args, **options):
+        for alias in get_shards():
+            recipes = Recipe.objects.using(alias).filter(
+                image_hash__isnull=True
+            ).exclude(image='').order_by('id')
+            if options['user'] is not None:
+                recipes = recipes.filter(user_id=options['user'])
+            hashed, unreadable, users = 0, 0, set()
+            for recipe in recipes.only('id', 'user_id', 'image').iterator():
+                try:
+                    with recipe.image.open('rb') as file:
+                        value = image_hashes.hash_file(file)
+                except OSError:
+                    value = None
+                if value is None:
+                    unreadable += 1
+                    continue
+                Recipe.objects.using(alias).filter(pk=recipe.pk).update(
+                    image_hash=image_hashes.to_db(value)
+                )
+                users.add(recipe.user_id)
+                hashed += 1
+            for user_id in users:
+                image_hashes.invalidate(user_id)
+            self.stdout.write(self.style.SUCCESS(
+                f'{alias}: hashed {hashed} image(s), {unreadable} unreadable'
+            ))
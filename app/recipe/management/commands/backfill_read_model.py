@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.sharding import get_shards
+from recipe import read_model
+
+
+class Command(BaseCommand):
+    help = 'Build the denormalized tags and ingredients of every recipe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only this user')
+
+    def handle(self, *args, **options):
+        for alias in get_shards():
+            total = 0
+            for ids in read_model.iter_batches(alias, options['user']):
+                with transaction.atomic(using=alias):
+                    read_model.save(read_model.build(ids, alias), alias)
+                total += len(ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'{alias}: rebuilt {total} recipe(s)'
+            ))
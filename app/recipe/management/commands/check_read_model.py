@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core.sharding import get_shards
+from recipe import read_model
+
+
+class Command(BaseCommand):
+    help = 'Compare the denormalized recipe relations with the M2M tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only this user')
+        parser.add_argument('--fix', action='store_true',
+                            help='Rewrite the recipes that drifted')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for alias in get_shards():
+            for ids in read_model.iter_batches(alias, options['user']):
+                with transaction.atomic(using=alias):
+                    drift = read_model.find_drift(ids, alias)
+                    if drift and options['fix']:
+                        read_model.save(drift, alias)
+                for recipe_id in drift:
+                    self.stdout.write(f'{alias}: recipe {recipe_id} drifted')
+                drifted += len(drift)
+
+        if drifted and not options['fix']:
+            raise CommandError(f'{drifted} recipe(s) out of date')
+        self.stdout.write(self.style.SUCCESS(
+            f'{drifted} recipe(s) fixed' if drifted else 'No drift found'
+        ))
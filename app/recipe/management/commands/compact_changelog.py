@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.sharding import get_shards
+from recipe import changes
+
+
+class Command(BaseCommand):
+    help = 'Drop superseded change log entries and expired tombstones'
+
+    def handle(self, *args, **options):
+        for alias in get_shards():
+            superseded, expired = changes.compact(alias)
+            self.stdout.write(self.style.SUCCESS(
+                f'{alias}: removed {superseded} superseded and {expired} '
+                'expired entries'
+            ))
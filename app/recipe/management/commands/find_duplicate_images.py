@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Recipe
+from core.sharding import get_shards
+from recipe import image_hashes
+
+
+class Command(BaseCommand):
+    help = 'List near-duplicates of a recipe image across all users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('recipe', type=int)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--distance', type=int,
+                            help='Maximum Hamming distance, defaults to '
+                                 'IMAGE_DUPLICATE_DISTANCE')
+
+    def handle(self, *args, **options):
+        for alias in get_shards():
+            recipe = Recipe.objects.using(alias).filter(
+                pk=options['recipe']
+            ).first()
+            if recipe is not None:
+                break
+        else:
+            raise CommandError(f'Recipe {options["recipe"]} does not exist')
+        if recipe.image_hash is None:
+            raise CommandError('Recipe image has no hash, run '
+                               'backfill_image_hashes first')
+
+        distance = options['distance']
+        if distance is None:
+            distance = image_hashes.max_distance()
+        found = image_hashes.registry.get_global().search(
+            image_hashes.from_db(recipe.image_hash), distance,
+            options['limit'], exclude=recipe.pk
+        )
+        for pk, value in found:
+            self.stdout.write(f'{pk}\t{value}')
+        self.stdout.write(self.style.SUCCESS(f'{len(found)} duplicate(s)'))
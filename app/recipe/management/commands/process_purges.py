@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipe import purge
+
+
+class Command(BaseCommand):
+    help = 'Run pending account and recipe deletion jobs in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new jobs')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            finished = purge.process_jobs()
+            if finished:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Finished {finished} purge job(s)'
+                ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,97 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Seek pagination over ``(ordering field, id)``.
+
+    Only used when the client sends ``limit`` or ``cursor``; the page is
+    fetched with a ``WHERE (field, id) > (last field, last id)`` style
+    predicate so deep pages cost the same as the first one. The view must
+    provide ``get_ordering()`` returning e.g. ``'-price'``.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def _decode(self, cursor, model, field):
+        """Return the cursor's values converted and validated by the model
+        fields they are compared with
+        """
+        try:
+            value, last_id = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()).decode()
+            )
+            value = model._meta.get_field(field).clean(value, None)
+            last_id = model._meta.pk.clean(last_id, None)
+            return value, last_id
+        except (ValueError, TypeError, DjangoValidationError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def _encode(self, value, last_id):
+        if isinstance(value, Decimal):
+            value = str(value)
+        payload = json.dumps([value, last_id]).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    def _get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError(
+                {'limit': f'Must be between 1 and {self.max_limit}.'}
+            )
+        return limit
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if 'limit' not in params and 'cursor' not in params:
+            return None
+
+        ordering = view.get_ordering()
+        descending = ordering.startswith('-')
+        field = ordering.lstrip('-')
+        self.field = field
+        self.request = request
+        self.limit = self._get_limit(request)
+
+        cursor = params.get('cursor')
+        if cursor:
+            value, last_id = self._decode(cursor, queryset.model, field)
+            lookup = 'lt' if descending else 'gt'
+            if field == 'id':
+                queryset = queryset.filter(**{f'id__{lookup}': last_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__{lookup}': value}) |
+                    Q(**{field: value, f'id__{lookup}': last_id})
+                )
+
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self._encode(getattr(last, self.field), last.pk)
+        return replace_query_param(
+            self.request.build_absolute_uri(), 'cursor', cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
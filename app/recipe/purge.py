@@ -0,0 +1,172 @@
+"""
+Chunked deletion of a user's recipe data, and of the user itself.
+
+Requests only record a ``PurgeJob``; ``manage.py process_purges`` deletes
+the rows in batches of ``PURGE_BATCH_SIZE`` with raw bulk DELETEs (no
+collector, nothing loaded into memory besides the IDs of one batch), each
+batch in its own short transaction. Every batch re-selects what is left,
+so a job whose worker died is simply picked up again once its heartbeat
+is older than ``PURGE_STALE_SECONDS``.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.models import ChangeLogEntry, PurgeJob, Tag, Ingredient, Recipe
+from core.sharding import shard_for_user
+from recipe import autocomplete, changes, image_hashes, similarity, stats
+
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size():
+    return getattr(settings, 'PURGE_BATCH_SIZE', 500)
+
+
+def start_recipe_purge(user):
+    recipes = Recipe.objects.using(shard_for_user(user.pk)).filter(user=user)
+    summary = recipes.aggregate(max_id=Max('id'))
+    return PurgeJob.objects.using(DEFAULT_DB_ALIAS).create(
+        owner_id=user.pk,
+        scope=PurgeJob.RECIPES,
+        max_recipe_id=summary['max_id'],
+        total_recipes=recipes.count(),
+    )
+
+
+def start_user_purge(user):
+    """Lock the account out right away and queue deletion of its data"""
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=user.pk
+        ).update(is_active=False)
+        Token.objects.using(DEFAULT_DB_ALIAS).filter(user=user).delete()
+        return PurgeJob.objects.using(DEFAULT_DB_ALIAS).create(
+            owner_id=user.pk,
+            scope=PurgeJob.USER,
+            total_recipes=Recipe.objects.using(
+                shard_for_user(user.pk)
+            ).filter(user=user).count(),
+        )
+
+
+def _delete_recipe_batch(job, using):
+    recipes = Recipe.objects.using(using).filter(user_id=job.owner_id)
+    if job.max_recipe_id is not None:
+        recipes = recipes.filter(id__lte=job.max_recipe_id)
+    elif job.scope == PurgeJob.RECIPES:
+        return 0
+    ids = list(recipes.order_by('id').values_list('id', flat=True)
+               [:batch_size()])
+    if not ids:
+        return 0
+    with transaction.atomic(using=using):
+        for through in (Recipe.tags.through, Recipe.ingredients.through):
+            through.objects.using(using).filter(
+                recipe_id__in=ids
+            )._raw_delete(using)
+        Recipe.objects.using(using).filter(id__in=ids)._raw_delete(using)
+        if job.scope == PurgeJob.RECIPES:
+            changes.record(
+                job.owner_id, 'recipe', ids, ChangeLogEntry.DELETE
+            )
+    PurgeJob.objects.using(DEFAULT_DB_ALIAS).filter(pk=job.pk).update(
+        deleted_recipes=job.deleted_recipes + len(ids),
+        heartbeat_at=timezone.now()
+    )
+    job.deleted_recipes += len(ids)
+    return len(ids)
+
+
+def _delete_owned_batch(job, model, counter, using):
+    ids = list(model.objects.using(using).filter(
+        user_id=job.owner_id
+    ).order_by('id').values_list('id', flat=True)[:batch_size()])
+    if not ids:
+        return 0
+    with transaction.atomic(using=using):
+        if model is not ChangeLogEntry:
+            field = 'tag_id' if model is Tag else 'ingredient_id'
+            through = Recipe.tags.through if model is Tag else \
+                Recipe.ingredients.through
+            through.objects.using(using).filter(
+                **{f'{field}__in': ids}
+            )._raw_delete(using)
+        model.objects.using(using).filter(id__in=ids)._raw_delete(using)
+    update = {'heartbeat_at': timezone.now()}
+    if counter:
+        setattr(job, counter, getattr(job, counter) + len(ids))
+        update[counter] = getattr(job, counter)
+    PurgeJob.objects.using(DEFAULT_DB_ALIAS).filter(pk=job.pk).update(
+        **update
+    )
+    return len(ids)
+
+
+def run_job(job):
+    using = shard_for_user(job.owner_id)
+    while _delete_recipe_batch(job, using):
+        pass
+    if job.scope == PurgeJob.USER:
+        for model, counter in ((Tag, 'deleted_tags'),
+                               (Ingredient, 'deleted_ingredients'),
+                               (ChangeLogEntry, None)):
+            while _delete_owned_batch(job, model, counter, using):
+                pass
+        get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=job.owner_id
+        ).delete()
+
+    # Versions live in the database, so these reach the caches of every
+    # process, not just this worker's
+    stats.data_changed(job.owner_id, *stats.SECTIONS)
+    similarity.invalidate(job.owner_id)
+    image_hashes.invalidate(job.owner_id)
+    autocomplete.names_changed('tag', job.owner_id)
+    autocomplete.names_changed('ingredient', job.owner_id)
+    PurgeJob.objects.using(DEFAULT_DB_ALIAS).filter(pk=job.pk).update(
+        status=PurgeJob.DONE, finished_at=timezone.now()
+    )
+
+
+def claim_next_job():
+    """Atomically take a pending job or one whose worker went quiet"""
+    stale = timezone.now() - timedelta(
+        seconds=getattr(settings, 'PURGE_STALE_SECONDS', 300)
+    )
+    jobs = PurgeJob.objects.using(DEFAULT_DB_ALIAS)
+    available = Q(status=PurgeJob.PENDING) | Q(
+        status=PurgeJob.RUNNING, heartbeat_at__lt=stale
+    )
+    for job_id in jobs.filter(available).order_by('id').values_list(
+            'id', flat=True)[:10]:
+        claimed = jobs.filter(available, pk=job_id).update(
+            status=PurgeJob.RUNNING, heartbeat_at=timezone.now()
+        )
+        if claimed:
+            return jobs.get(pk=job_id)
+    return None
+
+
+def process_jobs():
+    """Run claimable jobs until none are left, return how many finished"""
+    finished = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return finished
+        try:
+            run_job(job)
+            finished += 1
+        except Exception as exc:
+            logger.exception('Purge job %s failed', job.pk)
+            PurgeJob.objects.using(DEFAULT_DB_ALIAS).filter(
+                pk=job.pk
+            ).update(status=PurgeJob.FAILED, error=str(exc))
@@ -0,0 +1,98 @@
+"""
+Denormalized tag and ingredient lists stored on each recipe.
+
+``Recipe.relations`` holds ``{"tags": [{"id", "name"}], "ingredients":
+[...]}`` so recipes render from their own row without the M2M joins. The
+signal receivers rebuild it inside the transaction of every write that
+changes a recipe's tags or ingredients or renames one of them. Recipes
+whose ``relations`` is still empty (not backfilled yet) are rendered from
+the M2M tables as before.
+
+``manage.py backfill_read_model`` fills it in for existing recipes and
+``manage.py check_read_model`` reports (and with ``--fix`` repairs) rows
+that drifted from the M2M tables.
+"""
+from core.models import Recipe
+
+
+BATCH_SIZE = 500
+RELATIONS = ('tags', 'ingredients')
+
+
+def empty():
+    return {name: [] for name in RELATIONS}
+
+
+def cached(instance, name):
+    """The denormalized list for name, or None if not built yet"""
+    relations = getattr(instance, 'relations', None)
+    if relations and name in relations:
+        return relations[name]
+    return None
+
+
+def build(recipe_ids, using):
+    """Compute the relations of recipes from the M2M tables"""
+    relations = {pk: empty() for pk in recipe_ids}
+    for name in RELATIONS:
+        field = Recipe._meta.get_field(name)
+        target = field.m2m_reverse_name()
+        related_name = field.related_model._meta.model_name + '__term__value'
+        rows = field.remote_field.through.objects.using(using).filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', target, related_name).order_by(target)
+        for recipe_id, pk, value in rows:
+            relations[recipe_id][name].append({'id': pk, 'name': value})
+    return relations
+
+
+def save(relations, using):
+    Recipe.objects.using(using).bulk_update(
+        [Recipe(pk=pk, relations=value) for pk, value in relations.items()],
+        ['relations'], batch_size=BATCH_SIZE
+    )
+
+
+def rebuild(recipe_ids, using, instance=None):
+    """Rebuild and store the relations of recipes, refreshing instance"""
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        relations = build(recipe_ids[start:start + BATCH_SIZE], using)
+        save(relations, using)
+        if instance is not None and instance.pk in relations:
+            instance.relations = relations[instance.pk]
+
+
+def recipe_created(instance, using):
+    instance.relations = empty()
+    Recipe.objects.using(using).filter(pk=instance.pk).update(
+        relations=instance.relations
+    )
+
+
+def iter_batches(using, user_id=None):
+    """Recipe IDs of a database in batches of BATCH_SIZE"""
+    recipes = Recipe.objects.using(using).order_by('id')
+    if user_id is not None:
+        recipes = recipes.filter(user_id=user_id)
+    last_id = 0
+    while True:
+        ids = list(recipes.filter(id__gt=last_id).values_list(
+            'id', flat=True
+        )[:BATCH_SIZE])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def find_drift(recipe_ids, using):
+    """{recipe id: expected relations} of recipes that are out of date"""
+    expected = build(recipe_ids, using)
+    stored = dict(Recipe.objects.using(using).filter(
+        id__in=recipe_ids
+    ).values_list('id', 'relations'))
+    return {
+        pk: value for pk, value in expected.items()
+        if pk in stored and stored[pk] != value
+    }
@@ -1,8 +1,85 @@
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+from rest_framework.relations import ManyRelatedField, PKOnlyObject, \
+    MANY_RELATION_KWARGS
+from core.models import Tag, Ingredient, Recipe, PurgeJob
+from recipe import read_model
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    """Resolve a whole list of primary keys with a single query"""
+    default_error_messages = dict(
+        ManyRelatedField.default_error_messages,
+        does_not_exist='Invalid pk(s) {pk_list} - objects do not exist.',
+        incorrect_type='Incorrect type. Expected pk values, received '
+                       '{data_type}.',
+    )
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        for item in data:
+            if isinstance(item, bool):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+        pks = list(dict.fromkeys(pks))
+        if not pks:
+            return []
+
+        found = self.child_relation.get_queryset().in_bulk(pks)
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            self.fail(
+                'does_not_exist', pk_list=', '.join(map(str, missing))
+            )
+        return [found[pk] for pk in pks]
+
+    def get_attribute(self, instance):
+        items = read_model.cached(instance, self.source)
+        if items is not None:
+            return [PKOnlyObject(pk=item['id']) for item in items]
+        return super().get_attribute(instance)
+
+
+class ReadModelListSerializer(serializers.ListSerializer):
+    """Nested list rendered from ``Recipe.relations`` once it is built"""
+
+    def get_attribute(self, instance):
+        items = read_model.cached(instance, self.source)
+        if items is not None:
+            return items
+        return super().get_attribute(instance)
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field limited to objects owned by the request user"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset.none()
+        return queryset.filter(user=request.user)
 
 
 class TagSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=255)
 
     class Meta:
         model = Tag
@@ -11,6 +88,7 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class IngredientSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=255)
 
     class Meta:
         model = Ingredient
@@ -18,25 +96,127 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class NameListSerializer(serializers.Serializer):
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=False,
+        max_length=100
+    )
+
+    def validate_names(self, value):
+        names = {}
+        for name in value:
+            names.setdefault(name.lower(), name)
+        return list(names.values())
+
+
 class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
+    add_ingredients = UserPrimaryKeyRelatedField(
+        many=True, write_only=True, required=False,
+        queryset=Ingredient.objects.all()
+    )
+    remove_ingredients = UserPrimaryKeyRelatedField(
+        many=True, write_only=True, required=False,
+        queryset=Ingredient.objects.all()
+    )
+    add_tags = UserPrimaryKeyRelatedField(
+        many=True, write_only=True, required=False,
+        queryset=Tag.objects.all()
+    )
+    remove_tags = UserPrimaryKeyRelatedField(
+        many=True, write_only=True, required=False,
+        queryset=Tag.objects.all()
+    )
     image = serializers.SerializerMethodField()
 
+    m2m_fields = ('tags', 'ingredients')
+
     class Meta:
         model = Recipe
         fields = (
             'id', 'title', 'tags', 'ingredients', 'time_minutes', 'price',
-            'link', 'image'
+            'link', 'image', 'add_tags', 'remove_tags', 'add_ingredients',
+            'remove_ingredients'
         )
         read_only_field = ('id')
 
+    def _pop_relations(self, validated_data):
+        changes = {}
+        for name in self.m2m_fields:
+            replace = validated_data.pop(name, None)
+            add = validated_data.pop(f'add_{name}', [])
+            remove = validated_data.pop(f'remove_{name}', [])
+            if replace is not None or add or remove:
+                changes[name] = (replace, add, remove)
+        return changes
+
+    def _apply_relations(self, instance, changes):
+        """Apply M2M changes as one bulk insert and one bulk delete"""
+        for name, (replace, add, remove) in changes.items():
+            field = Recipe._meta.get_field(name)
+            through = field.remote_field.through
+            source = field.m2m_column_name()
+            target = field.m2m_reverse_name()
+            using = router.db_for_write(through, instance=instance)
+            rows = through.objects.using(using).filter(
+                **{source: instance.pk}
+            )
+
+            current = set(rows.values_list(target, flat=True))
+            wanted = current if replace is None else \
+                {obj.pk for obj in replace}
+            wanted = (wanted | {obj.pk for obj in add}) - \
+                {obj.pk for obj in remove}
+            to_remove = current - wanted
+            to_add = wanted - current
+
+            signal_kwargs = {
+                'sender': through, 'instance': instance, 'reverse': False,
+                'model': field.related_model, 'using': using,
+            }
+            if to_remove:
+                m2m_changed.send(
+                    action='pre_remove', pk_set=to_remove, **signal_kwargs
+                )
+                rows.filter(**{f'{target}__in': to_remove}).delete()
+                m2m_changed.send(
+                    action='post_remove', pk_set=to_remove, **signal_kwargs
+                )
+            if to_add:
+                m2m_changed.send(
+                    action='pre_add', pk_set=to_add, **signal_kwargs
+                )
+                through.objects.using(using).bulk_create([
+                    through(**{source: instance.pk, target: pk})
+                    for pk in sorted(to_add)
+                ])
+                m2m_changed.send(
+                    action='post_add', pk_set=to_add, **signal_kwargs
+                )
+
+    def create(self, validated_data):
+        changes = self._pop_relations(validated_data)
+        with transaction.atomic(using=router.db_for_write(Recipe)):
+            instance = super().create(validated_data)
+            self._apply_relations(instance, changes)
+        return instance
+
+    def update(self, instance, validated_data):
+        changes = self._pop_relations(validated_data)
+        using = router.db_for_write(Recipe, instance=instance)
+        with transaction.atomic(using=using):
+            instance = super().update(instance, validated_data)
+            self._apply_relations(instance, changes)
+        return instance
+
     def get_image(self, obj):
         request = self.context.get('request')
         if obj.image and hasattr(obj.image, 'url'):
@@ -54,5 +234,17 @@ class RecipeImageSerializer(serializers.ModelSerializer):
 
 
 class RecipeDetailSerializer(RecipeSerializer):
-    ingredients = IngredientSerializer(many=True, read_only=True)
-    tags = TagSerializer(many=True, read_only=True)
+    ingredients = ReadModelListSerializer(
+        child=IngredientSerializer(), read_only=True
+    )
+    tags = ReadModelListSerializer(child=TagSerializer(), read_only=True)
+
+
+class PurgeJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = PurgeJob
+        fields = ('id', 'scope', 'status', 'total_recipes', 'deleted_recipes',
+                  'deleted_tags', 'deleted_ingredients', 'created_at',
+                  'finished_at')
+        read_only_fields = fields
@@ -0,0 +1,42 @@
+"""
+Shopping list across several recipes.
+
+Computed with one GROUP BY over the recipe/ingredient through table; the
+recipes of each ingredient come back as one comma separated string per
+row (``STRING_AGG`` on Postgres, ``GROUP_CONCAT`` elsewhere).
+"""
+from django.db.models import Aggregate, CharField, Count
+
+from core.models import Recipe
+
+
+class IdList(Aggregate):
+    """Comma separated integer values of a group"""
+    function = 'GROUP_CONCAT'
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, function='STRING_AGG',
+            template="%(function)s(%(expressions)s::text, ',')",
+            **extra_context
+        )
+
+
+def shopping_list(recipes):
+    """Distinct ingredients of the recipes queryset with their recipes"""
+    through = Recipe.ingredients.through
+    rows = through.objects.filter(
+        recipe__in=recipes.order_by().values('id')
+    ).values('ingredient_id', 'ingredient__term__value').annotate(
+        recipe_ids=IdList('recipe_id'), recipe_count=Count('recipe_id')
+    ).order_by('ingredient__term__value', 'ingredient_id')
+    return [
+        {
+            'id': row['ingredient_id'],
+            'name': row['ingredient__term__value'],
+            'count': row['recipe_count'],
+            'recipes': sorted(int(pk) for pk in row['recipe_ids'].split(',')),
+        }
+        for row in rows
+    ]
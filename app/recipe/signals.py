@@ -0,0 +1,116 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_delete
+from django.dispatch import receiver
+from core.models import ChangeLogEntry, Tag, Ingredient, Recipe
+from recipe import autocomplete, changes, image_hashes, read_model, \
+    similarity, stats
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_features_changed(sender, instance, action, reverse, pk_set,
+                            using, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_recipe_ids = list(
+            instance.recipe_set.values_list('id', flat=True)
+        )
+        changes.record(
+            instance.user_id, 'recipe', instance._cleared_recipe_ids
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        read_model.rebuild([instance.pk], using, instance=instance)
+        changes.record(instance.user_id, 'recipe', [instance.pk])
+    elif pk_set:
+        read_model.rebuild(pk_set, using)
+        changes.record(instance.user_id, 'recipe', pk_set)
+    else:
+        read_model.rebuild(
+            getattr(instance, '_cleared_recipe_ids', ()), using
+        )
+    if sender is Recipe.tags.through:
+        stats.data_changed(instance.user_id, stats.TAGS)
+    else:
+        stats.data_changed(instance.user_id, stats.INGREDIENTS)
+    if not reverse:
+        similarity.recipes_changed(instance.user_id, [instance.pk])
+    elif pk_set:
+        similarity.recipes_changed(instance.user_id, list(pk_set))
+    else:
+        similarity.recipes_changed(
+            instance.user_id, getattr(instance, '_cleared_recipe_ids', ())
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, using, **kwargs):
+    if created:
+        read_model.recipe_created(instance, using)
+    stats.data_changed(instance.user_id, stats.RECIPES, stats.TAGS)
+    changes.record(
+        instance.user_id, 'recipe', [instance.pk],
+        event='create' if created else 'update'
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    stats.data_changed(instance.user_id, *stats.SECTIONS)
+    changes.record(
+        instance.user_id, 'recipe', [instance.pk], ChangeLogEntry.DELETE
+    )
+    similarity.recipes_changed(instance.user_id, removed=[instance.pk])
+    image_hashes.invalidate(instance.user_id)
+
+
+def features_saved(model, user_id, object_ids, created=True):
+    """Record saved tags or ingredients of one user, once for the batch"""
+    kind = model._meta.model_name
+    stats.data_changed(
+        user_id, stats.TAGS if model is Tag else stats.INGREDIENTS
+    )
+    autocomplete.names_changed(kind, user_id)
+    changes.record(
+        user_id, kind, object_ids, event='create' if created else 'update'
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def feature_saved(sender, instance, created, using, **kwargs):
+    if not created:
+        read_model.rebuild(
+            instance.recipe_set.values_list('id', flat=True), using
+        )
+    features_saved(sender, instance.user_id, [instance.pk], created)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def feature_deleting(sender, instance, **kwargs):
+    # The cascade removes the through rows without m2m_changed
+    instance._affected_recipe_ids = list(
+        instance.recipe_set.values_list('id', flat=True)
+    )
+    changes.record(
+        instance.user_id, 'recipe', instance._affected_recipe_ids
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def feature_deleted(sender, instance, using, **kwargs):
+    read_model.rebuild(getattr(instance, '_affected_recipe_ids', ()), using)
+    if sender is Tag:
+        stats.data_changed(instance.user_id, stats.TAGS)
+    else:
+        stats.data_changed(instance.user_id, stats.INGREDIENTS)
+    changes.record(
+        instance.user_id, sender._meta.model_name, [instance.pk],
+        ChangeLogEntry.DELETE
+    )
+    autocomplete.names_changed(sender._meta.model_name, instance.user_id)
+    similarity.recipes_changed(
+        instance.user_id, getattr(instance, '_affected_recipe_ids', ())
+    )
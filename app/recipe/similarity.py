@@ -0,0 +1,343 @@
+"""
+In-memory similarity index over the tags and ingredients of a user's
+recipes.
+
+Every recipe is a binary row in a CSR matrix whose columns are the user's
+tags and ingredients. Scores for all recipes are one sparse matrix-vector
+product followed by a top-k partition. Changes arriving through
+``m2m_changed`` are kept in a small overlay of re-read rows that is scored
+separately and folded into the matrix once it grows past
+``OVERLAY_LIMIT`` rows.
+
+Other processes notice the bumped ``recipe-index`` version and catch up
+from the change log: they re-read only the recipes logged after the last
+entry their index has seen. They rebuild from scratch only when more than
+``DELTA_LIMIT`` recipes changed, when the user moved to another shard,
+when the index is older than the change log retention and compaction may
+have dropped tombstones it never saw, or when ``invalidate`` bumped the
+``recipe-index-reset`` version for changes that bypass the log.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db.models import Max
+
+from core import sharding, versions
+from core.models import ChangeLogEntry, Recipe
+from recipe import changes
+
+
+TAG = 't'
+INGREDIENT = 'i'
+OVERLAY_LIMIT = 256
+DELTA_LIMIT = 1000
+
+
+VERSION = 'recipe-index'
+RESET = 'recipe-index-reset'
+
+
+def load_features(user_id, recipe_ids=None):
+    """Return {recipe_id: set of (kind, id)} read from the through tables"""
+    features = {}
+    recipes = Recipe.objects.filter(user_id=user_id)
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    for recipe_id in recipes.values_list('id', flat=True):
+        features[recipe_id] = set()
+    for kind, through, column in (
+            (TAG, Recipe.tags.through, 'tag_id'),
+            (INGREDIENT, Recipe.ingredients.through, 'ingredient_id')):
+        rows = through.objects.filter(recipe_id__in=list(features))
+        for recipe_id, feature_id in rows.values_list('recipe_id', column):
+            features[recipe_id].add((kind, feature_id))
+    return features
+
+
+def log_position(user_id):
+    """Return the id of the user's latest change log entry"""
+    entries = ChangeLogEntry.objects.filter(user_id=user_id)
+    return entries.aggregate(last=Max('id'))['last'] or 0
+
+
+class RecipeIndex:
+    """Index of one user's recipes. ``update`` and ``compact`` replace its
+    arrays in place and run under ``lock``, which the readers take as well.
+    """
+
+    def __init__(self, user_id, features, version, log_id=0, reset=0):
+        self.user_id = user_id
+        self.version = version
+        self.reset = reset
+        self.log_id = log_id
+        self.synced_at = time.time()
+        self.shard = sharding.shard_for_user(user_id)
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.overlay = {}
+        self._build(features)
+
+    def _column(self, feature):
+        if feature not in self.columns:
+            self.columns[feature] = len(self.columns)
+        return self.columns[feature]
+
+    def _build(self, features):
+        ids = sorted(features)
+        indptr = [0]
+        indices = []
+        for recipe_id in ids:
+            indices.extend(self._column(f) for f in features[recipe_id])
+            indptr.append(len(indices))
+        self.ids = np.array(ids, dtype=np.int64)
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(ids)}
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(ids), len(self.columns))
+        )
+        self.row_sizes = np.diff(self.matrix.indptr).astype(np.float32)
+        ingredient_mask = np.zeros(len(self.columns), dtype=np.float32)
+        for (kind, _), column in self.columns.items():
+            if kind == INGREDIENT:
+                ingredient_mask[column] = 1
+        self.ingredient_counts = self.matrix @ ingredient_mask
+        self.stale = np.zeros(len(ids), dtype=bool)
+        self.overlay = {}
+
+    def features_of(self, recipe_id):
+        with self.lock:
+            if recipe_id in self.overlay:
+                return self.overlay[recipe_id]
+            row = self.rows.get(recipe_id)
+            if row is None or self.stale[row]:
+                return None
+            columns = self.matrix.indices[
+                self.matrix.indptr[row]:self.matrix.indptr[row + 1]
+            ]
+            inverse = {column: f for f, column in self.columns.items()}
+            return {inverse[column] for column in columns}
+
+    def update(self, features, removed=()):
+        """Replace the rows of changed recipes without touching the matrix"""
+        for recipe_id, recipe_features in features.items():
+            self.overlay[recipe_id] = set(recipe_features)
+        for recipe_id in removed:
+            self.overlay[recipe_id] = None
+        for recipe_id in list(features) + list(removed):
+            row = self.rows.get(recipe_id)
+            if row is not None:
+                self.stale[row] = True
+        if len(self.overlay) > OVERLAY_LIMIT:
+            self.compact()
+
+    def catch_up(self, version):
+        """Apply the recipes logged since ``log_id``. Return False when the
+        log cannot be trusted to hold every change and the caller has to
+        rebuild the index.
+        """
+        with self.lock:
+            if self.version >= version:
+                return True
+            expired = self.synced_at < \
+                time.time() - changes.retention().total_seconds()
+            if expired or self.shard != sharding.shard_for_user(self.user_id):
+                return False
+            synced_at = time.time()
+            entries = list(
+                ChangeLogEntry.objects.filter(
+                    user_id=self.user_id, kind='recipe', id__gt=self.log_id
+                ).order_by('id').values_list('id', 'object_id')
+                [:DELTA_LIMIT + 1]
+            )
+            if len(entries) > DELTA_LIMIT:
+                return False
+            if entries:
+                recipe_ids = {object_id for _, object_id in entries}
+                features = load_features(self.user_id, recipe_ids)
+                self.update(features, recipe_ids - set(features))
+                self.log_id = entries[-1][0]
+            self.synced_at = synced_at
+            self.version = version
+            return True
+
+    def compact(self):
+        features = {}
+        inverse = {column: f for f, column in self.columns.items()}
+        for recipe_id, row in self.rows.items():
+            if self.stale[row]:
+                continue
+            start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+            features[recipe_id] = {
+                inverse[column] for column in self.matrix.indices[start:end]
+            }
+        for recipe_id, recipe_features in self.overlay.items():
+            if recipe_features is not None:
+                features[recipe_id] = recipe_features
+        self.columns = {}
+        self._build(features)
+
+    def _query_vector(self, query):
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        for feature in query:
+            column = self.columns.get(feature)
+            if column is not None and column < len(vector):
+                vector[column] = 1
+        return vector
+
+    def _top_k(self, ids, scores, limit):
+        if not len(ids):
+            return []
+        limit = min(limit, len(ids))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.lexsort((ids[top], -scores[top]))]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def score(self, query, metric='jaccard', limit=10, exclude=None):
+        """Rank recipes by Jaccard or cosine similarity to a feature set"""
+        with self.lock:
+            return self._score(set(query), metric, limit, exclude)
+
+    def cookable(self, ingredient_ids, limit=10):
+        """Rank recipes by the share of their ingredients that is on hand"""
+        with self.lock:
+            return self._cookable(
+                {(INGREDIENT, pk) for pk in ingredient_ids}, limit
+            )
+
+    def _score(self, query, metric, limit, exclude):
+        if not query:
+            return []
+        size = float(len(query))
+        overlap = self.matrix @ self._query_vector(query)
+        if metric == 'cosine':
+            denominator = np.sqrt(self.row_sizes * size)
+        else:
+            denominator = self.row_sizes + size - overlap
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(denominator > 0, overlap / denominator, 0)
+        keep = (overlap > 0) & ~self.stale
+        ids, scores = self.ids[keep], scores[keep]
+
+        extra_ids, extra_scores = [], []
+        for recipe_id, features in self.overlay.items():
+            if not features:
+                continue
+            common = len(features & query)
+            if not common:
+                continue
+            if metric == 'cosine':
+                value = common / np.sqrt(len(features) * size)
+            else:
+                value = common / (len(features) + size - common)
+            extra_ids.append(recipe_id)
+            extra_scores.append(value)
+        if extra_ids:
+            ids = np.concatenate([ids, np.array(extra_ids, dtype=np.int64)])
+            scores = np.concatenate([scores, np.array(extra_scores)])
+        if exclude is not None:
+            keep = ids != exclude
+            ids, scores = ids[keep], scores[keep]
+        return self._top_k(ids, scores, limit)
+
+    def _cookable(self, query, limit):
+        if not query:
+            return []
+        overlap = self.matrix @ self._query_vector(query)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(
+                self.ingredient_counts > 0,
+                overlap / self.ingredient_counts, 0
+            )
+        keep = (overlap > 0) & ~self.stale
+        ids, scores = self.ids[keep], scores[keep]
+
+        extra_ids, extra_scores = [], []
+        for recipe_id, features in self.overlay.items():
+            ingredients = {f for f in features or () if f[0] == INGREDIENT}
+            common = len(ingredients & query)
+            if common:
+                extra_ids.append(recipe_id)
+                extra_scores.append(common / len(ingredients))
+        if extra_ids:
+            ids = np.concatenate([ids, np.array(extra_ids, dtype=np.int64)])
+            scores = np.concatenate([scores, np.array(extra_scores)])
+        return self._top_k(ids, scores, limit)
+
+
+class IndexRegistry:
+    """Per-process LRU of user indexes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def get(self, user_id):
+        current = versions.get_versions([VERSION, RESET], user_id)
+        version, reset = current[VERSION], current[RESET]
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.reset != reset:
+                index = None
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+                return index
+        if index is not None and index.catch_up(version):
+            with self._lock:
+                if user_id in self._indexes:
+                    self._indexes.move_to_end(user_id)
+            return index
+        log_id = log_position(user_id)
+        index = RecipeIndex(
+            user_id, load_features(user_id), version, log_id, reset
+        )
+        max_users = getattr(settings, 'RECIPE_INDEX_MAX_USERS', 1000)
+        with self._lock:
+            self._indexes[user_id] = index
+            while len(self._indexes) > max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def loaded(self, user_id):
+        with self._lock:
+            return self._indexes.get(user_id)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+registry = IndexRegistry()
+
+
+def recipes_changed(user_id, recipe_ids=(), removed=()):
+    """Apply changed recipes to a loaded index and publish the new version.
+    An index that missed other changes catches up from the log on its
+    next read.
+    """
+    version = versions.bump_version(VERSION, user_id)
+    index = registry.loaded(user_id)
+    if index is None:
+        return
+    with index.lock:
+        if index.version != version - 1:
+            return
+        features = load_features(user_id, recipe_ids)
+        removed = set(removed) | (set(recipe_ids) - set(features))
+        index.update(features, removed)
+        index.version = version
+
+
+def invalidate(user_id):
+    """Make every process rebuild the index, for changes not in the log"""
+    versions.bump_version(RESET, user_id)
+    versions.bump_version(VERSION, user_id)
+    registry.discard(user_id)
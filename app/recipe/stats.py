@@ -0,0 +1,150 @@
+"""
+Cookbook statistics computed with SQL aggregates.
+
+Each section is cached under its own per-user version, so a change only
+recomputes the sections it can affect (renaming a tag leaves the recipe
+totals and ingredient counts cached).
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max, Min, Q
+
+from core import versions
+from core.models import Tag, Ingredient, Recipe
+
+
+RECIPES = 'stats-recipes'
+TAGS = 'stats-tags'
+INGREDIENTS = 'stats-ingredients'
+SECTIONS = (RECIPES, TAGS, INGREDIENTS)
+
+TIME_BUCKETS = (0, 15, 30, 60, 120)
+PRICE_BUCKETS = (
+    Decimal('0'), Decimal('5'), Decimal('10'), Decimal('20'), Decimal('50')
+)
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _round(value, places=2):
+    return None if value is None else round(float(value), places)
+
+
+def _bucket_filters(field, bounds):
+    buckets = []
+    for index, low in enumerate(bounds):
+        high = bounds[index + 1] if index + 1 < len(bounds) else None
+        condition = Q(**{f'{field}__gte': low})
+        if high is not None:
+            condition &= Q(**{f'{field}__lt': high})
+        buckets.append((low, high, condition))
+    return buckets
+
+
+def _histogram(aggregates, prefix, buckets):
+    return [
+        {
+            'min': _round(low) if isinstance(low, Decimal) else low,
+            'max': _round(high) if isinstance(high, Decimal) else high,
+            'count': aggregates[f'{prefix}_{index}'],
+        }
+        for index, (low, high, _) in enumerate(buckets)
+    ]
+
+
+def recipe_stats(user):
+    time_buckets = _bucket_filters('time_minutes', TIME_BUCKETS)
+    price_buckets = _bucket_filters('price', PRICE_BUCKETS)
+    aggregates = {
+        'count': Count('id'),
+        'avg_price': Avg('price'),
+        'min_price': Min('price'),
+        'max_price': Max('price'),
+        'avg_time': Avg('time_minutes'),
+        'min_time': Min('time_minutes'),
+        'max_time': Max('time_minutes'),
+    }
+    for index, (_, _, condition) in enumerate(time_buckets):
+        aggregates[f'time_{index}'] = Count('id', filter=condition)
+    for index, (_, _, condition) in enumerate(price_buckets):
+        aggregates[f'price_{index}'] = Count('id', filter=condition)
+    result = Recipe.objects.filter(user=user).aggregate(**aggregates)
+    return {
+        'count': result['count'],
+        'price': {
+            'avg': _round(result['avg_price']),
+            'min': _round(result['min_price']),
+            'max': _round(result['max_price']),
+            'histogram': _histogram(result, 'price', price_buckets),
+        },
+        'time_minutes': {
+            'avg': _round(result['avg_time'], 1),
+            'min': result['min_time'],
+            'max': result['max_time'],
+            'histogram': _histogram(result, 'time', time_buckets),
+        },
+    }
+
+
+def tag_stats(user):
+    rows = Tag.objects.filter(user=user).annotate(
+        recipe_count=Count('recipe'),
+        avg_price=Avg('recipe__price'),
+        avg_time=Avg('recipe__time_minutes'),
+    ).order_by('-recipe_count', 'term__value').values(
+        'id', 'recipe_count', 'avg_price', 'avg_time', name=F('term__value')
+    )
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'recipe_count': row['recipe_count'],
+            'avg_price': _round(row['avg_price']),
+            'avg_time_minutes': _round(row['avg_time'], 1),
+        }
+        for row in rows
+    ]
+
+
+def ingredient_stats(user):
+    rows = Ingredient.objects.filter(user=user).annotate(
+        recipe_count=Count('recipe')
+    ).order_by('-recipe_count', 'term__value').values(
+        'id', 'recipe_count', name=F('term__value')
+    )
+    return list(rows)
+
+
+COMPUTE = {
+    RECIPES: recipe_stats,
+    TAGS: tag_stats,
+    INGREDIENTS: ingredient_stats,
+}
+
+
+def get_stats(user):
+    current = versions.get_versions(SECTIONS, user.pk)
+    keys = {
+        section: f'{section}:{user.pk}:{current[section]}'
+        for section in SECTIONS
+    }
+    cached = cache.get_many(list(keys.values()))
+    missing = {}
+    sections = {}
+    for section, key in keys.items():
+        if key in cached:
+            sections[section] = cached[key]
+        else:
+            sections[section] = missing[key] = COMPUTE[section](user)
+    if missing:
+        cache.set_many(missing, CACHE_TIMEOUT)
+    return {
+        'recipes': sections[RECIPES],
+        'tags': sections[TAGS],
+        'ingredients': sections[INGREDIENTS],
+    }
+
+
+def data_changed(user_id, *sections):
+    for section in sections:
+        versions.bump_version(section, user_id)
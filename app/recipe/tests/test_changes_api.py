@@ -0,0 +1,131 @@
+from io import StringIO
+from datetime import timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import ChangeLogEntry, Recipe, Tag, Ingredient
+
+
+CHANGES_URL = reverse('recipe:changes')
+
+
+def sample_recipe(user, title='test title'):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class ChangesAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None):
+        params = {'since': cursor} if cursor else {}
+        res = self.client.get(CHANGES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_login_required(self):
+        res = APIClient().get(CHANGES_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_initial_sync_then_only_changes(self):
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        first = self.sync()
+        self.assertTrue(first['reset'])
+        self.assertEqual([r['id'] for r in first['recipes']], [recipe.id])
+        self.assertEqual([t['id'] for t in first['tags']], [tag.id])
+
+        second = self.sync(first['cursor'])
+        self.assertFalse(second['reset'])
+        self.assertEqual(second['recipes'], [])
+        self.assertEqual(second['tags'], [])
+
+        recipe.tags.add(tag)
+        third = self.sync(second['cursor'])
+        self.assertEqual([r['id'] for r in third['recipes']], [recipe.id])
+        self.assertEqual(third['recipes'][0]['tags'], [tag.id])
+
+    def test_rows_from_before_the_log_are_backfilled(self):
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        ChangeLogEntry.objects.all().delete()
+        migration = import_module('core.migrations.0019_backfill_changelog')
+
+        schema_editor = SimpleNamespace(connection=connection)
+
+        migration.backfill_changelog(apps, schema_editor)
+        migration.backfill_changelog(apps, schema_editor)
+
+        data = self.sync()
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual([t['id'] for t in data['tags']], [tag.id])
+        self.assertEqual(ChangeLogEntry.objects.count(), 2)
+
+    def test_deletes_return_tombstones(self):
+        recipe = sample_recipe(self.user)
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        recipe.ingredients.add(ingredient)
+        cursor = self.sync()['cursor']
+
+        ingredient_id = ingredient.id
+        ingredient.delete()
+        data = self.sync(cursor)
+        self.assertEqual(data['deleted']['ingredients'], [ingredient_id])
+        self.assertEqual(data['recipes'][0]['ingredients'], [])
+
+        recipe_id = recipe.id
+        recipe.delete()
+        data = self.sync(data['cursor'])
+        self.assertEqual(data['deleted']['recipes'], [recipe_id])
+        self.assertEqual(data['recipes'], [])
+
+    def test_changes_limited_to_user(self):
+        other = get_user_model().objects.create_user('o@mail.com', 'pass')
+        sample_recipe(other)
+        data = self.sync()
+        self.assertEqual(data['recipes'], [])
+
+    def test_expired_cursor_resets(self):
+        sample_recipe(self.user)
+        cursor = self.sync()['cursor']
+        entry_id, issued = cursor.split('.')
+        stale = f'{entry_id}.{int(issued) - 31 * 24 * 3600}'
+        data = self.sync(stale)
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['recipes']), 1)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(CHANGES_URL, {'since': 'abc'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compaction(self):
+        recipe = sample_recipe(self.user)
+        recipe.title = 'new'
+        recipe.save()
+        other = sample_recipe(self.user)
+        other.delete()
+        self.assertEqual(ChangeLogEntry.objects.count(), 4)
+
+        later = timezone.now() + timedelta(days=31)
+        with patch('django.utils.timezone.now', return_value=later):
+            call_command('compact_changelog', stdout=StringIO())
+        self.assertEqual(
+            list(ChangeLogEntry.objects.values_list('object_id', 'action')),
+            [(recipe.id, ChangeLogEntry.UPSERT)]
+        )
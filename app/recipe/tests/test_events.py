@@ -0,0 +1,125 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from recipe import events
+
+
+def sse_scope(token=None):
+    headers = []
+    if token:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    return {
+        'type': 'http',
+        'method': 'GET',
+        'path': events.EVENTS_PATH,
+        'headers': headers,
+        'query_string': b'',
+    }
+
+
+async def run_stream(scope, on_body):
+    """Run the SSE app until on_body returns True, return sent messages"""
+    sent = []
+    disconnected = asyncio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        if message['type'] == 'http.response.body' and \
+                on_body(message['body']):
+            disconnected.set()
+
+    await asyncio.wait_for(events.sse_application(scope, receive, send), 5)
+    return sent
+
+
+class BrokerTests(TestCase):
+
+    @override_settings(EVENT_QUEUE_SIZE=2)
+    def test_overflow_replaced_by_resync(self):
+        async def scenario():
+            broker = events.LocalBroker()
+            subscription = broker.subscribe(1)
+            for index in range(5):
+                subscription.push({'id': index})
+            first = await subscription.get(1)
+            empty = await subscription.get(0.01)
+            subscription.push({'id': 6})
+            after = await subscription.get(1)
+            broker.unsubscribe(subscription)
+            return first, empty, after, broker.subscriber_count()
+
+        first, empty, after, count = async_to_sync(scenario)()
+        self.assertIs(first, events.RESYNC)
+        self.assertIsNone(empty)
+        self.assertEqual(after, {'id': 6})
+        self.assertEqual(count, 0)
+
+
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def test_requires_token(self):
+        sent = async_to_sync(run_stream)(sse_scope(), lambda body: True)
+        self.assertEqual(sent[0]['status'], 401)
+
+    @override_settings(EVENT_HEARTBEAT_SECONDS=0.05)
+    def test_streams_user_changes_and_heartbeats(self):
+        user_id = self.user.id
+        bodies = []
+
+        def on_body(body):
+            bodies.append(body)
+            if body.startswith(b'retry'):
+                events.publish(user_id + 1, 'recipe', [99], 'create')
+                events.publish(user_id, 'recipe', [7], 'create')
+            return any(b.startswith(b'event: change') for b in bodies) and \
+                any(b.startswith(b': ping') for b in bodies)
+
+        sent = async_to_sync(run_stream)(sse_scope(self.token.key), on_body)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), sent[0]['headers']
+        )
+        changes = [b for b in bodies if b.startswith(b'event: change')]
+        self.assertEqual(len(changes), 1)
+        payload = json.loads(changes[0].split(b'data: ')[1])
+        self.assertEqual(
+            payload, {'type': 'recipe', 'action': 'create', 'id': 7}
+        )
+        self.assertEqual(events.get_broker().subscriber_count(), 0)
+
+
+class PostgresBrokerTests(TestCase):
+
+    def test_notification_delivered_to_local_subscribers(self):
+        async def scenario():
+            broker = events.PostgresBroker()
+            # Without starting the listener, which needs Postgres
+            subscription = events.LocalBroker.subscribe(broker, 1)
+            broker.deliver(json.dumps({'user_id': 1, 'events': [
+                {'type': 'recipe', 'action': 'delete', 'id': 3},
+            ]}))
+            broker.deliver(json.dumps({'user_id': 2, 'events': [
+                {'type': 'recipe', 'action': 'delete', 'id': 4},
+            ]}))
+            first = await subscription.get(1)
+            second = await subscription.get(0.01)
+            return first, second
+
+        first, second = async_to_sync(scenario)()
+        self.assertEqual(first, {'type': 'recipe', 'action': 'delete',
+                                 'id': 3})
+        self.assertIsNone(second)
@@ -0,0 +1,191 @@
+import io
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from recipe import image_hashes
+
+
+def sample_image(seed, size=(256, 256)):
+    """A smooth random picture, different for every seed"""
+    pixels = np.random.RandomState(seed).randint(0, 256, (6, 6, 3))
+    return Image.fromarray(pixels.astype(np.uint8)).resize(size,
+                                                           Image.BICUBIC)
+
+
+def as_upload(image, quality=90, name='image.jpg'):
+    file = io.BytesIO()
+    image.save(file, format='JPEG', quality=quality)
+    file.seek(0)
+    file.name = name
+    return file
+
+
+def image_upload_url(recipe_id):
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+class ImageHashTests(TestCase):
+
+    def test_hash_survives_resize_and_recompression(self):
+        image = sample_image(1)
+        original = image_hashes.phash(image)
+        resized = image_hashes.hash_file(
+            as_upload(image.resize((120, 120)), quality=40)
+        )
+        distance = image_hashes.hamming(
+            np.array([original], dtype=np.uint64), resized
+        )[0]
+        self.assertLessEqual(distance, image_hashes.max_distance())
+
+    def test_different_images_are_far_apart(self):
+        hashes = np.array(
+            [image_hashes.phash(sample_image(seed)) for seed in range(1, 6)],
+            dtype=np.uint64
+        )
+        for value in hashes:
+            distances = image_hashes.hamming(hashes, int(value))
+            self.assertEqual(
+                int((distances <= image_hashes.max_distance()).sum()), 1
+            )
+
+    def test_unreadable_file(self):
+        self.assertIsNone(image_hashes.hash_file(io.BytesIO(b'not an image')))
+
+    def test_db_round_trip(self):
+        for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            stored = image_hashes.to_db(value)
+            self.assertTrue(-(1 << 63) <= stored < 1 << 63)
+            self.assertEqual(image_hashes.from_db(stored), value)
+
+    def test_index_search(self):
+        high = (1 << 64) - 1
+        index = image_hashes.HashIndex(
+            [(1, image_hashes.to_db(high)), (2, 0), (3, 0b111)]
+        )
+        self.assertEqual(index.search(0, 3), [(2, 0), (3, 3)])
+        self.assertEqual(index.search(0, 3, exclude=2), [(3, 3)])
+        self.assertEqual(index.search(high ^ 1, 1), [(1, 1)])
+        index.add(2, high)
+        self.assertEqual(index.search(high, 0), [(1, 0), (2, 0)])
+        self.assertEqual(len(index), 3)
+
+
+class DuplicateImageUploadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        image_hashes.registry.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipes = [
+            Recipe.objects.create(
+                user=self.user, title=f'recipe {i}', time_minutes=5, price=1
+            ) for i in range(3)
+        ]
+
+    def tearDown(self):
+        for recipe in Recipe.objects.all():
+            recipe.image.delete()
+
+    def upload(self, recipe, image, **params):
+        self.client.force_authenticate(recipe.user)
+        url = image_upload_url(recipe.id)
+        if params:
+            url += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        return self.client.post(
+            url, {'image': as_upload(image)}, format='multipart'
+        )
+
+    def test_upload_stores_hash(self):
+        res = self.upload(self.recipes[0], sample_image(1))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['duplicates'], [])
+        self.assertIsNone(res.data['reused_from'])
+        self.recipes[0].refresh_from_db()
+        self.assertIsNotNone(self.recipes[0].image_hash)
+
+    def test_upload_flags_near_duplicate(self):
+        self.upload(self.recipes[0], sample_image(1))
+        self.upload(self.recipes[1], sample_image(2))
+
+        res = self.upload(
+            self.recipes[2], sample_image(1).resize((200, 200))
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in res.data['duplicates']],
+            [self.recipes[0].id]
+        )
+        first, last = (Recipe.objects.get(pk=recipe.pk)
+                       for recipe in (self.recipes[0], self.recipes[2]))
+        self.assertNotEqual(first.image.name, last.image.name)
+
+    def test_upload_reuses_duplicate_file(self):
+        self.upload(self.recipes[0], sample_image(1))
+
+        res = self.upload(self.recipes[1], sample_image(1), reuse='true')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['reused_from'], self.recipes[0].id)
+        first, second = (Recipe.objects.get(pk=recipe.pk)
+                         for recipe in self.recipes[:2])
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_hash, second.image_hash)
+
+    def test_other_users_images_not_flagged(self):
+        other = get_user_model().objects.create_user(
+            'other@mail.com', 'pass123'
+        )
+        recipe = Recipe.objects.create(
+            user=other, title='other', time_minutes=5, price=1
+        )
+        self.upload(recipe, sample_image(1))
+
+        res = self.upload(self.recipes[0], sample_image(1), reuse='true')
+
+        self.assertEqual(res.data['duplicates'], [])
+        self.assertIsNone(res.data['reused_from'])
+        self.assertCountEqual(
+            [pk for pk, _ in image_hashes.find_duplicates(
+                None, image_hashes.from_db(
+                    Recipe.objects.get(pk=recipe.pk).image_hash
+                )
+            )],
+            [recipe.pk, self.recipes[0].pk]
+        )
+
+    def test_deleted_recipe_not_flagged(self):
+        self.upload(self.recipes[0], sample_image(1))
+        self.recipes[0].image.delete(save=False)
+        self.recipes[0].delete()
+
+        res = self.upload(self.recipes[1], sample_image(1))
+
+        self.assertEqual(res.data['duplicates'], [])
+
+    def test_upload_without_image_keeps_hash(self):
+        self.upload(self.recipes[0], sample_image(1))
+        stored = Recipe.objects.get(pk=self.recipes[0].pk).image_hash
+
+        res = self.client.post(
+            image_upload_url(self.recipes[0].id), {}, format='multipart'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['duplicates'], [])
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[0].pk).image_hash, stored
+        )
@@ -34,7 +34,7 @@ class PrivateIngredientAPITests(TestCase):
         Ingredient.objects.create(name='test 1', user=self.user)
         Ingredient.objects.create(name='test 2', user=self.user)
         res = self.client.get(INGREDIENT_URL)
-        ingredients = Ingredient.objects.all().order_by('-name')
+        ingredients = Ingredient.objects.all().order_by('-term__value')
         serializer = IngredientSerializer(ingredients, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -55,7 +55,7 @@ class PrivateIngredientAPITests(TestCase):
         payload = {'name': 'test'}
         res = self.client.post(INGREDIENT_URL, payload)
         exists = Ingredient.objects.filter(
-            name=payload['name'],
+            term__value=payload['name'],
             user=self.user
         ).exists()
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
@@ -111,3 +111,15 @@ class PrivateIngredientAPITests(TestCase):
         recipe2.ingredients.add(ingredient)
         res = self.client.get(INGREDIENT_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
+
+    def test_resolve_ingredients_by_name(self):
+        Ingredient.objects.create(user=self.user, name='Salt')
+        url = reverse('recipe:ingredient-resolve')
+        res = self.client.post(
+            url, {'names': ['salt', 'pepper']}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([i['name'] for i in res.data], ['Salt', 'pepper'])
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 2
+        )
@@ -0,0 +1,145 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient, PurgeJob, ChangeLogEntry
+from recipe import autocomplete, image_hashes, purge, similarity, stats
+
+
+PURGE_URL = reverse('recipe:recipe-purge')
+ME_URL = reverse('user:me')
+
+
+def purge_url(job_id):
+    return reverse('recipe:purge-detail', args=[job_id])
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'Sample recipe', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+@override_settings(PURGE_BATCH_SIZE=2)
+class PurgeTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.other = get_user_model().objects.create_user(
+            'other@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        for index in range(5):
+            recipe = sample_recipe(self.user, title=f'Recipe {index}')
+            recipe.tags.add(tag)
+            recipe.ingredients.add(ingredient)
+        self.kept = sample_recipe(self.other)
+
+    def test_purge_recipes(self):
+        res = self.client.post(PURGE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], PurgeJob.PENDING)
+        self.assertEqual(res.data['total_recipes'], 5)
+        late = sample_recipe(self.user, title='Created after the request')
+
+        self.assertEqual(purge.process_jobs(), 1)
+
+        res = self.client.get(purge_url(res.data['id']))
+        self.assertEqual(res.data['status'], PurgeJob.DONE)
+        self.assertEqual(res.data['deleted_recipes'], 5)
+        self.assertEqual(
+            list(Recipe.objects.filter(user=self.user)), [late]
+        )
+        self.assertTrue(Recipe.objects.filter(pk=self.kept.pk).exists())
+        self.assertEqual(Recipe.tags.through.objects.count(), 0)
+        self.assertEqual(ChangeLogEntry.objects.filter(
+            user=self.user, kind='recipe', action=ChangeLogEntry.DELETE
+        ).count(), 5)
+
+    def test_purge_invalidates_caches_of_other_processes(self):
+        cache.clear()
+        self.assertEqual(stats.get_stats(self.user)['recipes']['count'], 5)
+        self.assertEqual(len(similarity.registry.get(self.user.pk).ids), 5)
+        self.assertEqual(
+            len(autocomplete.search('tag', self.user.pk, 'v')), 1
+        )
+        self.client.delete(ME_URL)
+
+        # The worker runs with in-process caches of its own
+        with patch.object(stats, 'cache', LocMemCache('worker', {})), \
+                patch.object(similarity, 'registry',
+                             similarity.IndexRegistry()), \
+                patch.object(image_hashes, 'registry',
+                             image_hashes.HashIndexRegistry()), \
+                patch.object(autocomplete, 'index_cache',
+                             autocomplete.PrefixIndexCache()):
+            self.assertEqual(purge.process_jobs(), 1)
+
+        self.assertEqual(stats.get_stats(self.user)['recipes']['count'], 0)
+        self.assertEqual(len(similarity.registry.get(self.user.pk).ids), 0)
+        self.assertEqual(autocomplete.search('tag', self.user.pk, 'v'), [])
+
+    def test_job_status_limited_to_owner(self):
+        job = PurgeJob.objects.create(
+            owner_id=self.other.pk, scope=PurgeJob.RECIPES
+        )
+
+        res = self.client.get(purge_url(job.pk))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_account(self):
+        Token.objects.create(user=self.user)
+
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+        purge.process_jobs()
+
+        job = PurgeJob.objects.get(pk=res.data['id'])
+        self.assertEqual(job.status, PurgeJob.DONE)
+        self.assertEqual(job.deleted_recipes, 5)
+        self.assertEqual(job.deleted_tags, 1)
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertFalse(Ingredient.objects.filter(
+            user_id=self.user.pk
+        ).exists())
+        self.assertTrue(Recipe.objects.filter(pk=self.kept.pk).exists())
+
+    def test_stale_job_is_resumed(self):
+        job = PurgeJob.objects.create(
+            owner_id=self.user.pk, scope=PurgeJob.USER,
+            status=PurgeJob.RUNNING,
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        fresh = PurgeJob.objects.create(
+            owner_id=self.other.pk, scope=PurgeJob.USER,
+            status=PurgeJob.RUNNING, heartbeat_at=timezone.now()
+        )
+
+        self.assertEqual(purge.process_jobs(), 1)
+
+        job.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual(job.status, PurgeJob.DONE)
+        self.assertEqual(fresh.status, PurgeJob.RUNNING)
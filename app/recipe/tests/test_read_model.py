@@ -0,0 +1,95 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class RecipeReadModelTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='Salt'
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1
+        )
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+    def stored(self):
+        return Recipe.objects.get(pk=self.recipe.pk).relations
+
+    def test_built_on_write(self):
+        self.assertEqual(self.stored(), {
+            'tags': [{'id': self.tag.id, 'name': 'Vegan'}],
+            'ingredients': [{'id': self.ingredient.id, 'name': 'Salt'}],
+        })
+
+    def test_list_and_detail_render_without_joins(self):
+        for index in range(3):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'r{index}', time_minutes=5, price=1
+            )
+            recipe.tags.add(self.tag)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data[-1]['tags'], [self.tag.id])
+
+        with self.assertNumQueries(1):
+            res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res.data['ingredients'],
+                         [{'id': self.ingredient.id, 'name': 'Salt'}])
+
+    def test_rename_and_delete_propagate(self):
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+        self.assertEqual(self.stored()['tags'][0]['name'], 'Vegetarian')
+
+        self.ingredient.delete()
+        self.assertEqual(self.stored()['ingredients'], [])
+
+        self.tag.recipe_set.clear()
+        self.assertEqual(self.stored()['tags'], [])
+
+    def test_update_response_uses_new_relations(self):
+        other = Tag.objects.create(user=self.user, name='Quick')
+
+        res = self.client.patch(detail_url(self.recipe.id),
+                                {'add_tags': [other.id]}, format='json')
+
+        self.assertEqual(res.data['tags'], [self.tag.id, other.id])
+
+    def test_check_and_backfill(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(relations={})
+
+        with self.assertRaises(CommandError):
+            call_command('check_read_model', stdout=StringIO())
+
+        call_command('backfill_read_model', stdout=StringIO())
+        self.assertEqual(self.stored()['tags'][0]['id'], self.tag.id)
+        call_command('check_read_model', stdout=StringIO())
+
+        Recipe.tags.through.objects.all()._raw_delete('default')
+        out = StringIO()
+        call_command('check_read_model', '--fix', stdout=out)
+        self.assertIn('1 recipe(s) fixed', out.getvalue())
+        self.assertEqual(self.stored()['tags'], [])
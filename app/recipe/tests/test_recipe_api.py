@@ -1,4 +1,6 @@
-from django.test import TestCase
+import base64
+import json
+from django.test import TestCase, RequestFactory
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
@@ -225,3 +227,295 @@ class RecipeUploadImageTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+
+class RecipeRangeFilterTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.quick = sample_recipe(self.user, time_minutes=10, price=4.00)
+        self.medium = sample_recipe(self.user, time_minutes=30, price=12.00)
+        self.slow = sample_recipe(self.user, time_minutes=90, price=8.00)
+
+    def ids(self, res):
+        return [recipe['id'] for recipe in res.data]
+
+    def test_filter_by_time_range(self):
+        res = self.client.get(RECIPE_URL, {'max_time': 30})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids(res), [self.medium.id, self.quick.id])
+        res = self.client.get(RECIPE_URL, {'min_time': 30, 'max_time': 60})
+        self.assertEqual(self.ids(res), [self.medium.id])
+
+    def test_filter_by_price_range(self):
+        res = self.client.get(RECIPE_URL, {'max_price': '10'})
+        self.assertEqual(self.ids(res), [self.slow.id, self.quick.id])
+        res = self.client.get(RECIPE_URL, {'min_price': '8.50'})
+        self.assertEqual(self.ids(res), [self.medium.id])
+
+    def test_ordering(self):
+        res = self.client.get(RECIPE_URL, {'ordering': 'price'})
+        self.assertEqual(
+            self.ids(res), [self.quick.id, self.slow.id, self.medium.id]
+        )
+        res = self.client.get(RECIPE_URL, {'ordering': '-time_minutes'})
+        self.assertEqual(
+            self.ids(res), [self.slow.id, self.medium.id, self.quick.id]
+        )
+
+    def test_invalid_params_rejected(self):
+        for params in ({'max_time': 'soon'}, {'min_price': 'cheap'},
+                       {'max_price': '-1'}, {'ordering': 'title'},
+                       {'tags': '1,two'}, {'cursor': 'garbage'}):
+            res = self.client.get(RECIPE_URL, params)
+            self.assertEqual(
+                res.status_code, status.HTTP_400_BAD_REQUEST, params
+            )
+
+    def test_keyset_pagination(self):
+        sample_recipe(self.user, time_minutes=30, price=1.00)
+        seen = []
+        res = self.client.get(
+            RECIPE_URL, {'ordering': 'time_minutes', 'limit': 2}
+        )
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            seen.extend(r['time_minutes'] for r in res.data['results'])
+            if not res.data['next']:
+                break
+            res = self.client.get(res.data['next'])
+        self.assertEqual(seen, [10, 30, 30, 90])
+
+    def test_tampered_cursor_rejected(self):
+        def cursor(value, last_id=1):
+            payload = json.dumps([value, last_id]).encode()
+            return base64.urlsafe_b64encode(payload).decode()
+
+        for ordering, value, last_id in (
+                ('time_minutes', 'abc', 1), ('time_minutes', {'a': 1}, 1),
+                ('time_minutes', None, 1), ('time_minutes', [], 1),
+                ('price', 'NaN', 1), ('price', [1], 1), ('id', 1, 'x'),
+                ('-id', 1, {'a': 1})):
+            res = self.client.get(RECIPE_URL, {
+                'ordering': ordering, 'cursor': cursor(value, last_id)
+            })
+            self.assertEqual(
+                res.status_code, status.HTTP_400_BAD_REQUEST, (ordering, value)
+            )
+
+
+class RecipeRelatedValidationTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, **params):
+        payload = {'title': 'test title', 'time_minutes': 10, 'price': 5.00}
+        payload.update(params)
+        return payload
+
+    def test_foreign_and_missing_ids_reported_together(self):
+        other = get_user_model().objects.create_user(
+            email='other@mail.com',
+            password='pass123'
+        )
+        own = sample_tag(self.user)
+        foreign = sample_tag(other)
+        res = self.client.post(
+            RECIPE_URL, self.payload(tags=[own.id, foreign.id, 9999])
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(foreign.id), res.data['tags'][0])
+        self.assertIn('9999', res.data['tags'][0])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_validation_queries_do_not_grow_with_ids(self):
+        few = [sample_ingredient(self.user, f'a{i}').id for i in range(2)]
+        many = [sample_ingredient(self.user, f'b{i}').id for i in range(20)]
+        request = RequestFactory().post(RECIPE_URL)
+        request.user = self.user
+        serializer = RecipeSerializer(
+            data=self.payload(ingredients=few, tags=[]),
+            context={'request': request}
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        serializer = RecipeSerializer(
+            data=self.payload(ingredients=many, tags=[]),
+            context={'request': request}
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(
+            [i.id for i in serializer.validated_data['ingredients']], many
+        )
+
+    def test_invalid_pk_type(self):
+        res = self.client.post(RECIPE_URL, self.payload(tags=['x']))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeRelationUpdateTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+        self.tag1 = sample_tag(self.user, 'tag 1')
+        self.tag2 = sample_tag(self.user, 'tag 2')
+        self.recipe.tags.add(self.tag1)
+
+    def tag_ids(self):
+        return set(self.recipe.tags.values_list('id', flat=True))
+
+    def test_add_and_remove_tags(self):
+        url = detail_url(self.recipe.id)
+        res = self.client.patch(
+            url, {'add_tags': [self.tag2.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.tag_ids(), {self.tag1.id, self.tag2.id})
+        self.assertNotIn('add_tags', res.data)
+
+        res = self.client.patch(
+            url, {'remove_tags': [self.tag1.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.tag_ids(), {self.tag2.id})
+        self.assertEqual(res.data['tags'], [self.tag2.id])
+
+    def test_unchanged_relations_not_rewritten(self):
+        through = Recipe.tags.through
+        row = through.objects.get(recipe=self.recipe)
+        res = self.client.patch(
+            detail_url(self.recipe.id),
+            {'tags': [self.tag1.id, self.tag2.id]},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(through.objects.filter(pk=row.pk).exists())
+        self.assertEqual(self.tag_ids(), {self.tag1.id, self.tag2.id})
+
+    def test_patch_without_relations_keeps_them(self):
+        res = self.client.patch(
+            detail_url(self.recipe.id), {'title': 'new'}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.tag_ids(), {self.tag1.id})
+
+
+class RecipeBatchRetrieveTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('recipe:recipe-batch')
+
+    def test_batch_returns_details_in_request_order(self):
+        recipes = [sample_recipe(self.user, title=f'r{i}') for i in range(3)]
+        for recipe in recipes:
+            recipe.tags.add(sample_tag(self.user, recipe.title))
+            recipe.ingredients.add(sample_ingredient(self.user, recipe.title))
+        ids = [recipes[2].id, recipes[0].id, recipes[1].id]
+
+        with self.assertNumQueries(1):
+            res = self.client.get(
+                self.url, {'ids': ','.join(map(str, ids))}
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], ids)
+        expected = RecipeDetailSerializer(recipes[2])
+        self.assertEqual(res.data[0]['tags'], expected.data['tags'])
+
+    def test_batch_skips_other_users_recipes(self):
+        other = get_user_model().objects.create_user(
+            email='other@mail.com',
+            password='pass123'
+        )
+        own = sample_recipe(self.user)
+        foreign = sample_recipe(other)
+        res = self.client.get(self.url, {'ids': f'{own.id},{foreign.id}'})
+        self.assertEqual([r['id'] for r in res.data], [own.id])
+
+    def test_batch_size_capped(self):
+        ids = ','.join(str(i) for i in range(1, 102))
+        with self.assertLogs('core.budgets', 'WARNING'):
+            res = self.client.get(self.url, {'ids': ids})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ShoppingListTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('recipe:recipe-shopping-list')
+        self.salt = sample_ingredient(self.user, 'Salt')
+        self.eggs = sample_ingredient(self.user, 'Eggs')
+        self.tag = sample_tag(self.user, 'Breakfast')
+        self.omelette = sample_recipe(self.user, title='Omelette')
+        self.omelette.ingredients.add(self.salt, self.eggs)
+        self.omelette.tags.add(self.tag)
+        self.soup = sample_recipe(self.user, title='Soup')
+        self.soup.ingredients.add(self.salt)
+
+    def test_shopping_list_by_ids(self):
+        ids = f'{self.soup.id},{self.omelette.id}'
+
+        with self.assertNumQueries(1):
+            res = self.client.get(self.url, {'ids': ids})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.eggs.id, 'name': 'Eggs', 'count': 1,
+             'recipes': [self.omelette.id]},
+            {'id': self.salt.id, 'name': 'Salt', 'count': 2,
+             'recipes': sorted([self.omelette.id, self.soup.id])},
+        ])
+
+    def test_shopping_list_by_tags(self):
+        res = self.client.get(self.url, {'tags': self.tag.id})
+
+        self.assertEqual([item['name'] for item in res.data],
+                         ['Eggs', 'Salt'])
+        self.assertEqual(res.data[1]['recipes'], [self.omelette.id])
+
+    def test_other_users_recipes_ignored(self):
+        other = get_user_model().objects.create_user(
+            email='other@mail.com', password='pass123'
+        )
+        recipe = sample_recipe(other)
+        recipe.ingredients.add(sample_ingredient(other, 'Flour'))
+
+        res = self.client.get(self.url, {'ids': recipe.id})
+
+        self.assertEqual(res.data, [])
+
+    def test_ids_or_tags_required(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
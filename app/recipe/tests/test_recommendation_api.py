@@ -0,0 +1,171 @@
+import threading
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+from recipe import similarity
+
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, title):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class RecipeIndexTests(TestCase):
+
+    def test_scores_and_compaction(self):
+        features = {
+            1: {('t', 1), ('i', 1)},
+            2: {('t', 1), ('i', 2)},
+            3: {('i', 3)},
+        }
+        index = similarity.RecipeIndex(1, features, 0)
+        self.assertEqual(
+            [pk for pk, _ in index.score({('t', 1), ('i', 1)})], [1, 2]
+        )
+        index.update({3: {('t', 1), ('i', 1)}}, removed=[1])
+        results = index.score({('t', 1), ('i', 1)})
+        self.assertEqual([pk for pk, _ in results], [3, 2])
+        self.assertEqual(results[0][1], 1.0)
+        index.compact()
+        self.assertEqual(index.overlay, {})
+        self.assertEqual(
+            [pk for pk, _ in index.score({('t', 1), ('i', 1)})], [3, 2]
+        )
+
+    def test_readers_wait_for_updates(self):
+        index = similarity.RecipeIndex(1, {1: {('i', 1)}}, 0)
+        results = []
+        reader = threading.Thread(
+            target=lambda: results.append(index.cookable([1]))
+        )
+        with index.lock:
+            reader.start()
+            reader.join(0.1)
+            self.assertTrue(reader.is_alive())
+            index.update({2: {('i', 1)}}, removed=[1])
+        reader.join()
+        self.assertEqual(results, [[(2, 1.0)]])
+
+
+class RecommendationAPITests(TestCase):
+
+    def setUp(self):
+        similarity.registry.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='vegan')
+        self.rice = Ingredient.objects.create(user=self.user, name='rice')
+        self.beans = Ingredient.objects.create(user=self.user, name='beans')
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+
+    def test_similar_recipes(self):
+        recipe1 = sample_recipe(self.user, 'rice and beans')
+        recipe1.tags.add(self.vegan)
+        recipe1.ingredients.add(self.rice, self.beans)
+        recipe2 = sample_recipe(self.user, 'rice')
+        recipe2.tags.add(self.vegan)
+        recipe2.ingredients.add(self.rice)
+        sample_recipe(self.user, 'salt').ingredients.add(self.salt)
+
+        res = self.client.get(similar_url(recipe1.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [recipe2.id])
+        self.assertAlmostEqual(res.data[0]['score'], 2 / 3, places=3)
+
+    def test_index_updated_on_m2m_change(self):
+        recipe1 = sample_recipe(self.user, 'rice and beans')
+        recipe1.ingredients.add(self.rice, self.beans)
+        recipe2 = sample_recipe(self.user, 'salt')
+        recipe2.ingredients.add(self.salt)
+        res = self.client.get(similar_url(recipe1.id))
+        self.assertEqual(res.data, [])
+
+        recipe2.ingredients.add(self.rice)
+        res = self.client.get(similar_url(recipe1.id))
+        self.assertEqual([r['id'] for r in res.data], [recipe2.id])
+
+        recipe2.delete()
+        res = self.client.get(similar_url(recipe1.id))
+        self.assertEqual(res.data, [])
+
+    def test_other_processes_apply_logged_changes(self):
+        recipe1 = sample_recipe(self.user, 'rice and beans')
+        recipe1.ingredients.add(self.rice, self.beans)
+        recipe2 = sample_recipe(self.user, 'salt')
+        recipe2.ingredients.add(self.salt)
+        index = similarity.registry.get(self.user.pk)
+
+        # Changes made by another process leave this index untouched
+        with patch.object(similarity.registry, 'loaded', return_value=None):
+            recipe2.ingredients.set([self.rice])
+            recipe3 = sample_recipe(self.user, 'beans')
+            recipe3.ingredients.add(self.beans)
+
+        with patch.object(similarity, 'load_features',
+                          wraps=similarity.load_features) as load:
+            self.assertIs(similarity.registry.get(self.user.pk), index)
+        load.assert_called_once_with(self.user.pk, {recipe2.id, recipe3.id})
+        self.assertEqual(
+            [pk for pk, _ in index.cookable([self.rice.id])],
+            [recipe2.id, recipe1.id]
+        )
+
+        with patch.object(similarity.registry, 'loaded', return_value=None):
+            recipe3.delete()
+        self.assertIs(similarity.registry.get(self.user.pk), index)
+        self.assertEqual(index.cookable([self.beans.id]), [(recipe1.id, 0.5)])
+
+    def test_rebuilt_when_too_many_changes(self):
+        index = similarity.registry.get(self.user.pk)
+        with patch.object(similarity.registry, 'loaded', return_value=None):
+            sample_recipe(self.user, 'one').ingredients.add(self.rice)
+            sample_recipe(self.user, 'two').ingredients.add(self.rice)
+        with patch.object(similarity, 'DELTA_LIMIT', 1):
+            self.assertIsNot(similarity.registry.get(self.user.pk), index)
+
+    def test_cookable_ranks_by_coverage(self):
+        recipe1 = sample_recipe(self.user, 'rice and beans')
+        recipe1.ingredients.add(self.rice, self.beans)
+        recipe2 = sample_recipe(self.user, 'rice')
+        recipe2.ingredients.add(self.rice)
+        recipe3 = sample_recipe(self.user, 'salt')
+        recipe3.ingredients.add(self.salt)
+
+        res = self.client.get(COOKABLE_URL, {'ingredients': self.rice.id})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [r['id'] for r in res.data], [recipe2.id, recipe1.id]
+        )
+        self.assertEqual(res.data[0]['score'], 1.0)
+        self.assertEqual(res.data[1]['score'], 0.5)
+
+    def test_similar_limited_to_user(self):
+        other = get_user_model().objects.create_user(
+            'other@mail.com', 'pass123'
+        )
+        recipe = sample_recipe(other, 'other')
+        res = self.client.get(similar_url(recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_limit(self):
+        res = self.client.get(
+            COOKABLE_URL, {'ingredients': self.rice.id, 'limit': 0}
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
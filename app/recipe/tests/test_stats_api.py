@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+
+STATS_URL = reverse('recipe:recipe-cookbook-stats')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test title', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class StatsAPITests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@mail.com', 'pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        res = APIClient().get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_recipe_aggregates(self):
+        sample_recipe(self.user, time_minutes=10, price=4.00)
+        sample_recipe(self.user, time_minutes=45, price=12.00)
+        other = get_user_model().objects.create_user('o@mail.com', 'pass')
+        sample_recipe(other, time_minutes=500, price=99.00)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipes = res.data['recipes']
+        self.assertEqual(recipes['count'], 2)
+        self.assertEqual(recipes['price']['avg'], 8.0)
+        self.assertEqual(recipes['time_minutes']['max'], 45)
+        histogram = recipes['time_minutes']['histogram']
+        time_counts = [b['count'] for b in histogram]
+        self.assertEqual(time_counts, [1, 0, 1, 0, 0])
+        price_counts = [b['count'] for b in recipes['price']['histogram']]
+        self.assertEqual(price_counts, [1, 0, 1, 0, 0])
+
+    def test_tag_and_ingredient_stats(self):
+        tag = Tag.objects.create(user=self.user, name='dinner')
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        Ingredient.objects.create(user=self.user, name='saffron')
+        recipe1 = sample_recipe(self.user, price=4.00, time_minutes=10)
+        recipe2 = sample_recipe(self.user, price=6.00, time_minutes=20)
+        recipe1.tags.add(tag)
+        recipe2.tags.add(tag)
+        recipe1.ingredients.add(salt)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['tags'][0]['recipe_count'], 2)
+        self.assertEqual(res.data['tags'][0]['avg_price'], 5.0)
+        self.assertEqual(res.data['tags'][0]['avg_time_minutes'], 15.0)
+        self.assertEqual(
+            [(i['name'], i['recipe_count']) for i in res.data['ingredients']],
+            [('salt', 1), ('saffron', 0)]
+        )
+
+    def test_only_changed_sections_recomputed(self):
+        tag = Tag.objects.create(user=self.user, name='dinner')
+        sample_recipe(self.user).tags.add(tag)
+        self.client.get(STATS_URL)
+
+        tag.name = 'supper'
+        tag.save()
+        with self.assertNumQueries(2):
+            res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['tags'][0]['name'], 'supper')
+
+        with self.assertNumQueries(1):
+            self.client.get(STATS_URL)
+
+        sample_recipe(self.user)
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['recipes']['count'], 2)
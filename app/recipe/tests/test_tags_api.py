@@ -1,9 +1,14 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from core.models import Tag, Recipe
+from core import versions
+from core.models import CacheVersion, ChangeLogEntry, Tag, Recipe
+from recipe.autocomplete import index_cache
 from recipe.serializers import TagSerializer
 
 
@@ -34,7 +39,7 @@ class PrivateTagAPITests(TestCase):
         Tag.objects.create(user=self.user, name='test 1')
         Tag.objects.create(user=self.user, name='test 2')
         res = self.client.get(TAG_URL)
-        tags = Tag.objects.all().order_by('-name')
+        tags = Tag.objects.all().order_by('-term__value')
         serializer = TagSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -55,7 +60,7 @@ class PrivateTagAPITests(TestCase):
         payload = {'name': 'test'}
         self.client.post(TAG_URL, payload)
         exists = Tag.objects.filter(
-            name=payload['name'],
+            term__value=payload['name'],
             user=self.user
         ).exists()
         self.assertTrue(exists)
@@ -101,3 +106,116 @@ class PrivateTagAPITests(TestCase):
         recipe2.tags.add(tag1)
         res = self.client.get(TAG_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
+
+    def test_create_existing_tag_is_idempotent(self):
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.post(TAG_URL, {'name': 'vegan'})
+        self.assertEqual(res.data['id'], tag.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_resolve_tags_by_name(self):
+        existing = Tag.objects.create(user=self.user, name='Vegan')
+        url = reverse('recipe:tag-resolve')
+        payload = {'names': ['dinner', 'VEGAN', 'Dinner', 'quick']}
+        res = self.client.post(url, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [tag['name'] for tag in res.data], ['dinner', 'Vegan', 'quick']
+        )
+        self.assertEqual(res.data[1]['id'], existing.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+        # The SELECT, inside the savepoint of the request's transaction
+        with self.assertNumQueries(3):
+            res = self.client.post(url, payload, format='json')
+        self.assertEqual(len(res.data), 3)
+
+    def test_resolve_cost_independent_of_batch_size(self):
+        url = reverse('recipe:tag-resolve')
+
+        def post(names):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(url, {'names': names}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        # The first write creates the user's version counters
+        post(['warm'])
+        few = post(['a0', 'a1'])
+        many = post([f'b{index}' for index in range(50)])
+
+        self.assertEqual(few, many)
+        self.assertEqual(
+            ChangeLogEntry.objects.filter(user=self.user, kind='tag').count(),
+            53
+        )
+
+    def test_resolve_requires_names(self):
+        url = reverse('recipe:tag-resolve')
+        res = self.client.post(url, {'names': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TagAutocompleteTests(TestCase):
+
+    def setUp(self):
+        index_cache.clear()
+        versions.forget_recent()
+        self.user = get_user_model().objects.create_user(
+            email='test@mail.com',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('recipe:tag-autocomplete')
+        for name in ('Salad', 'salty', 'Soup', 'sauce'):
+            Tag.objects.create(user=self.user, name=name)
+
+    def names(self, prefix, **params):
+        res = self.client.get(self.url, dict(prefix=prefix, **params))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [tag['name'] for tag in res.data]
+
+    def test_prefix_search_case_insensitive(self):
+        self.assertEqual(self.names('SA'), ['Salad', 'salty', 'sauce'])
+        self.assertEqual(self.names('sa', limit=1), ['Salad'])
+        self.assertEqual(self.names('x'), [])
+
+    def test_hot_path_runs_no_query(self):
+        self.names('sa')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('so'), ['Soup'])
+
+    def test_other_processes_changes_seen_after_version_expires(self):
+        self.names('sa')
+        # A rename in another process bumps the counter behind our back
+        CacheVersion.objects.filter(owner_id=self.user.pk).update(
+            value=F('value') + 1
+        )
+        Tag.objects.filter(term__value='Salad')._raw_delete('default')
+
+        self.assertIn('Salad', self.names('sa'))
+        with override_settings(AUTOCOMPLETE_VERSION_SECONDS=0):
+            self.assertNotIn('Salad', self.names('sa'))
+
+    def test_cache_invalidated_on_change(self):
+        self.names('sa')
+        Tag.objects.create(user=self.user, name='Sandwich')
+        Tag.objects.get(term__value='salty').delete()
+        self.assertEqual(self.names('sa'), ['Salad', 'Sandwich', 'sauce'])
+
+    def test_limited_to_user(self):
+        other = get_user_model().objects.create_user(
+            email='other@mail.com',
+            password='pass123'
+        )
+        Tag.objects.create(user=other, name='Saffron')
+        self.assertNotIn('Saffron', self.names('sa'))
+
+    @override_settings(AUTOCOMPLETE_MAX_NAMES=2)
+    def test_large_vocabulary_falls_back_to_query(self):
+        self.assertEqual(self.names('sa'), ['Salad', 'salty', 'sauce'])
+
+    def test_prefix_required(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
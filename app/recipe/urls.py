@@ -11,5 +11,8 @@ router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
-    path('', include(router.urls))
+    path('', include(router.urls)),
+    path('changes/', views.ChangesView.as_view(), name='changes'),
+    path('purges/<int:pk>/', views.PurgeJobView.as_view(),
+         name='purge-detail'),
 ]
@@ -1,17 +1,28 @@
-from rest_framework import viewsets, mixins, status
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, router, transaction
+from rest_framework import viewsets, mixins, status, generics
 from rest_framework import authentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from recipe import serializers
-from core.models import Tag, Ingredient, Recipe
+from rest_framework.views import APIView
+from recipe import autocomplete, changes, image_hashes, purge, \
+    serializers, shopping, signals, similarity, stats
+from recipe.pagination import KeysetPagination
+from core.models import Tag, Ingredient, Recipe, PurgeJob
+from core import budgets
+from core.idempotency import idempotent
+from core.sharding import ShardRoutingMixin
 
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttrViewSet(ShardRoutingMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    action_query_budgets = {'create': 'names', 'resolve': 'names'}
 
     def get_queryset(self):
         assigned_only = bool(
@@ -23,10 +34,77 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
 
         return queryset.filter(
             user=self.request.user
-            ).order_by('-name').distinct()
+            ).order_by('-term__value').distinct()
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        return serializer.save(user=self.request.user)
+        name = serializer.validated_data['name']
+        existing = self._find_by_names([name])
+        if existing:
+            serializer.instance = existing[0]
+            return serializer.instance
+        try:
+            with transaction.atomic(using=router.db_for_write(
+                    self.queryset.model)):
+                return serializer.save(user=self.request.user)
+        except IntegrityError:
+            serializer.instance = self._find_by_names([name])[0]
+            return serializer.instance
+
+    def _find_by_names(self, names):
+        return list(self.queryset.filter(
+            user=self.request.user,
+            folded_term__value__in=[name.lower() for name in names]
+        ))
+
+    @action(methods=['POST'], detail=False)
+    def resolve(self, request):
+        """Return the objects with the given names, creating missing ones"""
+        serializer = serializers.NameListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        names = serializer.validated_data['names']
+        model = self.queryset.model
+
+        found = {obj.name.lower(): obj for obj in self._find_by_names(names)}
+        missing = [name for name in names if name.lower() not in found]
+        if missing:
+            using = router.db_for_write(model)
+            objs = [model(user=request.user, name=name) for name in missing]
+            with transaction.atomic(using=using):
+                model.intern_names(objs, using)
+                model.objects.using(using).bulk_create(
+                    objs, ignore_conflicts=True
+                )
+                created = self._find_by_names(missing)
+                # One change log write, version bump and event for the
+                # batch rather than a post_save per object
+                signals.features_saved(
+                    model, request.user.pk, [obj.pk for obj in created]
+                )
+            for obj in created:
+                found[obj.name.lower()] = obj
+
+        objects = [found[name.lower()] for name in names]
+        return Response(self.get_serializer(objects, many=True).data)
+
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        prefix = request.query_params.get('prefix', '')
+        if not prefix:
+            raise ValidationError({'prefix': 'This field is required.'})
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if not 1 <= limit <= 50:
+            raise ValidationError({'limit': 'Must be between 1 and 50.'})
+        return Response(autocomplete.search(
+            self.queryset.model._meta.model_name, request.user.pk,
+            prefix, limit
+        ))
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -39,43 +117,295 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ShardRoutingMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = serializers.RecipeSerializer
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
+    ordering_fields = ('id', 'time_minutes', 'price')
+    default_ordering = '-id'
+    max_batch_size = 100
+    max_shopping_list_size = 500
+    action_query_budgets = {
+        'cookbook_stats': 'bulk',
+        'create': 'write',
+        'update': 'write',
+        'partial_update': 'write',
+        'destroy': 'write',
+        'upload_image': 'write',
+        'purge_recipes': 'write',
+    }
+
+    def _params_to_ints(self, qs, name='ids', limit=None):
+        budgets.check_ids(self, qs, name, limit)
+        try:
+            return [int(str_id) for str_id in qs.split(',')]
+        except ValueError:
+            raise ValidationError(
+                {name: 'Must be a comma separated list of integers.'}
+            )
+
+    def _param_to_int(self, name):
+        value = self.request.query_params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer.'})
+        if value < 0:
+            raise ValidationError({name: 'Must not be negative.'})
+        return value
 
-    def _params_to_ints(self, qs):
-        return [int(str_id) for str_id in qs.split(',')]
+    def _param_to_decimal(self, name):
+        value = self.request.query_params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: 'Must be a number.'})
+        if not value.is_finite() or value < 0:
+            raise ValidationError({name: 'Must be a non-negative number.'})
+        return value
+
+    def get_ordering(self):
+        ordering = self.request.query_params.get(
+            'ordering', self.default_ordering
+        )
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({
+                'ordering': 'Must be one of ' + ', '.join(
+                    self.ordering_fields
+                ) + ' optionally prefixed with -.'
+            })
+        return ordering
 
     def get_queryset(self):
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
         if tags:
-            tag_ids = self._params_to_ints(tags)
+            tag_ids = self._params_to_ints(tags, 'tags')
             queryset = queryset.filter(tags__id__in=tag_ids)
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
+            ingredient_ids = self._params_to_ints(ingredients, 'ingredients')
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
 
-        return queryset.filter(user=self.request.user)
+        min_time = self._param_to_int('min_time')
+        max_time = self._param_to_int('max_time')
+        min_price = self._param_to_decimal('min_price')
+        max_price = self._param_to_decimal('max_price')
+        if min_time is not None:
+            queryset = queryset.filter(time_minutes__gte=min_time)
+        if max_time is not None:
+            queryset = queryset.filter(time_minutes__lte=max_time)
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+
+        ordering = self.get_ordering()
+        direction = '-' if ordering.startswith('-') else ''
+        return queryset.filter(user=self.request.user).order_by(
+            *dict.fromkeys((ordering, f'{direction}id'))
+        )
 
     def get_serializer_class(self):
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'batch'):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
         return self.serializer_class
 
+    def _get_limit(self, default=10, maximum=50):
+        try:
+            limit = int(self.request.query_params.get('limit', default))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if not 1 <= limit <= maximum:
+            raise ValidationError(
+                {'limit': f'Must be between 1 and {maximum}.'}
+            )
+        return limit
+
+    def _scored_response(self, results):
+        recipes = self.queryset.filter(
+            user=self.request.user,
+            id__in=[recipe_id for recipe_id, _ in results]
+        ).in_bulk()
+        data = []
+        for recipe_id, score in results:
+            if recipe_id not in recipes:
+                continue
+            item = self.get_serializer(recipes[recipe_id]).data
+            item['score'] = round(score, 4)
+            data.append(item)
+        return Response(data)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         return serializer.save(user=self.request.user)
 
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        recipe = self.get_object()
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in ('jaccard', 'cosine'):
+            raise ValidationError({'metric': 'Must be jaccard or cosine.'})
+        index = similarity.registry.get(request.user.pk)
+        results = index.score(
+            index.features_of(recipe.pk) or (),
+            metric=metric,
+            limit=self._get_limit(),
+            exclude=recipe.pk
+        )
+        return self._scored_response(results)
+
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        ingredients = request.query_params.get('ingredients')
+        if not ingredients:
+            raise ValidationError({'ingredients': 'This field is required.'})
+        index = similarity.registry.get(request.user.pk)
+        results = index.cookable(
+            self._params_to_ints(ingredients, 'ingredients'),
+            limit=self._get_limit()
+        )
+        return self._scored_response(results)
+
+    @action(methods=['GET'], detail=False)
+    def batch(self, request):
+        ids = request.query_params.get('ids')
+        if not ids:
+            raise ValidationError({'ids': 'This field is required.'})
+        ids = list(dict.fromkeys(
+            self._params_to_ints(ids, 'ids', self.max_batch_size)
+        ))
+        recipes = self.queryset.filter(
+            user=request.user, id__in=ids
+        ).in_bulk()
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """Ingredients needed for the recipes in ids, or matching tags"""
+        ids = request.query_params.get('ids')
+        if not ids and not request.query_params.get('tags'):
+            raise ValidationError({'ids': 'Pass ids or tags.'})
+        recipes = self.get_queryset()
+        if ids:
+            ids = set(self._params_to_ints(
+                ids, 'ids', self.max_shopping_list_size
+            ))
+            recipes = recipes.filter(id__in=ids)
+        return Response(shopping.shopping_list(recipes))
+
+    @action(methods=['GET'], detail=False, url_path='stats')
+    def cookbook_stats(self, request):
+        return Response(stats.get_stats(request.user))
+
+    @action(methods=['POST'], detail=False, url_path='purge',
+            url_name='purge')
+    def purge_recipes(self, request):
+        """Queue deletion of all current recipes, processed in batches"""
+        job = purge.start_recipe_purge(request.user)
+        return Response(
+            serializers.PurgeJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
+    @idempotent
     def upload_image(self, request, pk=None):
+        """Store an image, flagging the user's near-duplicate images.
+
+        With ``?reuse=true`` the file of the closest duplicate is reused
+        instead of storing another copy.
+        """
         recipe = self.get_object()
         serializer = self.get_serializer(recipe, data=request.data)
-        if serializer.is_valid():
+        if not serializer.is_valid():
+            return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        image = serializer.validated_data.get('image')
+        image_hash = image_hashes.hash_file(image) if image else None
+        duplicates = image_hashes.find_duplicates(
+            request.user.pk, image_hash, exclude=recipe.pk
+        )
+        source = None
+        if duplicates and request.query_params.get('reuse') in ('1', 'true'):
+            source = self.queryset.filter(
+                user=request.user, id__in=[pk for pk, _ in duplicates]
+            ).exclude(image='').in_bulk()
+            source = next(
+                (source[pk] for pk, _ in duplicates if pk in source), None
+            )
+        if source is not None:
+            recipe.image = source.image.name
+            recipe.image_hash = image_hashes.to_db(image_hash)
+            recipe.save()
+        elif 'image' in serializer.validated_data:
+            hash_value = None if image_hash is None else \
+                image_hashes.to_db(image_hash)
+            serializer.save(image_hash=hash_value)
+        else:
             serializer.save()
-            return Response(serializer.data, status.HTTP_200_OK)
-        return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        if image_hash is not None:
+            image_hashes.image_changed(request.user.pk, recipe.pk, image_hash)
+
+        data = dict(self.get_serializer(recipe).data)
+        data['duplicates'] = [
+            {'id': pk, 'distance': distance} for pk, distance in duplicates
+        ]
+        data['reused_from'] = source.pk if source is not None else None
+        return Response(data, status.HTTP_200_OK)
+
+
+class ChangesView(ShardRoutingMixin, APIView):
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    page_size = 500
+
+    def get(self, request):
+        result = changes.changes_since(
+            request.user, request.query_params.get('since'), self.page_size
+        )
+        context = {'request': request}
+        objects = result['objects']
+        deleted = result['deleted']
+        return Response({
+            'cursor': result['cursor'],
+            'reset': result['reset'],
+            'has_more': result['has_more'],
+            'recipes': serializers.RecipeSerializer(
+                objects['recipe'], many=True, context=context
+            ).data,
+            'tags': serializers.TagSerializer(
+                objects['tag'], many=True
+            ).data,
+            'ingredients': serializers.IngredientSerializer(
+                objects['ingredient'], many=True
+            ).data,
+            'deleted': {
+                'recipes': deleted['recipe'],
+                'tags': deleted['tag'],
+                'ingredients': deleted['ingredient'],
+            },
+        })
+
+
+class PurgeJobView(generics.RetrieveAPIView):
+    serializer_class = serializers.PurgeJobSerializer
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return PurgeJob.objects.filter(owner_id=self.request.user.pk)
@@ -0,0 +1,123 @@
+"""
+Write-behind buffer for ``User.last_login``.
+
+Logging in used to write the user row on every successful token request,
+which makes login spikes contend on the user table. Instead
+``user_logged_in`` records the timestamp in a per-process buffer that keeps
+only the latest value per user. A background thread writes the buffer with
+``bulk_update`` every ``ACTIVITY_FLUSH_SECONDS``, and sooner once
+``ACTIVITY_BUFFER_MAX_USERS`` users are pending. The buffer is also flushed
+when the process exits, so at most one interval of updates is lost if a
+process is killed. ``ACTIVITY_FLUSH_SECONDS = 0`` writes through as before.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def flush_interval():
+    return getattr(settings, 'ACTIVITY_FLUSH_SECONDS', 10)
+
+
+class ActivityBuffer:
+    """Latest pending last_login per user id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._worker = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, when):
+        with self._lock:
+            current = self._pending.get(user_id)
+            if current is None or when > current:
+                self._pending[user_id] = when
+            return len(self._pending)
+
+    def flush(self):
+        """Write the pending timestamps, returning how many users"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        User = get_user_model()
+        try:
+            User.objects.bulk_update(
+                [User(pk=pk, last_login=when)
+                 for pk, when in sorted(pending.items())],
+                ['last_login'], batch_size=BATCH_SIZE
+            )
+        except Exception:
+            for user_id, when in pending.items():
+                self.add(user_id, when)
+            raise
+        return len(pending)
+
+    def start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(
+                target=self._run, name='activity-flush', daemon=True
+            )
+            self._worker.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._stop.set()
+            worker.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing last_login updates failed')
+
+    def _run(self):
+        while not self._stop.wait(flush_interval()):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing last_login updates failed')
+            finally:
+                connections.close_all()
+
+
+buffer = ActivityBuffer()
+
+
+def logged_in(sender, request, user, **kwargs):
+    """``user_logged_in`` receiver replacing ``update_last_login``"""
+    if flush_interval() <= 0:
+        update_last_login(sender, user)
+        return
+    user.last_login = timezone.now()
+    pending = buffer.add(user.pk, user.last_login)
+    buffer.start()
+    if pending >= getattr(settings, 'ACTIVITY_BUFFER_MAX_USERS', 10000):
+        buffer.flush()
+
+
+def install():
+    user_logged_in.disconnect(update_last_login,
+                              dispatch_uid='update_last_login')
+    user_logged_in.connect(logged_in, dispatch_uid='buffered_last_login')
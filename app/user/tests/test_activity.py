@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from user import activity
+
+
+TOKEN_URL = reverse('user:token')
+
+
+def create_user(email='test@mail.com', password='pass123'):
+    return get_user_model().objects.create_user(email=email,
+                                                password=password)
+
+
+class ActivityBufferTests(TestCase):
+
+    def setUp(self):
+        self.buffer = activity.ActivityBuffer()
+        self.users = [create_user(f'user{i}@mail.com') for i in range(3)]
+
+    def test_add_keeps_latest_time(self):
+        now = timezone.now()
+        self.buffer.add(1, now)
+        self.buffer.add(1, now - timedelta(minutes=1))
+        self.buffer.add(1, now - timedelta(minutes=2))
+        self.buffer.add(2, now)
+
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer._pending[1], now)
+
+    def test_flush_writes_in_one_query(self):
+        now = timezone.now()
+        for minutes, user in enumerate(self.users):
+            self.buffer.add(user.pk, now - timedelta(minutes=minutes))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.buffer.flush(), 3)
+
+        self.assertEqual(len(self.buffer), 0)
+        for minutes, user in enumerate(self.users):
+            user.refresh_from_db()
+            self.assertEqual(user.last_login,
+                             now - timedelta(minutes=minutes))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.buffer.flush(), 0)
+
+    def test_stop_flushes_pending(self):
+        self.buffer.add(self.users[0].pk, timezone.now())
+
+        self.buffer.stop()
+
+        self.users[0].refresh_from_db()
+        self.assertIsNotNone(self.users[0].last_login)
+
+
+class BufferedLoginTests(TestCase):
+
+    def setUp(self):
+        activity.buffer.flush()
+        self.user = create_user()
+        self.client = APIClient()
+
+    def tearDown(self):
+        activity.buffer.flush()
+
+    def login(self):
+        return self.client.post(
+            TOKEN_URL, {'email': 'test@mail.com', 'password': 'pass123'}
+        )
+
+    @override_settings(ACTIVITY_FLUSH_SECONDS=3600)
+    def test_token_login_is_buffered(self):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.login()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE')])
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+        self.assertIn(self.user.pk, activity.buffer._pending)
+
+        activity.buffer.flush()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    @override_settings(ACTIVITY_FLUSH_SECONDS=3600,
+                       ACTIVITY_BUFFER_MAX_USERS=1)
+    def test_full_buffer_is_flushed(self):
+        self.login()
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(len(activity.buffer), 0)
+
+    @override_settings(ACTIVITY_FLUSH_SECONDS=0)
+    def test_write_through_when_disabled(self):
+        user_logged_in.send(sender=self.user.__class__, request=None,
+                            user=self.user)
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(len(activity.buffer), 0)
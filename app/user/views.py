@@ -1,6 +1,11 @@
-from rest_framework import generics, authentication, permissions
+from django.contrib.auth.signals import user_logged_in
+from rest_framework import generics, authentication, permissions, status
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from recipe import purge
+from recipe.serializers import PurgeJobSerializer
 from .serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -12,11 +17,29 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, _ = Token.objects.get_or_create(user=user)
+        # last_login is written behind by user.activity
+        user_logged_in.send(sender=user.__class__, request=request, user=user)
+        return Response({'token': token.key})
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = UserSerializer
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate now, the data is removed by ``process_purges``"""
+        job = purge.start_user_purge(self.get_object())
+        return Response(
+            PurgeJobSerializer(job).data, status=status.HTTP_202_ACCEPTED
+        )